@@ -8,8 +8,28 @@ import base64
 import os
 import json
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import cryptomessage_keyring
+import cryptomessage_paths
+
+CHUNK_SIZE = 1024 * 1024  # AES a blocchi: avanzamento visibile sui messaggi grandi
+POLL_MS = 50  # intervallo di controllo delle operazioni in background
+
+
+def _aes_cbc(cryptor, data, progress):
+    """Esegue cifratura o decifratura AES-CBC a blocchi, segnalando l'avanzamento"""
+    view = memoryview(data)
+    total = len(view)
+    out = bytearray()
+    for offset in range(0, total, CHUNK_SIZE):
+        out += cryptor.update(view[offset:offset + CHUNK_SIZE])
+        progress(min(offset + CHUNK_SIZE, total), total)
+    out += cryptor.finalize()
+    return bytes(out)
+
+
 class CryptoMessengerPro:
     def __init__(self, root):
         self.root = root
@@ -20,9 +40,21 @@ class CryptoMessengerPro:
         # Dati applicazione
         self.private_key = None
         self.public_key = None
-        self.contacts = {}  # Rubrica contatti
-        self.config_file = "cryptomessenger_config.json"
-        self.contacts_file = "cryptomessenger_contacts.json"
+        self.contacts = None  # Rubrica contatti (vedi load_contacts)
+        # Stessa cartella dati della CLI: chiavi, KDF e rubrica condivise
+        self.data_dir = cryptomessage_paths.data_dir()
+        self.config_file = os.path.join(self.data_dir, "cryptomessenger_config.json")
+        self.contacts_file = os.path.join(self.data_dir, "cryptomessenger_contacts.db")
+        self.legacy_contacts_file = os.path.join(self.data_dir, "cryptomessenger_contacts.json")
+        
+        # Operazioni lente (chiavi RSA, messaggi grandi) in un thread di lavoro:
+        # la finestra resta reattiva, i risultati tornano sul thread di Tk
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._busy = False
+        self._progress = None
+        self._crypto_buttons = []
+        
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         self.load_config()
         self.load_contacts()
@@ -63,6 +95,14 @@ class CryptoMessengerPro:
                             style='Subtitle.TLabel', background="#ffffff")
         subtitle.pack()
         
+        # Avanzamento delle operazioni in background (in basso, visibile solo durante il lavoro)
+        progress_frame = tk.Frame(self.root, bg="#f8f9fa")
+        progress_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=15, pady=(0, 8))
+        self.progress_label = ttk.Label(progress_frame, text="", background="#f8f9fa",
+                                        foreground="#6c757d", font=('Segoe UI', 9))
+        self.progress_label.pack(side=tk.LEFT)
+        self.progress_bar = ttk.Progressbar(progress_frame, mode='indeterminate', length=220)
+        
         # Container principale
         main_container = tk.Frame(self.root, bg="#f8f9fa")
         main_container.pack(fill=tk.BOTH, expand=True, padx=15, pady=10)
@@ -134,9 +174,11 @@ class CryptoMessengerPro:
                   command=self.add_contact_quick).pack(side=tk.LEFT)
         
         # Pulsante CRIPTA E COPIA - SPOSTATO IN ALTO PER MAGGIORE VISIBILITÀ
-        ttk.Button(encrypt_frame, text="🔒 CRIPTA E COPIA", 
-                  command=self.encrypt_message_enhanced,
-                  style='Accent.TButton').pack(pady=8, ipady=4)
+        encrypt_button = ttk.Button(encrypt_frame, text="🔒 CRIPTA E COPIA", 
+                                    command=self.encrypt_message_enhanced,
+                                    style='Accent.TButton')
+        encrypt_button.pack(pady=8, ipady=4)
+        self._crypto_buttons.append(encrypt_button)
         
         # Area messaggio
         tk.Label(encrypt_frame, text="Il tuo messaggio:", 
@@ -193,9 +235,11 @@ class CryptoMessengerPro:
         
         ttk.Button(buttons_frame, text="📋 Incolla dagli Appunti", 
                   command=self.paste_from_clipboard).pack(side=tk.LEFT, padx=(0, 8), ipady=2)
-        ttk.Button(buttons_frame, text="🔓 DECRIPTA", 
-                  command=self.decrypt_message_enhanced,
-                  style='Accent.TButton').pack(side=tk.LEFT, ipady=2)
+        decrypt_button = ttk.Button(buttons_frame, text="🔓 DECRIPTA", 
+                                    command=self.decrypt_message_enhanced,
+                                    style='Accent.TButton')
+        decrypt_button.pack(side=tk.LEFT, ipady=2)
+        self._crypto_buttons.append(decrypt_button)
         
         tk.Label(decrypt_frame, text="Messaggio decriptato:", 
                 bg="#f8f9fa", fg="#2c3e50", font=('Segoe UI', 10, 'bold')).pack(anchor=tk.W, pady=(15, 8))
@@ -212,6 +256,66 @@ class CryptoMessengerPro:
         
         self.update_status()
     
+    def on_close(self):
+        """Chiude la finestra senza attendere un'operazione in corso"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+    
+    def run_in_background(self, text, task, on_success, on_error=None):
+        """Esegue task in un thread di lavoro con indicatore di avanzamento
+        
+        task non deve toccare i widget: on_success/on_error vengono chiamate
+        sul thread di Tk tramite root.after.
+        """
+        if self._busy:
+            messagebox.showwarning("Attenzione", "Operazione in corso, attendi il termine.")
+            return
+        
+        self._busy = True
+        self._progress = None
+        self.progress_label.config(text=text)
+        self.progress_bar.config(mode='indeterminate', value=0)
+        self.progress_bar.pack(side=tk.RIGHT)
+        self.progress_bar.start(15)
+        for button in self._crypto_buttons:
+            button.state(['disabled'])
+        
+        future = self._executor.submit(task)
+        self.root.after(POLL_MS, self._poll_background, future, on_success, on_error)
+    
+    def _poll_background(self, future, on_success, on_error):
+        """Aggiorna l'avanzamento e, a lavoro finito, consegna il risultato"""
+        if not future.done():
+            progress = self._progress
+            if progress is not None:
+                if str(self.progress_bar.cget('mode')) != 'determinate':
+                    self.progress_bar.stop()
+                    self.progress_bar.config(mode='determinate', maximum=100)
+                self.progress_bar.config(value=progress * 100)
+            self.root.after(POLL_MS, self._poll_background, future, on_success, on_error)
+            return
+        
+        self.progress_bar.stop()
+        self.progress_bar.pack_forget()
+        self.progress_label.config(text="")
+        for button in self._crypto_buttons:
+            button.state(['!disabled'])
+        self._busy = False
+        
+        try:
+            result = future.result()
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            else:
+                messagebox.showerror("Errore", str(e))
+            return
+        on_success(result)
+    
+    def _report_progress(self, done, total):
+        """Chiamata dal thread di lavoro: salva solo la frazione completata"""
+        self._progress = done / total if total else None
+    
     def update_char_count(self, event=None):
         """Aggiorna contatore caratteri"""
         text = self.plain_text.get("1.0", tk.END).strip()
@@ -330,17 +434,24 @@ Scegli un'opzione:
             messagebox.showerror("Errore", "Le password non corrispondono!")
             return
         
-        try:
-            # Genera chiavi
-            self.private_key = rsa.generate_private_key(
+        def generate():
+            # Genera chiavi (nel thread di lavoro)
+            return rsa.generate_private_key(
                 public_exponent=65537,
                 key_size=2048,
                 backend=default_backend()
             )
-            self.public_key = self.private_key.public_key()
-            
-            # Salva chiavi
-            self.save_keys_with_password(password)
+        
+        def generated(private_key):
+            try:
+                self.private_key = private_key
+                self.public_key = private_key.public_key()
+                
+                # Salva chiavi
+                self.save_keys_with_password(password)
+            except Exception as e:
+                messagebox.showerror("Errore", f"Errore nella generazione:\n{str(e)}")
+                return
             self.update_status()
             
             messagebox.showinfo("✅ Successo!", 
@@ -355,8 +466,10 @@ Scegli un'opzione:
                                    "Vuoi esportare ora la tua chiave pubblica?"):
                 self.export_public_key()
         
-        except Exception as e:
-            messagebox.showerror("Errore", f"Errore nella generazione:\n{str(e)}")
+        self.run_in_background(
+            "🔑 Generazione delle chiavi...", generate, generated,
+            lambda e: messagebox.showerror("Errore", f"Errore nella generazione:\n{str(e)}")
+        )
     
     def save_keys_with_password(self, password):
         """Salva chiavi con cifratura"""
@@ -380,7 +493,9 @@ Scegli un'opzione:
                 'created': datetime.now().isoformat()
             }
             
-            with open(self.config_file, 'w') as f:
+            cryptomessage_paths.ensure_dir(self.data_dir)
+            fd = os.open(self.config_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
                 json.dump(config, f)
                 
         except Exception as e:
@@ -418,21 +533,58 @@ Scegli un'opzione:
             return False
         
         try:
-            with open(self.config_file, 'r') as f:
-                config = json.load(f)
-            
-            private_pem = base64.b64decode(config['private_key'])
-            self.private_key = serialization.load_pem_private_key(
-                private_pem,
-                password=password.encode(),
-                backend=default_backend()
-            )
+            self.private_key = self._read_private_key(password)
             return True
             
         except Exception as e:
             messagebox.showerror("Errore", "Password errata o chiave corrotta!")
             return False
     
+    def load_private_key_async(self, on_ready):
+        """Come load_private_key_with_password, ma sblocca la chiave in background"""
+        if self.private_key:
+            on_ready()
+            return
+        
+        if not os.path.exists(self.config_file):
+            messagebox.showwarning("Attenzione", "Nessun account configurato!")
+            return
+        
+        password = simpledialog.askstring("Password", 
+                                         "Inserisci la password del tuo account:", 
+                                         show='*')
+        if not password:
+            return
+        
+        def unlocked(private_key):
+            self.private_key = private_key
+            on_ready()
+        
+        self.run_in_background(
+            "🔐 Sblocco della chiave...", lambda: self._read_private_key(password), unlocked,
+            lambda e: messagebox.showerror("Errore", "Password errata o chiave corrotta!")
+        )
+    
+    def _read_private_key(self, password):
+        """Legge e decifra la chiave privata dalla configurazione"""
+        with open(self.config_file, 'r') as f:
+            config = json.load(f)
+        
+        if config.get('kdf'):
+            # Chiave ricifrata dalla CLI con KDF calibrata (comando kdf o setup --kdf):
+            # stesso file, la GUI usa la cartella dati della CLI
+            import cryptomessage_kdf
+            
+            private_der = cryptomessage_kdf.decrypt_private_key(config['private_key'], password.encode(), config['kdf'])
+            return serialization.load_der_private_key(private_der, password=None, backend=default_backend())
+        
+        private_pem = base64.b64decode(config['private_key'])
+        return serialization.load_pem_private_key(
+            private_pem,
+            password=password.encode(),
+            backend=default_backend()
+        )
+    
     def import_private_key(self):
         """Importa chiave privata esistente"""
         file_path = filedialog.askopenfilename(
@@ -693,8 +845,7 @@ Scegli quale chiave vuoi esportare:
             if selection:
                 name = contacts_list.get(selection[0]).replace("👤 ", "")
                 if messagebox.askyesno("Conferma", f"Eliminare {name}?"):
-                    del self.contacts[name]
-                    self.save_contacts()
+                    self.contacts.remove(name)
                     contacts_list.delete(selection[0])
                     self.update_recipient_list()
         
@@ -745,9 +896,8 @@ Scegli quale chiave vuoi esportare:
                 key_data, backend=default_backend()
             )
             
-            # Salva come base64
-            self.contacts[name] = base64.b64encode(key_data).decode()
-            self.save_contacts()
+            # Salva come base64 (una riga nella rubrica condivisa con la CLI)
+            self.contacts.add(name, base64.b64encode(key_data).decode(), public_key)
             self.update_recipient_list()
             
             fingerprint = self.get_key_fingerprint(self.contacts[name])
@@ -769,19 +919,10 @@ Scegli quale chiave vuoi esportare:
         # Formatta in blocchi di 4
         return ' '.join([fingerprint[i:i+4] for i in range(0, len(fingerprint), 4)])
     
-    def save_contacts(self):
-        """Salva rubrica"""
-        with open(self.contacts_file, 'w') as f:
-            json.dump(self.contacts, f)
-    
     def load_contacts(self):
-        """Carica rubrica"""
-        if os.path.exists(self.contacts_file):
-            try:
-                with open(self.contacts_file, 'r') as f:
-                    self.contacts = json.load(f)
-            except:
-                self.contacts = {}
+        """Carica rubrica (database SQLite della CLI; importa una volta il vecchio file JSON)"""
+        self.contacts = cryptomessage_keyring.SQLiteKeyring(self.contacts_file)
+        self.contacts.load(self.legacy_contacts_file)
     
     def update_recipient_list(self):
         """Aggiorna lista destinatari"""
@@ -820,183 +961,220 @@ Scegli quale chiave vuoi esportare:
             messagebox.showwarning("Attenzione", "Contatto non trovato!")
             return
         
+        if self.contacts.key_type(recipient) != 'rsa':
+            messagebox.showwarning("Attenzione", f"La chiave di {recipient} non è RSA: usa la CLI per questo contatto")
+            return
+        
         message = self.plain_text.get("1.0", tk.END).strip()
         if not message:
             messagebox.showwarning("Attenzione", "Scrivi un messaggio!")
             return
         
+        sign = self.sign_var.get()
+        recipient_key_b64 = self.contacts[recipient]
+        
+        def start():
+            private_key = self.private_key if sign else None
+            self.run_in_background(
+                f"🔒 Crittografia per {recipient}...",
+                lambda: self._encrypt_packet(recipient, recipient_key_b64, message, private_key),
+                lambda result: self._show_encrypted(recipient, *result),
+                lambda e: messagebox.showerror("Errore", f"Errore nella crittografia:\n{str(e)}")
+            )
+        
         # Carica chiave privata se serve firmare
-        if self.sign_var.get():
-            if not self.load_private_key_with_password():
-                return
+        if sign:
+            self.load_private_key_async(start)
+        else:
+            start()
+    
+    def _encrypt_packet(self, recipient, recipient_key_b64, message, private_key):
+        """Crea il pacchetto criptato (nel thread di lavoro), restituisce (testo, firmato)"""
+        # Carica chiave pubblica destinatario
+        recipient_key_pem = base64.b64decode(recipient_key_b64)
+        recipient_key = serialization.load_pem_public_key(
+            recipient_key_pem, backend=default_backend()
+        )
         
-        try:
-            # Carica chiave pubblica destinatario
-            recipient_key_pem = base64.b64decode(self.contacts[recipient])
-            recipient_key = serialization.load_pem_public_key(
-                recipient_key_pem, backend=default_backend()
+        # Genera chiave AES casuale
+        aes_key = os.urandom(32)  # 256 bit
+        iv = os.urandom(16)
+        
+        # Cripta messaggio con AES
+        cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv), backend=default_backend())
+        encryptor = cipher.encryptor()
+        
+        # Padding del messaggio
+        message_bytes = message.encode('utf-8')
+        padding_length = 16 - (len(message_bytes) % 16)
+        padded_message = message_bytes + bytes([padding_length] * padding_length)
+        
+        encrypted_message = _aes_cbc(encryptor, padded_message, self._report_progress)
+        
+        # Cripta chiave AES con RSA
+        encrypted_aes_key = recipient_key.encrypt(
+            aes_key,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
             )
-            
-            # Genera chiave AES casuale
-            aes_key = os.urandom(32)  # 256 bit
-            iv = os.urandom(16)
-            
-            # Cripta messaggio con AES
-            cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv), backend=default_backend())
-            encryptor = cipher.encryptor()
-            
-            # Padding del messaggio
-            message_bytes = message.encode('utf-8')
-            padding_length = 16 - (len(message_bytes) % 16)
-            padded_message = message_bytes + bytes([padding_length] * padding_length)
-            
-            encrypted_message = encryptor.update(padded_message) + encryptor.finalize()
-            
-            # Cripta chiave AES con RSA
-            encrypted_aes_key = recipient_key.encrypt(
-                aes_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
+        )
+        
+        # Firma (opzionale)
+        signature = b""
+        if private_key:
+            signature = private_key.sign(
+                encrypted_message,
+                padding.PSS(
+                    mgf=padding.MGF1(hashes.SHA256()),
+                    salt_length=padding.PSS.MAX_LENGTH
+                ),
+                hashes.SHA256()
             )
-            
-            # Firma (opzionale)
-            signature = b""
-            if self.sign_var.get() and self.private_key:
-                signature = self.private_key.sign(
-                    encrypted_message,
-                    padding.PSS(
-                        mgf=padding.MGF1(hashes.SHA256()),
-                        salt_length=padding.PSS.MAX_LENGTH
-                    ),
-                    hashes.SHA256()
-                )
-            
-            # Crea pacchetto finale
-            packet = {
-                'version': '2.0',
-                'aes_key': base64.b64encode(encrypted_aes_key).decode(),
-                'iv': base64.b64encode(iv).decode(),
-                'data': base64.b64encode(encrypted_message).decode(),
-                'signature': base64.b64encode(signature).decode() if signature else "",
-                'timestamp': datetime.now().isoformat(),
-                'to': recipient
-            }
-            
-            encrypted_text = base64.b64encode(json.dumps(packet).encode()).decode()
-            
-            self.encrypted_text.delete("1.0", tk.END)
-            self.encrypted_text.insert("1.0", encrypted_text)
-            
-            # Copia automaticamente
-            self.root.clipboard_clear()
-            self.root.clipboard_append(encrypted_text)
-            
-            messagebox.showinfo("✅ Successo!", 
-                              f"Messaggio criptato per {recipient}!\n\n"
-                              f"✓ Il messaggio è stato copiato negli appunti\n"
-                              f"✓ Lunghezza: {len(encrypted_text)} caratteri\n"
-                              f"{'✓ Firmato digitalmente' if signature else ''}\n\n"
-                              f"Ora puoi incollarlo su WhatsApp, Telegram, email, ecc.")
         
-        except Exception as e:
-            messagebox.showerror("Errore", f"Errore nella crittografia:\n{str(e)}")
+        # Crea pacchetto finale
+        packet = {
+            'version': '2.0',
+            'aes_key': base64.b64encode(encrypted_aes_key).decode(),
+            'iv': base64.b64encode(iv).decode(),
+            'data': base64.b64encode(encrypted_message).decode(),
+            'signature': base64.b64encode(signature).decode() if signature else "",
+            'timestamp': datetime.now().isoformat(),
+            'to': recipient
+        }
+        
+        return base64.b64encode(json.dumps(packet).encode()).decode(), bool(signature)
+    
+    def _show_encrypted(self, recipient, encrypted_text, signed):
+        """Mostra e copia il messaggio criptato"""
+        self.encrypted_text.delete("1.0", tk.END)
+        self.encrypted_text.insert("1.0", encrypted_text)
+        
+        # Copia automaticamente
+        self.root.clipboard_clear()
+        self.root.clipboard_append(encrypted_text)
+        
+        messagebox.showinfo("✅ Successo!", 
+                          f"Messaggio criptato per {recipient}!\n\n"
+                          f"✓ Il messaggio è stato copiato negli appunti\n"
+                          f"✓ Lunghezza: {len(encrypted_text)} caratteri\n"
+                          f"{'✓ Firmato digitalmente' if signed else ''}\n\n"
+                          f"Ora puoi incollarlo su WhatsApp, Telegram, email, ecc.")
     
     def decrypt_message_enhanced(self):
         """Decrittografia ibrida con verifica firma"""
-        if not self.load_private_key_with_password():
-            return
-        
         encrypted_text = self.encrypted_input.get("1.0", tk.END).strip()
         if not encrypted_text:
             messagebox.showwarning("Attenzione", "Incolla il messaggio ricevuto!")
             return
         
-        try:
-            # Decodifica pacchetto
-            packet_json = base64.b64decode(encrypted_text).decode()
-            packet = json.loads(packet_json)
-            
-            # Estrae componenti
-            encrypted_aes_key = base64.b64decode(packet['aes_key'])
-            iv = base64.b64decode(packet['iv'])
-            encrypted_message = base64.b64decode(packet['data'])
-            signature = base64.b64decode(packet['signature']) if packet.get('signature') else None
-            timestamp = packet.get('timestamp', 'Sconosciuto')
-            sender = packet.get('to', 'Sconosciuto')
-            
-            # Decripta chiave AES con RSA
-            aes_key = self.private_key.decrypt(
-                encrypted_aes_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
+        def start():
+            private_key = self.private_key
+            contacts = self.contacts
+            self.run_in_background(
+                "🔓 Decrittografia...",
+                lambda: self._decrypt_packet(encrypted_text, private_key, contacts),
+                self._show_decrypted,
+                self._show_decrypt_error
             )
-            
-            # Decripta messaggio con AES
-            cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv), backend=default_backend())
-            decryptor = cipher.decryptor()
-            padded_message = decryptor.update(encrypted_message) + decryptor.finalize()
-            
-            # Rimuovi padding
-            padding_length = padded_message[-1]
-            message = padded_message[:-padding_length].decode('utf-8')
-            
-            # Verifica firma se presente
-            signature_valid = False
-            if signature and sender in self.contacts:
-                try:
-                    sender_key_pem = base64.b64decode(self.contacts[sender])
-                    sender_key = serialization.load_pem_public_key(
-                        sender_key_pem, backend=default_backend()
-                    )
-                    
-                    sender_key.verify(
-                        signature,
-                        encrypted_message,
-                        padding.PSS(
-                            mgf=padding.MGF1(hashes.SHA256()),
-                            salt_length=padding.PSS.MAX_LENGTH
-                        ),
-                        hashes.SHA256()
-                    )
-                    signature_valid = True
-                except:
-                    signature_valid = False
-            
-            # Mostra messaggio
-            self.decrypted_text.delete("1.0", tk.END)
-            self.decrypted_text.insert("1.0", message)
-            
-            # Info aggiuntive
-            info_text = f"📅 Inviato: {timestamp}\n"
-            if signature:
-                if signature_valid:
-                    info_text += f"✅ Firma verificata da: {sender}"
-                else:
-                    info_text += f"⚠️ Firma non verificata (mittente sconosciuto o firma invalida)"
-            
-            self.decrypt_info.config(text=info_text)
-            
-            messagebox.showinfo("✅ Decriptato!", 
-                              f"Messaggio decriptato con successo!\n\n{info_text}")
         
-        except json.JSONDecodeError:
+        self.load_private_key_async(start)
+    
+    def _decrypt_packet(self, encrypted_text, private_key, contacts):
+        """Decripta il pacchetto e verifica la firma (nel thread di lavoro)"""
+        # Decodifica pacchetto
+        packet_json = base64.b64decode(encrypted_text).decode()
+        packet = json.loads(packet_json)
+        
+        # Estrae componenti
+        encrypted_aes_key = base64.b64decode(packet['aes_key'])
+        iv = base64.b64decode(packet['iv'])
+        encrypted_message = base64.b64decode(packet['data'])
+        signature = base64.b64decode(packet['signature']) if packet.get('signature') else None
+        timestamp = packet.get('timestamp', 'Sconosciuto')
+        sender = packet.get('to', 'Sconosciuto')
+        
+        # Decripta chiave AES con RSA
+        aes_key = private_key.decrypt(
+            encrypted_aes_key,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
+        )
+        
+        # Decripta messaggio con AES
+        cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv), backend=default_backend())
+        decryptor = cipher.decryptor()
+        padded_message = _aes_cbc(decryptor, encrypted_message, self._report_progress)
+        
+        # Rimuovi padding
+        padding_length = padded_message[-1]
+        message = padded_message[:-padding_length].decode('utf-8')
+        
+        # Verifica firma se presente
+        signature_valid = False
+        if signature and sender in contacts:
+            try:
+                sender_key_pem = base64.b64decode(contacts[sender])
+                sender_key = serialization.load_pem_public_key(
+                    sender_key_pem, backend=default_backend()
+                )
+                
+                sender_key.verify(
+                    signature,
+                    encrypted_message,
+                    padding.PSS(
+                        mgf=padding.MGF1(hashes.SHA256()),
+                        salt_length=padding.PSS.MAX_LENGTH
+                    ),
+                    hashes.SHA256()
+                )
+                signature_valid = True
+            except:
+                signature_valid = False
+        
+        return {
+            'message': message,
+            'timestamp': timestamp,
+            'sender': sender,
+            'signed': bool(signature),
+            'signature_valid': signature_valid,
+        }
+    
+    def _show_decrypted(self, result):
+        """Mostra il messaggio decriptato"""
+        self.decrypted_text.delete("1.0", tk.END)
+        self.decrypted_text.insert("1.0", result['message'])
+        
+        # Info aggiuntive
+        info_text = f"📅 Inviato: {result['timestamp']}\n"
+        if result['signed']:
+            if result['signature_valid']:
+                info_text += f"✅ Firma verificata da: {result['sender']}"
+            else:
+                info_text += f"⚠️ Firma non verificata (mittente sconosciuto o firma invalida)"
+        
+        self.decrypt_info.config(text=info_text)
+        
+        messagebox.showinfo("✅ Decriptato!", 
+                          f"Messaggio decriptato con successo!\n\n{info_text}")
+    
+    def _show_decrypt_error(self, e):
+        if isinstance(e, json.JSONDecodeError):
             messagebox.showerror("Errore", 
                                "Formato messaggio non valido.\n"
                                "Assicurati di aver copiato tutto il testo criptato.")
-        except Exception as e:
-            messagebox.showerror("Errore", 
-                               f"Impossibile decrittare il messaggio.\n\n"
-                               f"Possibili cause:\n"
-                               f"• Il messaggio non era destinato a te\n"
-                               f"• Il messaggio è corrotto\n"
-                               f"• Formato non compatibile\n\n"
-                               f"Dettagli: {str(e)}")
+            return
+        messagebox.showerror("Errore", 
+                           f"Impossibile decrittare il messaggio.\n\n"
+                           f"Possibili cause:\n"
+                           f"• Il messaggio non era destinato a te\n"
+                           f"• Il messaggio è corrotto\n"
+                           f"• Formato non compatibile\n\n"
+                           f"Dettagli: {str(e)}")
     
     def paste_from_clipboard(self):
         """Incolla dagli appunti"""
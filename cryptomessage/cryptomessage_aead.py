@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger AEAD - Cifrari autenticati per i pacchetti messaggio
+AES-256-GCM e ChaCha20-Poly1305 cifrano e autenticano in un solo passaggio:
+niente padding e un messaggio alterato viene rifiutato anche senza firma.
+Il cifrario usato è scritto nel pacchetto (byte cifrario del v3).
+
+Quale dei due usare lo decide un micro-benchmark eseguito una volta per
+macchina: con le istruzioni AES del processore (AES-NI, ARMv8 Crypto)
+AES-GCM è nettamente più veloce, senza lo è ChaCha20-Poly1305.
+Il risultato resta in cache nella cartella dati:
+    cryptomessenger_cipher.json
+    {"cipher": "AES-256-GCM", "machine": "<host/arch/OpenSSL>",
+     "mb_s": {"AES-256-GCM": 3100.5, "ChaCha20-Poly1305": 1450.2}, "measured": "<iso>"}
+e viene rifatto se la cartella dati passa su un'altra macchina o cambia OpenSSL.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+AES_GCM = 'AES-256-GCM'
+CHACHA20 = 'ChaCha20-Poly1305'
+CIPHERS = (AES_GCM, CHACHA20)
+# Nomi brevi per la riga di comando
+NAMES = {'aes-gcm': AES_GCM, 'chacha20': CHACHA20}
+
+KEY_SIZE = 32
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+BENCH_SIZE = 64 * 1024
+BENCH_SECONDS = 0.02
+
+
+def _aead(cipher, key):
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+
+    if cipher == AES_GCM:
+        return AESGCM(key)
+    if cipher == CHACHA20:
+        return ChaCha20Poly1305(key)
+    raise ValueError(f"Cifrario non supportato: {cipher}")
+
+
+def encrypt(cipher, key, plaintext, associated_data=None):
+    """Cifra e autentica, restituisce (nonce, ciphertext con tag in coda)"""
+    aead = _aead(cipher, key)
+    nonce = os.urandom(NONCE_SIZE)
+    if not hasattr(aead, 'encrypt_into'):
+        return nonce, aead.encrypt(nonce, bytes(plaintext), associated_data)
+    # Un solo buffer di uscita, nessuna copia del messaggio (cryptography >= 45)
+    ciphertext = bytearray(len(plaintext) + TAG_SIZE)
+    aead.encrypt_into(nonce, plaintext, associated_data, ciphertext)
+    return nonce, ciphertext
+
+
+def decrypt(cipher, key, nonce, ciphertext, associated_data=None):
+    """Verifica il tag e decifra (InvalidTag se il messaggio è alterato)"""
+    aead = _aead(cipher, key)
+    if not hasattr(aead, 'decrypt_into'):
+        return aead.decrypt(bytes(nonce), bytes(ciphertext), associated_data)
+    if len(ciphertext) < TAG_SIZE:
+        raise ValueError("Ciphertext troppo corto")
+    plaintext = bytearray(len(ciphertext) - TAG_SIZE)
+    aead.decrypt_into(bytes(nonce), ciphertext, associated_data, plaintext)
+    return plaintext
+
+
+def machine_id():
+    """Macchina e libreria su cui vale la misura"""
+    import platform
+
+    from cryptography.hazmat.backends.openssl import backend
+
+    return f"{platform.node()}/{platform.machine()}/{backend.openssl_version_text()}"
+
+
+def benchmark(size=BENCH_SIZE, seconds=BENCH_SECONDS):
+    """MB/s di cifratura per ogni cifrario (il migliore di tre misure da seconds secondi)"""
+    data = os.urandom(size)
+    key = os.urandom(KEY_SIZE)
+    results = {}
+    for cipher in CIPHERS:
+        best = 0
+        for _ in range(3):
+            rounds = 0
+            start = time.perf_counter()
+            while True:
+                encrypt(cipher, key, data)
+                rounds += 1
+                elapsed = time.perf_counter() - start
+                if elapsed >= seconds:
+                    break
+            best = max(best, rounds * size / elapsed / 1e6)
+        results[cipher] = round(best, 1)
+    return results
+
+
+def load_choice(path):
+    """Scelta in cache se misurata su questa macchina, altrimenti None"""
+    try:
+        with open(path, 'r') as f:
+            choice = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(choice, dict) or choice.get('cipher') not in CIPHERS or choice.get('machine') != machine_id():
+        return None
+    return choice
+
+
+def measure_choice(path):
+    """Esegue il benchmark, salva e restituisce la scelta (il cifrario più veloce)"""
+    results = benchmark()
+    choice = {
+        'cipher': max(results, key=results.get),
+        'machine': machine_id(),
+        'mb_s': results,
+        'measured': datetime.now().isoformat(timespec='seconds'),
+    }
+    # Cache non essenziale: se la cartella non è scrivibile si misura di nuovo la prossima volta
+    try:
+        temporary = path + ".tmp"
+        with open(temporary, 'w') as f:
+            json.dump(choice, f)
+        os.replace(temporary, path)
+    except OSError:
+        pass
+    return choice
+
+
+def describe(choice):
+    """Descrizione leggibile della scelta e delle misure"""
+    rates = ", ".join(f"{cipher} {rate:.0f} MB/s" for cipher, rate in choice['mb_s'].items())
+    return f"{choice['cipher']} ({rates}; misurato il {choice['measured'][:10]})"
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Agent - Chiave privata sbloccata una volta per sessione
+Stile ssh-agent: tiene la chiave in memoria dietro un socket Unix ed esegue
+firme e decifrature per conto della CLI
+
+Protocollo: una richiesta JSON per riga, una risposta JSON per riga.
+    {"op": "ping"}                     -> {"ok": true, "key_id": "..."}
+    {"op": "public_key"}               -> {"ok": true, "public_key": "<b64 PEM>"}
+    {"op": "decrypt", "data": "<b64>"} -> {"ok": true, "data": "<b64>"}   (RSA-OAEP SHA-256 o X25519)
+    {"op": "sign", "data": "<b64>"}    -> {"ok": true, "data": "<b64>"}   (RSA-PSS SHA-256 o Ed25519)
+    {"op": "sign_digest", "data": "<b64>"} -> {"ok": true, "data": "<b64>"} (firma di un digest SHA-256,
+                                                                         vedi cryptomessage_keys.sign_digest)
+    {"op": "derive", "info": "..."}    -> {"ok": true, "data": "<b64>"}   (chiave locale, vedi derive_key;
+                                                                         solo le etichette di DERIVE_LABELS)
+    {"op": "stop"}                     -> {"ok": true}
+"""
+
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+import time
+
+DEFAULT_TIMEOUT = 15 * 60  # secondi di inattività prima dello spegnimento
+
+# Unici usi delle chiavi locali: l'agent non deriva chiavi per etichette arbitrarie
+DERIVE_LABELS = frozenset({
+    "sessions",
+    "archive",
+    "archive-search",
+    "decrypt-cache",
+    "decrypt-cache-index",
+})
+
+
+def socket_dir():
+    """Cartella privata dei socket: $XDG_RUNTIME_DIR/cryptomessenger o /tmp/cryptomessenger-<uid>"""
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime and os.path.isabs(runtime):
+        return os.path.join(runtime, "cryptomessenger")
+    uid = os.getuid() if hasattr(os, "getuid") else "user"
+    return os.path.join(tempfile.gettempdir(), f"cryptomessenger-{uid}")
+
+
+def default_socket_path():
+    """Percorso del socket (variabile CRYPTOMESSENGER_AGENT_SOCK o cartella privata, vedi socket_dir)"""
+    path = os.environ.get("CRYPTOMESSENGER_AGENT_SOCK")
+    if path:
+        return path
+    return os.path.join(socket_dir(), "agent.sock")
+
+
+def check_private_dir(directory):
+    """Solleva PermissionError se la cartella del socket non è privata
+
+    Il percorso di default è prevedibile: un altro utente potrebbe crearlo
+    per primo e intercettare le richieste. La cartella deve essere una vera
+    cartella (non un link simbolico), dell'utente corrente e con permessi 0700.
+    """
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{directory} non è una cartella (link simbolico?)")
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} appartiene a un altro utente")
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        raise PermissionError(f"{directory} ha permessi {stat.S_IMODE(info.st_mode):o} invece di 700")
+
+
+def private_dir(socket_path):
+    """Crea (se manca) e verifica la cartella che conterrà il socket"""
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    try:
+        os.makedirs(directory, mode=0o700)
+    except FileExistsError:
+        pass
+    check_private_dir(directory)
+    return directory
+
+
+def is_supported():
+    """I socket Unix non sono disponibili su tutte le piattaforme"""
+    return hasattr(socket, "AF_UNIX")
+
+
+def peer_uid(conn):
+    """Utente del processo all'altro capo del socket, o None se non verificabile"""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid
+
+
+def peer_allowed(conn):
+    """Accetta solo processi dello stesso utente (dove verificabile)"""
+    uid = peer_uid(conn)
+    return uid is None or uid == os.getuid()
+
+
+def open_socket(socket_path):
+    """Collega un client al socket dopo aver verificato cartella e utente del server"""
+    check_private_dir(os.path.dirname(os.path.abspath(socket_path)))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        if not peer_allowed(sock):
+            raise PermissionError(f"{socket_path} è servito da un altro utente")
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+# Import di cryptography differiti: collegarsi all'agente non li richiede
+
+def _oaep():
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    return padding.OAEP(
+        mgf=padding.MGF1(algorithm=hashes.SHA256()),
+        algorithm=hashes.SHA256(),
+        label=None
+    )
+
+
+def _pss():
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    return padding.PSS(
+        mgf=padding.MGF1(hashes.SHA256()),
+        salt_length=padding.PSS.MAX_LENGTH
+    )
+
+
+def derive_key(private_key, info):
+    """Chiave simmetrica locale derivata dalla chiave privata (HKDF-SHA256)
+
+    Serve a cifrare dati locali (sessioni, archivio, cache) senza chiedere
+    altre password: chi ha la chiave privata sbloccata può rigenerarla.
+    Sono ammesse solo le etichette di DERIVE_LABELS.
+    """
+    if info not in DERIVE_LABELS:
+        raise ValueError(f"etichetta di derivazione non ammessa: {info!r}")
+
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    private_der = private_key.private_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"cryptomessenger/" + info.encode()
+    ).derive(private_der)
+
+
+class _AgentHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        agent = self.server.agent
+        if not agent.peer_allowed(self.request):
+            return
+
+        for line in self.rfile:
+            agent.touch()
+            try:
+                request = json.loads(line)
+                response = agent.dispatch(request)
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+            if not agent.running:
+                return
+
+
+class _AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class KeyAgent:
+    """Server che custodisce la chiave privata sbloccata"""
+
+    def __init__(self, private_key, socket_path=None, timeout=DEFAULT_TIMEOUT):
+        self.private_key = private_key
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        self.running = False
+        self.last_activity = time.monotonic()
+
+        from cryptography.hazmat.primitives import serialization
+
+        public_pem = private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        self.public_pem = public_pem
+        self.key_id = hashlib.sha256(public_pem).hexdigest()[:16]
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def peer_allowed(self, conn):
+        return peer_allowed(conn)
+
+    def dispatch(self, request):
+        """Esegue una singola operazione"""
+        op = request.get('op')
+        if op == 'ping':
+            return {'ok': True, 'key_id': self.key_id}
+        if op == 'public_key':
+            return {'ok': True, 'public_key': base64.b64encode(self.public_pem).decode()}
+        if op == 'decrypt':
+            data = self.private_key.decrypt(base64.b64decode(request['data']), _oaep())
+            return {'ok': True, 'data': base64.b64encode(data).decode()}
+        if op == 'sign':
+            from cryptography.hazmat.primitives import hashes
+
+            data = self.private_key.sign(base64.b64decode(request['data']), _pss(), hashes.SHA256())
+            return {'ok': True, 'data': base64.b64encode(data).decode()}
+        if op == 'sign_digest':
+            import cryptomessage_keys
+
+            data = cryptomessage_keys.sign_digest(self.private_key, base64.b64decode(request['data']))
+            return {'ok': True, 'data': base64.b64encode(data).decode()}
+        if op == 'derive':
+            data = derive_key(self.private_key, request['info'])
+            return {'ok': True, 'data': base64.b64encode(data).decode()}
+        if op == 'stop':
+            self.running = False
+            return {'ok': True}
+        return {'ok': False, 'error': f"operazione sconosciuta: {op}"}
+
+    def serve(self, ready=None):
+        """Resta in ascolto finché non scade il timeout di inattività o arriva 'stop'"""
+        private_dir(self.socket_path)
+        if os.path.lexists(self.socket_path):
+            os.remove(self.socket_path)
+
+        old_umask = os.umask(0o177)
+        try:
+            server = _AgentServer(self.socket_path, _AgentHandler)
+        finally:
+            os.umask(old_umask)
+        server.agent = self
+        server.timeout = 1
+
+        self.running = True
+        self.touch()
+        if ready is not None:
+            ready()
+        try:
+            while self.running:
+                server.handle_request()
+                if self.timeout and time.monotonic() - self.last_activity > self.timeout:
+                    self.running = False
+        finally:
+            server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class AgentPrivateKey:
+    """Chiave privata remota: stessa interfaccia di decrypt/sign di una chiave RSA
+
+    Gli argomenti di padding vengono ignorati: l'agente usa sempre OAEP e PSS
+    con SHA-256 (o X25519 ed Ed25519), gli unici schemi usati da CryptoMessenger.
+    """
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or default_socket_path()
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+        self._public_key = None
+
+    def _call(self, request):
+        with self._lock:
+            if self._sock is None:
+                self._sock = open_socket(self.socket_path)
+                self._file = self._sock.makefile('rwb')
+            self._file.write(json.dumps(request).encode() + b"\n")
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError("Agente non raggiungibile")
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise ValueError(response.get('error', 'errore dell\'agente'))
+        return response
+
+    def ping(self):
+        return self._call({'op': 'ping'})['key_id']
+
+    def decrypt(self, ciphertext, padding=None):
+        response = self._call({'op': 'decrypt', 'data': base64.b64encode(ciphertext).decode()})
+        return base64.b64decode(response['data'])
+
+    def sign(self, data, padding=None, algorithm=None):
+        response = self._call({'op': 'sign', 'data': base64.b64encode(data).decode()})
+        return base64.b64decode(response['data'])
+
+    def sign_digest(self, digest):
+        """Firma di un digest: all'agente arrivano solo 32 byte, non i dati"""
+        response = self._call({'op': 'sign_digest', 'data': base64.b64encode(digest).decode()})
+        return base64.b64decode(response['data'])
+
+    def derive(self, info):
+        response = self._call({'op': 'derive', 'info': info})
+        return base64.b64decode(response['data'])
+
+    def public_key(self):
+        if self._public_key is None:
+            import cryptomessage_keys
+
+            response = self._call({'op': 'public_key'})
+            self._public_key = cryptomessage_keys.load_pem_public_key(base64.b64decode(response['public_key']))
+        return self._public_key
+
+    def stop(self):
+        self._call({'op': 'stop'})
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._file.close()
+                self._sock.close()
+                self._sock = None
+                self._file = None
+
+
+@contextlib.contextmanager
+def temporary_agent(private_key):
+    """Agente in un thread per la durata del blocco, su un socket in una cartella mkdtemp
+
+    Restituisce il percorso del socket: i processi figli usano la chiave
+    tramite AgentPrivateKey senza che la chiave lasci questo processo.
+    """
+    directory = tempfile.mkdtemp(prefix="cryptomessenger-")
+    socket_path = os.path.join(directory, "agent.sock")
+    agent = KeyAgent(private_key, socket_path, timeout=0)
+    ready = threading.Event()
+    thread = threading.Thread(target=agent.serve, args=(ready.set,), daemon=True)
+    thread.start()
+    try:
+        while not ready.wait(0.05):
+            if not thread.is_alive():
+                raise ConnectionError("Agente temporaneo non avviato")
+        yield socket_path
+    finally:
+        if thread.is_alive():
+            AgentPrivateKey(socket_path).stop()
+            thread.join()
+        os.rmdir(directory)
+
+
+def connect(socket_path=None):
+    """Restituisce un AgentPrivateKey se un agente è attivo, altrimenti None"""
+    if not is_supported():
+        return None
+    path = socket_path or default_socket_path()
+    if not os.path.exists(path):
+        return None
+    agent_key = AgentPrivateKey(path)
+    try:
+        agent_key.ping()
+    except (OSError, ValueError):
+        agent_key.close()
+        return None
+    return agent_key
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Archive - Archivio locale dei messaggi inviati e ricevuti
+
+Due file:
+    archivio (append-only)  MAGIC | record...
+                            record = u32 len | nonce (12) | AES-256-GCM(JSON del messaggio)
+                            con dati associati MAGIC | offset del record
+    indice (SQLite)         direzione, data, contatti e hash del pacchetto in chiaro,
+                            più un token cieco per ogni parola del testo
+
+I token sono HMAC-SHA256 delle parole con una chiave separata: la ricerca
+trova i record senza decifrare l'archivio e l'indice non rivela il testo.
+Solo i record trovati vengono letti e decifrati.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import re
+import struct
+
+MAGIC = b"CMA1"
+NONCE_SIZE = 12
+TOKEN_SIZE = 16
+MIN_WORD = 2
+
+DIRECTIONS = ('in', 'out')
+
+_LEN = struct.Struct(">I")
+_OFFSET = struct.Struct(">Q")
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def packet_hash(packet):
+    """Identificativo del pacchetto, uguale in ogni formato (v2, v3, armato o no)"""
+    digest = hashlib.sha256(packet['iv'])
+    digest.update(packet['data'])
+    return digest.hexdigest()
+
+
+def words(text):
+    """Parole indicizzabili del testo (minuscole, senza duplicati)"""
+    return {w for w in _WORD.findall(text.lower()) if len(w) >= MIN_WORD}
+
+
+class MessageArchive:
+    """Archivio cifrato con indice per data, contatto, hash e parole"""
+
+    def __init__(self, path, index_path, key, search_key):
+        self.path = path
+        self.index_path = index_path
+        self.key = key
+        self.search_key = search_key
+        self._db = None
+
+    def open(self):
+        import sqlite3
+
+        # Indice leggibile solo dall'utente: contiene date e nomi dei contatti
+        if not os.path.exists(self.index_path):
+            os.close(os.open(self.index_path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self._db = sqlite3.connect(self.index_path)
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS records (
+                    id INTEGER PRIMARY KEY,
+                    direction TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    packet_hash TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    UNIQUE (packet_hash, direction)
+                );
+                CREATE INDEX IF NOT EXISTS records_timestamp ON records (timestamp);
+                CREATE TABLE IF NOT EXISTS record_contacts (record_id INTEGER NOT NULL, contact TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS record_contacts_contact ON record_contacts (contact, record_id);
+                CREATE TABLE IF NOT EXISTS terms (token BLOB NOT NULL, record_id INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS terms_token ON terms (token, record_id);
+            """)
+        return self
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def token(self, word):
+        """Token cieco di una parola"""
+        return hmac.new(self.search_key, word.encode(), hashlib.sha256).digest()[:TOKEN_SIZE]
+
+    def _aad(self, offset):
+        return MAGIC + _OFFSET.pack(offset)
+
+    def add(self, direction, contacts, timestamp, message, packet_id, signature_valid=None):
+        """Archivia un messaggio; False se era già presente"""
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Direzione non valida: {direction}")
+        exists = self._db.execute(
+            "SELECT 1 FROM records WHERE packet_hash = ? AND direction = ?", (packet_id, direction)
+        ).fetchone()
+        if exists:
+            return False
+
+        record = json.dumps({
+            'direction': direction,
+            'contacts': contacts,
+            'timestamp': timestamp,
+            'message': message,
+            'signature_valid': signature_valid,
+            'packet_hash': packet_id,
+        }).encode()
+
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with os.fdopen(fd, 'ab') as f:
+            if f.tell() == 0:
+                f.write(MAGIC)
+            offset = f.tell()
+            nonce = os.urandom(NONCE_SIZE)
+            ciphertext = AESGCM(self.key).encrypt(nonce, record, self._aad(offset))
+            f.write(_LEN.pack(len(ciphertext)) + nonce + ciphertext)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._db:
+            cursor = self._db.execute(
+                "INSERT INTO records (direction, timestamp, packet_hash, offset, length) VALUES (?, ?, ?, ?, ?)",
+                (direction, timestamp, packet_id, offset, len(ciphertext))
+            )
+            record_id = cursor.lastrowid
+            self._db.executemany(
+                "INSERT INTO record_contacts (record_id, contact) VALUES (?, ?)",
+                [(record_id, contact) for contact in dict.fromkeys(contacts)]
+            )
+            self._db.executemany(
+                "INSERT INTO terms (token, record_id) VALUES (?, ?)",
+                [(self.token(word), record_id) for word in words(message)]
+            )
+        return True
+
+    def query(self, direction=None, contact=None, since=None, until=None, search=None, limit=None):
+        """Record più recenti che soddisfano i filtri (in ordine cronologico)"""
+        conditions = []
+        params = []
+        if direction:
+            conditions.append("direction = ?")
+            params.append(direction)
+        if contact:
+            conditions.append("id IN (SELECT record_id FROM record_contacts WHERE contact = ?)")
+            params.append(contact)
+        if since:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            conditions.append("timestamp < ?")
+            params.append(until)
+        if search:
+            search_words = words(search)
+            if not search_words:
+                return []
+            # Tutte le parole devono comparire nel messaggio
+            for word in search_words:
+                conditions.append("id IN (SELECT record_id FROM terms WHERE token = ?)")
+                params.append(self.token(word))
+
+        sql = "SELECT offset, length FROM records"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY timestamp DESC, id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        rows = self._db.execute(sql, params).fetchall()
+        return [self.read(offset, length) for offset, length in reversed(rows)]
+
+    def read(self, offset, length):
+        """Legge e decifra un solo record"""
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(_LEN.size + NONCE_SIZE + length)
+        if len(data) != _LEN.size + NONCE_SIZE + length or _LEN.unpack(data[:_LEN.size])[0] != length:
+            raise ValueError("Archivio danneggiato")
+        nonce = data[_LEN.size:_LEN.size + NONCE_SIZE]
+        plaintext = AESGCM(self.key).decrypt(nonce, data[_LEN.size + NONCE_SIZE:], self._aad(offset))
+        return json.loads(plaintext)
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
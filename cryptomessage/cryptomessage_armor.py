@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Armor - Armatura ASCII in flusso per stdin/stdout
+Il formato a blocchi di cryptomessage_stream, codificato in base64 a righe
+mentre viene scritto e decodificato mentre viene letto: memoria costante,
+qualunque sia la lunghezza del messaggio (niente stringa unica, niente argv).
+
+    -----BEGIN CRYPTOMESSENGER STREAM-----
+    <base64, righe da 76 caratteri>
+    =<CRC-32 dei dati, 8 cifre hex>
+    -----END CRYPTOMESSENGER STREAM-----
+
+Il CRC rileva subito i danni del trasporto (terminali, client di posta);
+autenticità e integrità restano compito di AES-GCM e della firma del flusso.
+"""
+
+import binascii
+import io
+import zlib
+
+BEGIN = b"-----BEGIN CRYPTOMESSENGER STREAM-----"
+END = b"-----END CRYPTOMESSENGER STREAM-----"
+LINE_BYTES = 57            # 76 caratteri base64 per riga (come MIME)
+BLOCK_LINES = 1150         # ~64 KiB di dati per ogni scrittura
+READ_SIZE = 64 * 1024
+_MAX_LINE = 1024
+
+
+class _RawReader(io.RawIOBase):
+    """Sorgente con solo read() vista come file raw (chiuderla non chiude src)"""
+
+    def __init__(self, src):
+        self.src = src
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.src.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def peekable(src):
+    """src con peek(): le sorgenti senza buffer (BytesIO, socket, file raw) vengono bufferizzate"""
+    if hasattr(src, 'peek'):
+        return src
+    return io.BufferedReader(_RawReader(src), READ_SIZE)
+
+
+def is_armored(src):
+    """True se il flusso bufferizzato src inizia con l'armatura (senza consumarlo, vedi peekable)"""
+    peek = getattr(src, 'peek', None)
+    if peek is None:
+        return False
+    return peek(len(BEGIN)).lstrip()[:1] == BEGIN[:1]
+
+
+def is_stream(src):
+    """True se src contiene un flusso a blocchi, binario o con armatura (e non un pacchetto messaggio)"""
+    import cryptomessage_stream
+
+    if is_armored(src):
+        return True
+    magic = cryptomessage_stream.MAGIC
+    peek = getattr(src, 'peek', None)
+    return peek is not None and peek(len(magic))[:len(magic)] == magic
+
+
+class ArmorWriter:
+    """File scrivibile: codifica in base64 a righe su dst (close() scrive il CRC e la riga finale)"""
+
+    def __init__(self, dst):
+        self.dst = dst
+        self.size = 0
+        self._crc = 0
+        self._pending = bytearray()
+        self._closed = False
+        dst.write(BEGIN + b"\n")
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError("Scrittura su un flusso chiuso")
+        self._crc = zlib.crc32(data, self._crc)
+        self.size += len(data)
+        self._pending += data
+        if len(self._pending) >= LINE_BYTES * BLOCK_LINES:
+            self._emit(len(self._pending) - len(self._pending) % LINE_BYTES)
+        return len(data)
+
+    def _emit(self, size):
+        """Codifica i primi size byte in attesa (righe intere, tranne l'ultima a close())"""
+        view = memoryview(self._pending)
+        try:
+            # b2a_base64 aggiunge già l'a capo a ogni riga
+            self.dst.write(b"".join(map(binascii.b2a_base64,
+                                        (view[start:start + LINE_BYTES] for start in range(0, size, LINE_BYTES)))))
+        finally:
+            view.release()
+        del self._pending[:size]
+
+    def flush(self):
+        self.dst.flush()
+
+    def close(self):
+        """Ultima riga, checksum e riga finale (dst resta aperto)"""
+        if self._closed:
+            return
+        self._emit(len(self._pending))
+        self.dst.write(b"=%08x\n" % self._crc + END + b"\n")
+        self.dst.flush()
+        self._closed = True
+
+
+class ArmorReader:
+    """File leggibile: decodifica l'armatura letta da src, verifica il CRC alla riga finale"""
+
+    def __init__(self, src):
+        self.src = src
+        self.size = 0
+        self._crc = 0
+        self._decoded = bytearray()
+        self._tail = b""
+        self._done = False
+        self._read_begin()
+
+    def _read_begin(self):
+        line = b""
+        while not line.strip():
+            line = self.src.readline(_MAX_LINE)
+            if not line:
+                raise ValueError("Armatura mancante: flusso vuoto")
+        if line.strip() != BEGIN:
+            raise ValueError("Armatura non valida: manca la riga iniziale")
+
+    def _decode(self, text):
+        try:
+            # a2b_base64 (non stretto) salta a capo e \r: una sola chiamata per blocco
+            data = binascii.a2b_base64(text)
+        except binascii.Error as e:
+            raise ValueError(f"Armatura non valida: {e}") from None
+        self._crc = zlib.crc32(data, self._crc)
+        self.size += len(data)
+        self._decoded += data
+
+    def _fill(self):
+        """Decodifica il blocco successivo di righe intere"""
+        block = self.src.read(READ_SIZE)
+        data = self._tail + block if self._tail else block
+        # _tail inizia sempre a inizio riga: il checksum è la riga che inizia con '='.
+        # '=' è raro (solo padding dell'ultima riga): lo si cerca prima da solo
+        equals = data.find(b"=")
+        trailer = data.find(b"\n=", max(equals - 1, 0)) + 1 if equals > 0 else 0
+        if trailer or equals == 0:
+            self._decode(data[:trailer])
+            self._finish(data[trailer:])
+            return
+        if not block:
+            raise ValueError("Armatura troncata: manca la riga finale")
+        cut = data.rfind(b"\n") + 1
+        if not cut and len(data) > _MAX_LINE:
+            raise ValueError("Armatura non valida: riga troppo lunga")
+        self._decode(data[:cut])
+        self._tail = data[cut:]
+
+    def _finish(self, trailer):
+        """Controlla checksum e riga finale; dopo sono ammessi solo spazi"""
+        while trailer.count(b"\n") < 2:
+            more = self.src.read(READ_SIZE)
+            if not more:
+                break
+            trailer += more
+        lines = trailer.split(b"\n", 2)
+        if len(lines) < 2 or lines[1].strip() != END:
+            raise ValueError("Armatura troncata: manca la riga finale")
+        try:
+            crc = int(lines[0].strip()[1:], 16)
+        except ValueError:
+            raise ValueError("Armatura non valida: checksum illeggibile") from None
+        if crc != self._crc:
+            raise ValueError("Checksum dell'armatura errato: dati danneggiati nel trasporto")
+        if (len(lines) > 2 and lines[2].strip()) or self.src.read(_MAX_LINE).strip():
+            raise ValueError("Dati inattesi dopo l'armatura")
+        self._tail = b""
+        self._done = True
+
+    def read(self, size=-1):
+        """Fino a size byte decodificati (meno solo a fine armatura)"""
+        if size is None or size < 0:
+            while not self._done:
+                self._fill()
+            size = len(self._decoded)
+        while len(self._decoded) < size and not self._done:
+            self._fill()
+        data = bytes(self._decoded[:size])
+        del self._decoded[:size]
+        return data
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        while len(self._decoded) < len(view) and not self._done:
+            self._fill()
+        count = min(len(view), len(self._decoded))
+        view[:count] = self._decoded[:count]
+        del self._decoded[:count]
+        return count
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Bench - Misure ripetibili dei costi della CLI
+Generazione chiavi, encrypt_message/decrypt_message per varie dimensioni,
+formati e cifrari (AEAD scelto dal benchmark contro AES-CBC), firma e
+verifica; risultato in JSON per confrontare le versioni
+
+Uso:
+    python cryptomessage_bench.py
+    python cryptomessage_bench.py --sizes 16,1K,1M,64M,1G --key-types rsa -o bench.json
+    python cryptomessage_bench.py --ciphers aes-gcm,chacha20,cbc --formats v3
+    python cryptomessage_cli.py bench --runs 5
+
+Ogni misura di encrypt/decrypt gira in un processo separato, così il picco di
+memoria (RSS) riportato è quello della singola dimensione.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+# Gli altri import restano nelle funzioni: la CLI importa questo modulo
+# solo per registrare le opzioni di 'bench'
+
+DEFAULT_SIZES = "16,256,4K,64K,1M,16M"
+DEFAULT_KEY_TYPES = "rsa,x25519"
+DEFAULT_FORMATS = "v3,v2"
+# auto = cifrario scelto dal benchmark della macchina; il v2 usa sempre AES-CBC
+DEFAULT_CIPHERS = "auto,cbc"
+CIPHER_NAMES = {"auto": None, "aes-gcm": "aes-gcm", "chacha20": "chacha20", "cbc": "AES-256-CBC"}
+RSA_KEY_SIZES = (2048, 3072, 4096)
+SIGN_DATA_SIZE = 1024
+LARGE_SIZE = 1024 * 1024  # oltre questa dimensione una sola ripetizione
+
+_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text):
+    """'16', '4K', '1M', '1G' -> byte"""
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1] if text and text[-1] in _UNITS else ""
+    return int(text[:len(text) - len(unit)]) * _UNITS[unit]
+
+
+def peak_rss_kb():
+    """Picco di memoria del processo corrente in KiB (None se non disponibile)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KiB, macOS byte
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _timed(func, runs):
+    import statistics
+
+    samples = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def _make_cli(private_der):
+    """CLI con la chiave già sbloccata, in una cartella dati temporanea"""
+    import cryptomessage_cli
+    import cryptomessage_keys
+
+    cli = cryptomessage_cli.CryptoMessengerCLI()
+    cli.private_key = cryptomessage_keys.load_der_private_key(private_der)
+    cli.public_key = cli.private_key.public_key()
+    cli.key_type = cryptomessage_keys.key_type_of(cli.private_key)
+    return cli
+
+
+def _message_case(private_der, size, fmt, cipher, runs, home):
+    """Misura encrypt_message e decrypt_message (eseguita in un processo dedicato)"""
+    import contextlib
+
+    os.environ["CRYPTOMESSENGER_HOME"] = home
+    cli = _make_cli(private_der)
+    message = "x" * size
+    # Benchmark dei cifrari (o lettura della scelta in cache) fuori dalla misura
+    cli.cipher_choice()
+    cipher_name = cli._payload_cipher(cipher, fmt)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        encrypt_s, packet = _timed(lambda: cli.encrypt_message("Me", message, True, fmt, cipher=cipher), runs)
+        if packet is None:
+            raise RuntimeError("encrypt_message non riuscito")
+        decrypt_s, decrypted = _timed(lambda: cli.decrypt_message(packet), runs)
+    if decrypted != message:
+        raise RuntimeError("decrypt_message non ha restituito il messaggio originale")
+
+    return {
+        "cipher": cipher_name,
+        "encrypt_s": encrypt_s,
+        "decrypt_s": decrypt_s,
+        "packet_bytes": len(packet),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def bench_keygen(key_types, runs):
+    """Tempo di generazione delle chiavi"""
+    import cryptomessage_keys
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    results = []
+    for key_type in key_types:
+        if key_type == "rsa":
+            for key_size in RSA_KEY_SIZES:
+                seconds, _ = _timed(lambda: rsa.generate_private_key(public_exponent=65537, key_size=key_size), runs)
+                results.append({"key_type": "rsa", "key_size": key_size, "seconds": seconds})
+        else:
+            seconds, _ = _timed(lambda: cryptomessage_keys.generate_private_key(key_type), runs)
+            results.append({"key_type": key_type, "key_size": 256, "seconds": seconds})
+    return results
+
+
+def bench_signatures(cli, key_type, runs):
+    """Firma e verifica di un blocco di dati"""
+    import contextlib
+
+    data = os.urandom(SIGN_DATA_SIZE)
+    sign_s, signature = _timed(lambda: cli._sign_payload(data), runs)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        verify_s, (valid, _) = _timed(lambda: cli._verify_signature(signature, data, "Me"), runs)
+    if not valid:
+        raise RuntimeError("verifica della firma non riuscita")
+    return {
+        "key_type": key_type,
+        "data_bytes": SIGN_DATA_SIZE,
+        "signature_bytes": len(signature),
+        "sign_s": sign_s,
+        "verify_s": verify_s,
+    }
+
+
+def run(args):
+    """Esegue il benchmark e restituisce il risultato come dizionario"""
+    import multiprocessing
+    import platform
+    import tempfile
+
+    import cryptography
+    import cryptomessage_keys
+
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    key_types = [k.strip() for k in args.key_types.split(",") if k.strip()]
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    ciphers = [c.strip() for c in args.ciphers.split(",") if c.strip()]
+    for key_type in key_types:
+        if key_type not in cryptomessage_keys.KEY_TYPES:
+            raise ValueError(f"Tipo di chiave non supportato: {key_type}")
+    for cipher in ciphers:
+        if cipher not in CIPHER_NAMES:
+            raise ValueError(f"Cifrario non supportato: {cipher} (scegli tra {', '.join(CIPHER_NAMES)})")
+
+    report = {
+        "schema": 2,
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "cryptography": cryptography.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "keygen": [],
+        "signatures": [],
+        "messages": [],
+    }
+
+    def progress(text):
+        if not args.quiet:
+            print(f"⏱️ {text}", file=sys.stderr)
+
+    if not args.skip_keygen:
+        progress("generazione chiavi")
+        report["keygen"] = bench_keygen(key_types, args.keygen_runs)
+
+    context = multiprocessing.get_context("spawn")
+    previous_home = os.environ.get("CRYPTOMESSENGER_HOME")
+    with tempfile.TemporaryDirectory() as home:
+        os.environ["CRYPTOMESSENGER_HOME"] = home
+        try:
+            _bench_messages(report, key_types, formats, ciphers, sizes, args, context, home, progress)
+        finally:
+            if previous_home is None:
+                os.environ.pop("CRYPTOMESSENGER_HOME", None)
+            else:
+                os.environ["CRYPTOMESSENGER_HOME"] = previous_home
+    return report
+
+
+def _bench_messages(report, key_types, formats, ciphers, sizes, args, context, home, progress):
+    """Firme e messaggi per ogni tipo di chiave, formato, cifrario e dimensione"""
+    import cryptomessage_keys
+    from cryptography.hazmat.primitives import serialization
+
+    for key_type in key_types:
+        private_key = cryptomessage_keys.generate_private_key(key_type)
+        private_der = private_key.private_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+
+        progress(f"firma e verifica ({key_type})")
+        report["signatures"].append(bench_signatures(_make_cli(private_der), key_type, args.runs))
+
+        cases = [(fmt, cipher) for fmt in formats for cipher in (ciphers if fmt != "v2" else ["cbc"])]
+        for fmt, cipher in cases:
+            for size in sizes:
+                progress(f"{key_type} {fmt} {cipher} {size} byte")
+                runs = args.runs if size <= LARGE_SIZE else 1
+                with context.Pool(1) as pool:
+                    case = pool.apply(_message_case, (private_der, size, fmt, CIPHER_NAMES[cipher], runs, home))
+                case.update({
+                    "key_type": key_type,
+                    "format": fmt,
+                    "size": size,
+                    "runs": runs,
+                    "overhead_ratio": case["packet_bytes"] / size,
+                    "encrypt_mb_s": size / 1e6 / case["encrypt_s"],
+                    "decrypt_mb_s": size / 1e6 / case["decrypt_s"],
+                })
+                report["messages"].append(case)
+
+
+def add_arguments(parser):
+    """Opzioni del benchmark (condivise con il comando 'bench' della CLI)"""
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"Dimensioni dei messaggi, suffissi K/M/G (default: {DEFAULT_SIZES})")
+    parser.add_argument("--key-types", default=DEFAULT_KEY_TYPES,
+                        help=f"Tipi di chiave (default: {DEFAULT_KEY_TYPES})")
+    parser.add_argument("--formats", default=DEFAULT_FORMATS, help=f"Formati pacchetto (default: {DEFAULT_FORMATS})")
+    parser.add_argument("--ciphers", default=DEFAULT_CIPHERS,
+                        help=f"Cifrari per il v3: {', '.join(CIPHER_NAMES)} (default: {DEFAULT_CIPHERS})")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Ripetizioni per misura, mediana (default: 3; 1 oltre 1 MiB)")
+    parser.add_argument("--keygen-runs", type=int, default=3, help="Ripetizioni per la generazione chiavi")
+    parser.add_argument("--skip-keygen", action="store_true", help="Non misurare la generazione chiavi")
+    parser.add_argument("-o", "--output", help="Salva il JSON su file (default: stdout)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Nessun avanzamento su stderr")
+
+
+def main(args=None):
+    if args is None:
+        parser = argparse.ArgumentParser(description="Benchmark di CryptoMessenger CLI (output JSON)")
+        add_arguments(parser)
+        args = parser.parse_args()
+
+    try:
+        report = run(args)
+    except Exception as e:
+        print(f"❌ Benchmark non riuscito: {e}", file=sys.stderr)
+        return False
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"✅ Risultati salvati in: {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
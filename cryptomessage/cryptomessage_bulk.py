@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Bulk - Creazione di molte identità in parallelo
+Per ambienti di test e staging: le chiavi vengono generate da un pool di
+processi (una generazione RSA occupa un core intero) e ogni identità ottiene
+la propria cartella dati, utilizzabile con CRYPTOMESSENGER_HOME:
+
+    <out_dir>/<nome>/cryptomessenger_config.json   account (chiave privata cifrata)
+    <out_dir>/<nome>/<nome>.pem                    chiave pubblica esportata
+    <out_dir>/contatti.json                        pacchetto contatti
+
+Pacchetto contatti (JSON), importabile con un solo comando (import-contacts):
+    {"version": 1, "contacts": [{"name": "...", "key_type": "rsa",
+                                  "fingerprint": "<SHA-256 hex>", "public_key": "<PEM>"}]}
+"""
+
+import base64
+import json
+import os
+
+import cryptomessage_keyring
+import cryptomessage_keys
+import cryptomessage_paths
+
+BUNDLE_NAME = "contatti.json"
+BUNDLE_VERSION = 1
+
+_password = None
+_kdf = None
+
+
+def identity_names(count, prefix):
+    """Nomi delle identità (prefisso + numero con zeri iniziali)"""
+    width = len(str(count))
+    return [f"{prefix}{index:0{width}d}" for index in range(1, count + 1)]
+
+
+def _init_worker(password, kdf):
+    """Password e parametri KDF passati una volta sola a ogni processo"""
+    global _password, _kdf
+    _password = password
+    _kdf = kdf
+
+
+def create_identity(task):
+    """Genera e salva un'identità (eseguita in un processo del pool)"""
+    name, data_dir, key_type = task
+    from cryptomessage_core import CryptoMessenger
+
+    messenger = CryptoMessenger(data_dir)
+    messenger.private_key = cryptomessage_keys.generate_private_key(key_type)
+    messenger.public_key = messenger.private_key.public_key()
+    messenger.save_keys_with_password(_password, _kdf)
+
+    public_pem = messenger.public_key_pem()
+    with open(os.path.join(data_dir, name + ".pem"), 'wb') as f:
+        f.write(public_pem)
+    return bundle_entry(name, public_pem)
+
+
+def provision(count, out_dir, password, key_type=cryptomessage_keys.DEFAULT_KEY_TYPE, prefix="utente",
+              jobs=None, kdf=None, progress=None):
+    """Crea count identità in out_dir, restituisce le voci del pacchetto contatti
+
+    kdf: parametri già calibrati (ogni identità riceve un nuovo sale).
+    progress(fatte, totale) viene chiamata a ogni identità completata.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    names = identity_names(count, prefix)
+    tasks = [(name, os.path.join(out_dir, name), key_type) for name in names]
+    bundle_path = os.path.join(out_dir, BUNDLE_NAME)
+    if os.path.exists(bundle_path):
+        raise FileExistsError(f"Pacchetto contatti già presente: {bundle_path} (usa un'altra cartella)")
+    existing = [name for name, data_dir, _ in tasks
+                if os.path.exists(os.path.join(data_dir, "cryptomessenger_config.json"))]
+    if existing:
+        raise FileExistsError(f"Identità già presenti in {out_dir}: {', '.join(existing[:5])}")
+    for _, data_dir, _ in tasks:
+        cryptomessage_paths.ensure_dir(data_dir)
+
+    jobs = max(1, min(jobs or os.cpu_count() or 1, count))
+    entries = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(password, kdf)) as executor:
+        # Risultati nello stesso ordine dei nomi; blocchi di lavoro per ridurre lo scambio tra processi
+        for entry in executor.map(create_identity, tasks, chunksize=max(1, count // (jobs * 8))):
+            entries.append(entry)
+            if progress is not None:
+                progress(len(entries), count)
+
+    write_bundle(bundle_path, entries)
+    return entries
+
+
+# Pacchetto contatti
+
+def bundle_entry(name, public_pem):
+    """Voce del pacchetto contatti per una chiave pubblica PEM"""
+    return {
+        'name': name,
+        'key_type': cryptomessage_keys.detect_key_type(public_pem),
+        'fingerprint': cryptomessage_keyring.compute_fingerprint(base64.b64encode(public_pem)),
+        'public_key': public_pem.decode('ascii'),
+    }
+
+
+def write_bundle(path, entries):
+    """Scrive il pacchetto contatti (sostituzione atomica del file)"""
+    temporary = path + ".tmp"
+    with open(temporary, 'w') as f:
+        json.dump({'version': BUNDLE_VERSION, 'contacts': entries}, f, indent=1)
+        f.write("\n")
+    os.replace(temporary, path)
+
+
+def read_bundle(text):
+    """Voci di un pacchetto contatti, solleva ValueError se non valido
+
+    Ogni impronta viene ricalcolata: una chiave alterata nel file non passa.
+    """
+    try:
+        data = json.loads(text)
+        if data.get('version') != BUNDLE_VERSION:
+            raise ValueError(f"Versione del pacchetto non supportata: {data.get('version')}")
+        entries = []
+        for contact in data['contacts']:
+            public_pem = contact['public_key'].encode('ascii')
+            entry = bundle_entry(contact['name'], public_pem)
+            if contact.get('fingerprint') and contact['fingerprint'].upper() != entry['fingerprint']:
+                raise ValueError(f"Impronta non corrispondente per {contact['name']}")
+            entries.append(entry)
+    except (KeyError, TypeError, AttributeError, UnicodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Pacchetto contatti non valido: {e}") from e
+    return entries
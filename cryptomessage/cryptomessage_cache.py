@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Cache - Risultati di decifratura già calcolati
+Un pacchetto incollato di nuovo viene riaperto senza unwrap RSA/X25519,
+senza AES sul messaggio e senza verifica della firma: basta un HMAC del
+pacchetto, una ricerca sull'indice e la decifratura della voce.
+
+Due file nella cartella dati:
+    cryptomessenger_cache.json  impostazioni (la cache è attiva se esiste)
+                                {"ttl": 604800, "max_entries": 1000, "max_bytes": 4194304}
+    cryptomessenger_cache.db    SQLite, una riga per pacchetto:
+                                digest | created | used | size | nonce (12) | AES-256-GCM(JSON della voce)
+                                con dati associati MAGIC | digest
+
+Il digest è l'HMAC-SHA256 del pacchetto con una chiave derivata dalla
+chiave privata: il file non rivela quali pacchetti sono stati letti.
+Ogni decrypt aggiunge o tocca una sola riga, senza riscrivere il resto,
+e più processi condividono la stessa cache. Una voce scade dopo ttl
+secondi; oltre max_entries voci o max_bytes di testo si eliminano le
+meno usate di recente.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import time
+
+MAGIC = b"CMC1"
+NONCE_SIZE = 12
+
+TTL = 7 * 24 * 3600  # secondi
+MAX_ENTRIES = 1000
+MAX_BYTES = 4 * 1024 * 1024  # testo dei messaggi in cache
+
+
+def load_settings(path):
+    """Impostazioni della cache, o None se la cache è disattivata"""
+    try:
+        with open(path, 'r') as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(settings, dict):
+        return None
+    return {
+        'ttl': int(settings.get('ttl', TTL)),
+        'max_entries': int(settings.get('max_entries', MAX_ENTRIES)),
+        'max_bytes': int(settings.get('max_bytes', MAX_BYTES)),
+    }
+
+
+def save_settings(path, ttl=TTL, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+    """Attiva la cache con queste impostazioni"""
+    settings = {'ttl': ttl, 'max_entries': max_entries, 'max_bytes': max_bytes}
+    temporary = path + ".tmp"
+    with open(temporary, 'w') as f:
+        json.dump(settings, f)
+    os.replace(temporary, path)
+    return settings
+
+
+def clear(path):
+    """Svuota il database della cache; i processi che lo hanno aperto vedono subito la cache vuota"""
+    import sqlite3
+
+    if not os.path.exists(path):
+        return
+    db = sqlite3.connect(path)
+    try:
+        with db:
+            db.execute("DELETE FROM entries")
+    except sqlite3.OperationalError:
+        # Tabella mai creata
+        pass
+    finally:
+        db.close()
+
+
+def remove(path):
+    """Cancella il database della cache (con i file del journal WAL)"""
+    for name in (path, path + "-wal", path + "-shm"):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+class DecryptCache:
+    """Risultati di decrypt() per pacchetto, cifrati riga per riga in SQLite"""
+
+    def __init__(self, path, key, index_key, ttl=TTL, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.path = path
+        self.key = key
+        self.index_key = index_key
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._db = None
+
+    def open(self):
+        import sqlite3
+
+        # Voci leggibili solo dall'utente
+        if not os.path.exists(self.path):
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        # Una cache non ha bisogno di durabilità: commit senza fsync, lettori concorrenti
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = OFF")
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    digest TEXT PRIMARY KEY,
+                    created REAL NOT NULL,
+                    used REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    data BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+                CREATE INDEX IF NOT EXISTS entries_created ON entries (created);
+            """)
+        return self
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _aad(self, digest):
+        return MAGIC + digest.encode()
+
+    def digest(self, encrypted):
+        """Indice cieco del pacchetto (HMAC-SHA256 del testo, spazi esterni esclusi)"""
+        if isinstance(encrypted, str):
+            encrypted = encrypted.encode()
+        return hmac.new(self.index_key, bytes(encrypted).strip(), hashlib.sha256).hexdigest()
+
+    def get(self, digest):
+        """Voce del pacchetto ({'result', 'signer_fingerprint'}) o None se assente o scaduta"""
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        row = self._db.execute("SELECT created, data FROM entries WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        created, data = row
+        now = time.time()
+        if now - created > self.ttl:
+            self.discard(digest)
+            return None
+        try:
+            plaintext = AESGCM(self.key).decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], self._aad(digest))
+        except Exception:
+            # Voce scritta con un'altra chiave (account cambiato) o danneggiata
+            self.discard(digest)
+            return None
+        with self._db:
+            self._db.execute("UPDATE entries SET used = ? WHERE digest = ?", (now, digest))
+        return json.loads(plaintext)
+
+    def put(self, digest, result, signer_fingerprint=None):
+        """Aggiunge (o sostituisce) il risultato di un pacchetto ed elimina le voci in eccesso"""
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        size = len(result['message'])
+        if size > self.max_bytes:
+            return
+        entry = json.dumps({'result': result, 'signer_fingerprint': signer_fingerprint}).encode()
+        nonce = os.urandom(NONCE_SIZE)
+        data = nonce + AESGCM(self.key).encrypt(nonce, entry, self._aad(digest))
+        now = time.time()
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (digest, created, used, size, data) VALUES (?, ?, ?, ?, ?)",
+                (digest, now, now, size, data)
+            )
+            self._prune(now)
+
+    def _prune(self, now):
+        """Elimina le voci scadute, poi le meno usate oltre i limiti (nella transazione corrente)"""
+        self._db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        evicted = []
+        for digest, size in self._db.execute("SELECT digest, size FROM entries ORDER BY used").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append((digest,))
+            count -= 1
+            total -= size
+        self._db.executemany("DELETE FROM entries WHERE digest = ?", evicted)
+
+    def discard(self, digest):
+        """Dimentica un pacchetto (per esempio se la chiave del firmatario è cambiata)"""
+        with self._db:
+            self._db.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
@@ -4,96 +4,219 @@
 """
 CryptoMessenger CLI - Versione da riga di comando
 Crittografia end-to-end per messaggi sicuri via terminale
+
+La logica sta in cryptomessage_core.CryptoMessenger (senza stampe né
+richieste di password); questa classe aggiunge solo input e output.
 """
 
 import argparse
+import contextlib
 import sys
 import os
 import json
-import base64
-import hashlib
+import time
 from datetime import datetime
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
 import getpass
 
-class CryptoMessengerCLI:
-    def __init__(self):
-        self.config_file = "cryptomessenger_config.json"
-        self.contacts_file = "cryptomessenger_contacts.json"
-        self.private_key = None
-        self.public_key = None
-        self.contacts = {}
-        
-        self.load_config()
-        self.load_contacts()
-    
-    def load_config(self):
-        """Carica configurazione"""
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-                
-                public_pem = base64.b64decode(config['public_key'])
-                self.public_key = serialization.load_pem_public_key(
-                    public_pem, backend=default_backend()
-                )
-            except:
-                pass
-    
-    def load_contacts(self):
-        """Carica rubrica"""
-        if os.path.exists(self.contacts_file):
+import cryptomessage_bench
+import cryptomessage_keyring
+import cryptomessage_keys
+from cryptomessage_core import (
+    CryptoMessenger, CryptoMessengerError, ContactNotFoundError, ContactExistsError,
+    GroupNotFoundError, InvalidPacketError, PasswordRequiredError, RetiredKeyLockedError,
+    is_self,
+    cryptomessage_aead, cryptomessage_agent, cryptomessage_archive, cryptomessage_armor, cryptomessage_bulk, cryptomessage_kdf, cryptomessage_server,
+    cryptomessage_signature,
+)
+
+
+class CryptoMessengerCLI(CryptoMessenger):
+    def load_private_key_with_password(self, password=None, use_agent=True):
+        """Carica chiave privata con password"""
+        try:
             try:
-                with open(self.contacts_file, 'r') as f:
-                    self.contacts = json.load(f)
-            except:
-                self.contacts = {}
+                self.unlock(password, use_agent)
+            except PasswordRequiredError:
+                with self._phase('password_prompt'):
+                    password = getpass.getpass("🔐 Password del tuo account: ")
+                self.unlock(password, use_agent)
+            return True
+        except CryptoMessengerError as e:
+            print(f"❌ {e}")
+            return False
     
-    def save_config(self, config):
-        """Salva configurazione"""
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f)
+    def unlock_retired_key(self, kid):
+        """Chiede la password di una chiave ritirata e la sblocca"""
+        print(f"🗝️ Il messaggio è per una tua chiave precedente ({kid})")
+        password = getpass.getpass("🔐 Password della chiave precedente: ")
+        try:
+            self.unlock_retired(kid, password)
+            return True
+        except CryptoMessengerError as e:
+            print(f"❌ {e}")
+            return False
     
-    def save_contacts(self):
-        """Salva rubrica"""
-        with open(self.contacts_file, 'w') as f:
-            json.dump(self.contacts, f)
+    def archive_message(self, direction, contacts, timestamp, message, packet_id, signature_valid=None):
+        """Salva il messaggio nell'archivio locale (senza far fallire l'operazione)"""
+        try:
+            if self.archive(direction, contacts, timestamp, message, packet_id, signature_valid):
+                print("🗄️ Messaggio archiviato")
+            else:
+                print("🗄️ Messaggio già presente in archivio")
+            return True
+        except Exception as e:
+            print(f"⚠️ Archiviazione non riuscita: {e}")
+            return False
     
-    def load_private_key_with_password(self, password=None):
-        """Carica chiave privata con password"""
-        if self.private_key:
+    def history(self, sender=None, recipient=None, since=None, until=None, search=None, limit=20):
+        """Mostra i messaggi archiviati che soddisfano i filtri"""
+        if not os.path.exists(self.archive_index_file):
+            print("📭 Archivio vuoto: usa --archive con encrypt e decrypt")
             return True
         
-        if not os.path.exists(self.config_file):
-            print("❌ Nessun account configurato!")
+        if not self.load_private_key_with_password():
             return False
         
-        if not password:
-            password = getpass.getpass("🔐 Password del tuo account: ")
-        
         try:
-            with open(self.config_file, 'r') as f:
-                config = json.load(f)
-            
-            private_pem = base64.b64decode(config['private_key'])
-            self.private_key = serialization.load_pem_private_key(
-                private_pem,
-                password=password.encode(),
-                backend=default_backend()
-            )
+            records = self.search_archive(sender, recipient, since, until, search, limit)
+        except CryptoMessengerError as e:
+            print(f"❌ {e}")
+            return False
+        except Exception as e:
+            print(f"❌ Impossibile leggere l'archivio: {e}")
+            return False
+        
+        if not records:
+            print("📭 Nessun messaggio trovato")
             return True
-            
+        
+        print(f"📜 Messaggi trovati: {len(records)}")
+        for record in records:
+            contacts = ', '.join(record['contacts']) or 'Sconosciuto'
+            when = record['timestamp'][:16].replace('T', ' ')
+            if record['direction'] == 'in':
+                verified = " ✅" if record['signature_valid'] else ""
+                print(f"📥 {when} · da {contacts}{verified}")
+            else:
+                print(f"📤 {when} · a {contacts}")
+            for line in record['message'].splitlines() or ['']:
+                print(f"   {line}")
+            print()
+        return True
+    
+    def list_sessions(self, clear=False):
+        """Mostra (o cancella) le sessioni salvate"""
+        if not self.load_private_key_with_password():
+            return False
+        
+        try:
+            store = self.get_session_store()
         except Exception as e:
-            print(f"❌ Password errata o chiave corrotta: {e}")
+            print(f"❌ Impossibile aprire le sessioni: {e}")
             return False
+        
+        if clear:
+            store.clear()
+            store.save()
+            print("🗑️ Sessioni cancellate: il prossimo messaggio negozierà una nuova chiave")
+            return True
+        
+        if not store.outgoing and not store.incoming:
+            print("📭 Nessuna sessione attiva")
+            return True
+        
+        print(f"🔁 Sessioni in uscita: {len(store.outgoing)}")
+        for name, session in store.outgoing.items():
+            created = datetime.fromtimestamp(session['created']).strftime('%Y-%m-%d %H:%M')
+            print(f"  👤 {name}: {session['sid'][:8]} · {session['count']}/{store.max_messages} messaggi · dal {created}")
+        print(f"📥 Sessioni in arrivo: {len(store.incoming)}")
+        return True
     
-    def generate_keys(self):
+    def run_agent(self, socket_path=None, timeout=None):
+        """Avvia l'agente: sblocca la chiave una volta e la serve via socket"""
+        if timeout is None:
+            timeout = cryptomessage_agent.DEFAULT_TIMEOUT
+        if not cryptomessage_agent.is_supported():
+            print("❌ L'agente richiede socket Unix (non disponibili su questo sistema)")
+            return False
+        
+        socket_path = socket_path or cryptomessage_agent.default_socket_path()
+        running = cryptomessage_agent.connect(socket_path)
+        if running is not None:
+            running.close()
+            print(f"⚠️ Agente già attivo su {socket_path}")
+            return False
+        try:
+            cryptomessage_agent.private_dir(socket_path)
+        except OSError as e:
+            print(f"❌ Cartella del socket non sicura: {e}")
+            return False
+        
+        if not self.load_private_key_with_password(use_agent=False):
+            return False
+        
+        agent = cryptomessage_agent.KeyAgent(self.private_key, socket_path, timeout)
+        print(f"🔐 Agente attivo su {socket_path}")
+        print(f"⏱️ Timeout di inattività: {timeout or 'nessuno'} secondi")
+        print(f"💡 export CRYPTOMESSENGER_AGENT_SOCK={socket_path}")
+        sys.stdout.flush()
+        
+        try:
+            agent.serve()
+        except KeyboardInterrupt:
+            pass
+        
+        print("👋 Agente terminato")
+        return True
+    
+    def serve(self, socket_path=None, jobs=None):
+        """Servizio JSON-RPC: chiave sbloccata e rubrica in memoria tra una richiesta e l'altra"""
+        if not cryptomessage_agent.is_supported():
+            print("❌ Il server richiede socket Unix (non disponibili su questo sistema)")
+            return False
+        
+        socket_path = socket_path or cryptomessage_server.default_socket_path()
+        try:
+            cryptomessage_agent.private_dir(socket_path)
+        except OSError as e:
+            print(f"❌ Cartella del socket non sicura: {e}")
+            return False
+        
+        if not self.load_private_key_with_password():
+            return False
+        
+        server = cryptomessage_server.MessengerServer(self, socket_path, jobs)
+        
+        def ready():
+            print(f"🛰️ Server JSON-RPC attivo su {server.socket_path}")
+            print(f"🧵 Thread di lavoro: {server.jobs}")
+            sys.stdout.flush()
+        
+        try:
+            server.serve(ready)
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            print(f"❌ Impossibile avviare il server: {e}")
+            return False
+        
+        print(f"👋 Server terminato ({server.requests} richieste)")
+        return True
+    
+    def stop_agent(self, socket_path=None):
+        """Ferma l'agente in esecuzione"""
+        agent_key = cryptomessage_agent.connect(socket_path)
+        if agent_key is None:
+            print("📭 Nessun agente attivo")
+            return False
+        
+        agent_key.stop()
+        print("✅ Agente fermato")
+        return True
+    
+    def generate_keys(self, key_type=cryptomessage_keys.DEFAULT_KEY_TYPE, kdf=None, unlock_ms=None):
         """Genera nuove chiavi"""
-        print("🔑 Generazione nuove chiavi...")
+        print(f"🔑 Generazione nuove chiavi ({key_type})...")
         
         password = getpass.getpass("🔐 Crea una password per proteggere la tua chiave privata: ")
         password_confirm = getpass.getpass("🔐 Conferma la password: ")
@@ -103,51 +226,141 @@ class CryptoMessengerCLI:
             return False
         
         try:
-            # Genera chiavi
-            self.private_key = rsa.generate_private_key(
-                public_exponent=65537,
-                key_size=2048,
-                backend=default_backend()
-            )
-            self.public_key = self.private_key.public_key()
-            
-            # Salva chiavi
-            self.save_keys_with_password(password)
+            if kdf or unlock_ms:
+                print("⏱️ Calibrazione della KDF su questa macchina...")
+            self.create_account(password, key_type, kdf, unlock_ms)
             
             print("✅ Account configurato correttamente!")
+            if self.kdf:
+                print(f"🔐 KDF: {cryptomessage_kdf.describe(self.kdf)}")
             print("📤 Esporta la tua chiave pubblica per condividerla con i contatti")
             return True
-            
+        
         except Exception as e:
             print(f"❌ Errore nella generazione: {e}")
             return False
     
-    def save_keys_with_password(self, password):
-        """Salva chiavi con cifratura"""
+    def bulk_setup(self, count, out_dir, key_type=cryptomessage_keys.DEFAULT_KEY_TYPE, prefix="utente", jobs=None,
+                   kdf=None, unlock_ms=None):
+        """Crea molte identità di test in parallelo, con pacchetto contatti"""
+        if count <= 0:
+            print("❌ Il numero di identità deve essere positivo")
+            return False
+        
+        print(f"🔑 Generazione di {count} identità ({key_type}) in {out_dir}")
+        password = getpass.getpass("🔐 Password comune per le chiavi private: ")
+        password_confirm = getpass.getpass("🔐 Conferma la password: ")
+        if password != password_confirm:
+            print("❌ Le password non corrispondono!")
+            return False
+        
         try:
-            # Cifra chiave privata con password
-            private_pem = self.private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.BestAvailableEncryption(password.encode())
-            )
+            calibrated = None
+            if kdf or unlock_ms:
+                # Calibrazione una volta sola, con una chiave dello stesso tipo
+                print("⏱️ Calibrazione della KDF su questa macchina...")
+                probe = CryptoMessenger(out_dir)
+                probe.private_key = cryptomessage_keys.generate_private_key(key_type)
+                calibrated = probe.calibrate_kdf(kdf, unlock_ms)
+                print(f"🔐 KDF: {cryptomessage_kdf.describe(calibrated)}")
             
-            # Chiave pubblica non cifrata
-            public_pem = self.public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            )
-            
-            config = {
-                'private_key': base64.b64encode(private_pem).decode(),
-                'public_key': base64.b64encode(public_pem).decode(),
-                'created': datetime.now().isoformat()
-            }
+            def progress(done, total):
+                print(f"\r⏳ {done}/{total}", end="", flush=True)
             
-            self.save_config(config)
-                
-        except Exception as e:
-            raise Exception(f"Errore nel salvataggio: {str(e)}")
+            start = time.perf_counter()
+            entries = cryptomessage_bulk.provision(count, out_dir, password, key_type, prefix, jobs, calibrated,
+                                                   progress)
+            elapsed = time.perf_counter() - start
+        except (CryptoMessengerError, OSError, ValueError) as e:
+            print(f"\n❌ {e}")
+            return False
+        
+        print()
+        print(f"✅ {len(entries)} identità create in {elapsed:.1f} s ({len(entries) / elapsed:.1f}/s)")
+        print(f"📁 Cartelle dati: {out_dir}/{entries[0]['name']} ... (usa CRYPTOMESSENGER_HOME)")
+        print(f"👥 Pacchetto contatti: {os.path.join(out_dir, cryptomessage_bulk.BUNDLE_NAME)}")
+        return True
+    
+    def import_contacts_file(self, bundle_file, replace=False):
+        """Importa un pacchetto contatti (es. creato da bulk-setup)"""
+        try:
+            with open(bundle_file, 'r') as f:
+                result = self.import_contacts(f.read(), replace)
+        except OSError as e:
+            print(f"❌ Impossibile leggere {bundle_file}: {e}")
+            return False
+        except CryptoMessengerError as e:
+            print(f"❌ {e}")
+            return False
+        
+        print(f"✅ {len(result['added'])} contatti aggiunti")
+        if result['replaced']:
+            print(f"🔄 {len(result['replaced'])} contatti aggiornati")
+        if result['skipped']:
+            print(f"⏭️ {len(result['skipped'])} saltati (già presenti o la tua chiave; --replace per aggiornarli)")
+        return True
+    
+    def configure_kdf(self, kdf=None, unlock_ms=None):
+        """Mostra la KDF della password o la ricalibra su questa macchina"""
+        if not self.public_key_b64:
+            print("❌ Nessun account configurato!")
+            return False
+        
+        if not kdf and not unlock_ms:
+            print(f"🔐 KDF: {cryptomessage_kdf.describe(self.kdf)}")
+            return True
+        
+        # La chiave va ricifrata: serve la password, non l'agente
+        password = getpass.getpass("🔐 Password del tuo account: ")
+        try:
+            self.unlock(password, use_agent=False)
+            print("⏱️ Calibrazione della KDF su questa macchina...")
+            self.save_keys_with_password(password, self.calibrate_kdf(kdf, unlock_ms))
+        except CryptoMessengerError as e:
+            print(f"❌ {e}")
+            return False
+        
+        print("✅ Chiave privata ricifrata")
+        print(f"🔐 KDF: {cryptomessage_kdf.describe(self.kdf)}")
+        return True
+    
+    def show_cipher(self, remeasure=False):
+        """Mostra il cifrario AEAD scelto per questa macchina (o ripete il benchmark)"""
+        if remeasure or cryptomessage_aead.load_choice(self.cipher_file) is None:
+            print("⏱️ Benchmark dei cifrari su questa macchina...")
+        choice = self.cipher_choice(remeasure)
+        print(f"🔒 Cifrario: {cryptomessage_aead.describe(choice)}")
+        return True
+    
+    def decrypt_cache(self, action=None, ttl_hours=None, max_entries=None, max_mb=None):
+        """Attiva, disattiva, svuota o mostra la cache dei messaggi decriptati"""
+        if action == 'on':
+            settings = self.enable_decrypt_cache(
+                ttl=int(ttl_hours * 3600) if ttl_hours else None,
+                max_entries=max_entries,
+                max_bytes=int(max_mb * 1024 * 1024) if max_mb else None
+            )
+            print("✅ Cache dei messaggi decriptati attiva")
+        elif action == 'off':
+            self.clear_decrypt_cache(disable=True)
+            print("✅ Cache disattivata e cancellata")
+            return True
+        elif action == 'clear':
+            self.clear_decrypt_cache()
+            print("✅ Cache svuotata")
+            return True
+        else:
+            settings = self.decrypt_cache_settings()
+            if settings is None:
+                print("💤 Cache dei messaggi decriptati disattivata (attiva con: cache on)")
+                return True
+            print("⚡ Cache dei messaggi decriptati attiva")
+        
+        size = os.path.getsize(self.cache_file) if os.path.exists(self.cache_file) else 0
+        print(f"   Scadenza: {settings['ttl'] / 3600:g} ore")
+        print(f"   Limite: {settings['max_entries']} messaggi, {settings['max_bytes'] / 1024 / 1024:g} MB di testo")
+        print(f"   File: {self.cache_file} ({size} byte, cifrato)")
+        return True
     
     def export_public_key(self, filename=None):
         """Esporta chiave pubblica"""
@@ -159,18 +372,13 @@ class CryptoMessengerCLI:
             filename = "mia_chiave_pubblica.pem"
         
         try:
-            public_pem = self.public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            )
-            
             with open(filename, 'wb') as f:
-                f.write(public_pem)
+                f.write(self.public_key_pem())
             
             print(f"✅ Chiave pubblica esportata: {filename}")
             print("📤 Invia questo file ai tuoi contatti per permettergli di inviarti messaggi criptati")
             return True
-            
+        
         except Exception as e:
             print(f"❌ Errore nell'esportazione: {e}")
             return False
@@ -181,7 +389,8 @@ class CryptoMessengerCLI:
             print("❌ Nessuna chiave da esportare!")
             return False
         
-        if not self.load_private_key_with_password(password):
+        # L'esportazione richiede la chiave vera, non quella dell'agente
+        if not self.load_private_key_with_password(password, use_agent=False):
             return False
         
         if not filename:
@@ -205,31 +414,21 @@ class CryptoMessengerCLI:
                 export_password = password or ""
             
             # Esporta chiave privata
-            if protect and export_password:
-                private_pem = self.private_key.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.PKCS8,
-                    encryption_algorithm=serialization.BestAvailableEncryption(export_password.encode())
-                )
-            else:
+            if not (protect and export_password):
                 print("⚠️ ATTENZIONE: Stai esportando la chiave SENZA protezione password!")
                 confirm = input("Sei sicuro? (s/n): ").lower()
                 if confirm not in ['s', 'si', 'y', 'yes']:
                     print("❌ Esportazione annullata")
                     return False
-                
-                private_pem = self.private_key.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.PKCS8,
-                    encryption_algorithm=serialization.NoEncryption()
-                )
+                export_password = None
+            private_pem = self.private_key_pem(export_password)
             
             # Salva file
             with open(filename, 'wb') as f:
                 f.write(private_pem)
             
             print(f"✅ Chiave privata esportata: {filename}")
-            print(f"🔐 Protetta con password: {'SÌ ✅' if protect and export_password else 'NO ⚠️'}")
+            print(f"🔐 Protetta con password: {'SÌ ✅' if export_password else 'NO ⚠️'}")
             print()
             print("⚠️ IMPORTANTE:")
             print("• Conserva questo file in un luogo MOLTO sicuro")
@@ -237,7 +436,7 @@ class CryptoMessengerCLI:
             print("• NON caricarlo su cloud non sicuri")
             print("• Considera di salvarlo su USB criptata")
             return True
-            
+        
         except Exception as e:
             print(f"❌ Errore nell'esportazione: {e}")
             return False
@@ -257,29 +456,14 @@ class CryptoMessengerCLI:
             if not password:
                 password = getpass.getpass("🔐 Password della chiave privata (lascia vuoto se non protetta): ")
             
-            pwd = password.encode() if password else None
-            
             try:
-                self.private_key = serialization.load_pem_private_key(
-                    key_data, password=pwd, backend=default_backend()
-                )
-            except Exception as e:
-                if "incorrect password" in str(e).lower() or "bad decrypt" in str(e).lower():
-                    print("❌ Password errata!")
-                    return False
-                else:
-                    # Prova senza password
-                    try:
-                        self.private_key = serialization.load_pem_private_key(
-                            key_data, password=None, backend=default_backend()
-                        )
-                        print("💡 Chiave caricata senza password")
-                    except:
-                        print(f"❌ Errore nel caricare la chiave: {e}")
-                        return False
-            
-            # Estrai chiave pubblica
-            self.public_key = self.private_key.public_key()
+                if password and not self.load_private_key_pem(key_data, password):
+                    print("💡 Chiave caricata senza password")
+                elif not password:
+                    self.load_private_key_pem(key_data)
+            except CryptoMessengerError as e:
+                print(f"❌ {e}")
+                return False
             
             # Chiedi nuova password per salvare
             new_password = getpass.getpass("🔐 Crea una nuova password per proteggere la chiave nel sistema: ")
@@ -300,58 +484,33 @@ class CryptoMessengerCLI:
             print(f"🔍 Impronta digitale: {fingerprint}")
             
             return True
-            
+        
         except Exception as e:
             print(f"❌ Errore nell'importazione: {e}")
             return False
     
-    def get_key_fingerprint_from_key(self, public_key):
-        """Genera fingerprint da oggetto chiave pubblica"""
-        public_pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-        hash_obj = hashlib.sha256(public_pem)
-        fingerprint = hash_obj.hexdigest().upper()
-        return ' '.join([fingerprint[i:i+4] for i in range(0, len(fingerprint), 4)])
-    
     def add_contact(self, name, key_file):
         """Aggiungi nuovo contatto"""
-        if name in self.contacts:
-            print(f"⚠️ Contatto '{name}' già esistente!")
-            return False
-        
         try:
             with open(key_file, 'rb') as f:
                 key_data = f.read()
             
-            public_key = serialization.load_pem_public_key(
-                key_data, backend=default_backend()
-            )
-            
-            # Salva come base64
-            self.contacts[name] = base64.b64encode(key_data).decode()
-            self.save_contacts()
+            contact = self.add_contact_key(name, key_data)
             
-            fingerprint = self.get_key_fingerprint(self.contacts[name])
+            fingerprint = cryptomessage_keyring.format_fingerprint(contact['fingerprint'])
             
-            print(f"✅ Contatto '{name}' aggiunto!")
+            print(f"✅ Contatto '{name}' aggiunto! (chiave {contact['key_type']})")
             print(f"🔍 Impronta digitale: {fingerprint}")
             print("💡 Verifica questa impronta con il contatto tramite chiamata o di persona")
             return True
         
+        except ContactExistsError as e:
+            print(f"⚠️ {e}")
+            return False
         except Exception as e:
             print(f"❌ Errore nell'importazione: {e}")
             return False
     
-    def get_key_fingerprint(self, key_b64):
-        """Genera fingerprint leggibile della chiave"""
-        key_bytes = base64.b64decode(key_b64)
-        hash_obj = hashlib.sha256(key_bytes)
-        fingerprint = hash_obj.hexdigest().upper()
-        # Formatta in blocchi di 4
-        return ' '.join([fingerprint[i:i+4] for i in range(0, len(fingerprint), 4)])
-    
     def list_contacts(self):
         """Lista contatti"""
         if not self.contacts:
@@ -359,219 +518,571 @@ class CryptoMessengerCLI:
             return
         
         print("👥 I tuoi contatti:")
-        for name in self.contacts.keys():
-            fingerprint = self.get_key_fingerprint(self.contacts[name])
-            print(f"  👤 {name}")
+        # Impronte e tipi salvati nella rubrica: una sola query, nessun hash da ricalcolare
+        for name, fingerprint, key_type in self.contacts.entries():
+            fingerprint = cryptomessage_keyring.format_fingerprint(fingerprint)
+            print(f"  👤 {name} ({key_type})")
             print(f"     🔍 {fingerprint[:35]}...")
             print()
     
-    def encrypt_message(self, recipient, message, sign=True):
-        """Cripta messaggio"""
-        # Carica chiave privata se serve firmare
-        if sign:
-            if not self.load_private_key_with_password():
-                return None
+    def get_recipient_key(self, recipient):
+        """Restituisce la chiave pubblica del destinatario (o None)"""
+        try:
+            recipient_key = self.recipient_key(recipient)
+        except ContactNotFoundError:
+            print(f"❌ Contatto '{recipient}' non trovato!")
+            print("💡 Suggerimento: Usa 'Me' per inviare messaggi a te stesso")
+            return None
+        except CryptoMessengerError as e:
+            print(f"❌ {e}")
+            return None
         
+        # Gestione auto-messaggi (messaggio a se stessi)
+        if is_self(recipient):
+            print("💡 Messaggio auto-inviato (a te stesso)")
+        return recipient_key
+    
+    def add_group(self, name, members):
+        """Crea o aggiorna un gruppo di contatti"""
         try:
-            # Gestione auto-messaggi (messaggio a se stessi)
-            if recipient.lower() in ['me', 'io', 'self', 'me stesso']:
-                if not self.public_key:
-                    print("❌ Nessuna chiave pubblica disponibile!")
-                    return None
-                recipient_key = self.public_key
-                print("💡 Messaggio auto-inviato (a te stesso)")
-            else:
-                if recipient not in self.contacts:
-                    print(f"❌ Contatto '{recipient}' non trovato!")
-                    print("💡 Suggerimento: Usa 'Me' per inviare messaggi a te stesso")
-                    return None
-                
-                # Carica chiave pubblica destinatario
-                recipient_key_pem = base64.b64decode(self.contacts[recipient])
-                recipient_key = serialization.load_pem_public_key(
-                    recipient_key_pem, backend=default_backend()
-                )
-            
-            # Genera chiave AES casuale
-            aes_key = os.urandom(32)  # 256 bit
-            iv = os.urandom(16)
-            
-            # Cripta messaggio con AES
-            cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv), backend=default_backend())
-            encryptor = cipher.encryptor()
-            
-            # Padding del messaggio
-            message_bytes = message.encode('utf-8')
-            padding_length = 16 - (len(message_bytes) % 16)
-            padded_message = message_bytes + bytes([padding_length] * padding_length)
-            
-            encrypted_message = encryptor.update(padded_message) + encryptor.finalize()
-            
-            # Cripta chiave AES con RSA
-            encrypted_aes_key = recipient_key.encrypt(
-                aes_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
+            members = self.set_group(name, members)
+        except ContactNotFoundError as e:
+            print(f"❌ Contatti non trovati: {', '.join(e.names)}")
+            return False
+        
+        print(f"✅ Gruppo '{name}' salvato ({len(members)} membri)")
+        return True
+    
+    def list_groups(self):
+        """Lista gruppi"""
+        if not self.groups:
+            print("📭 Nessun gruppo")
+            return
+        
+        print("👥 I tuoi gruppi:")
+        for name, members in self.groups.items():
+            print(f"  📁 {name}: {', '.join(members)}")
+    
+    def resolve_recipients(self, to=None, group=None):
+        """Espande --to e --group in una lista di destinatari senza duplicati"""
+        try:
+            return super().resolve_recipients(to, group)
+        except GroupNotFoundError as e:
+            print(f"❌ {e}")
+            return None
+    
+    def _emit_packet(self, result, label, output_file=None):
+        """Mostra il pacchetto codificato (o lo salva su file)"""
+        encoded = result['encoded']
+        with self._phase('output'):
+            if output_file:
+                # Su file il v3 viene scritto in binario, senza armatura ASCII
+                with open(output_file, 'wb' if isinstance(encoded, bytes) else 'w') as f:
+                    f.write(encoded)
+                print(f"✅ Messaggio criptato per {label}!")
+                print(f"📏 Dimensione: {len(encoded)} byte")
+                print(f"🔒 Cifrario: {result['packet']['cipher']}")
+                if result['signed']:
+                    print("✍️ Firmato digitalmente")
+                print(f"💾 Salvato in: {output_file}")
+                return encoded
             
-            # Firma (opzionale)
-            signature = b""
-            if sign and self.private_key:
-                signature = self.private_key.sign(
-                    encrypted_message,
-                    padding.PSS(
-                        mgf=padding.MGF1(hashes.SHA256()),
-                        salt_length=padding.PSS.MAX_LENGTH
-                    ),
-                    hashes.SHA256()
-                )
-            
-            # Crea pacchetto finale
-            packet = {
-                'version': '2.0',
-                'aes_key': base64.b64encode(encrypted_aes_key).decode(),
-                'iv': base64.b64encode(iv).decode(),
-                'data': base64.b64encode(encrypted_message).decode(),
-                'signature': base64.b64encode(signature).decode() if signature else "",
-                'timestamp': datetime.now().isoformat(),
-                'to': recipient if recipient.lower() not in ['me', 'io', 'self', 'me stesso'] else 'Me'
-            }
-            
-            encrypted_text = base64.b64encode(json.dumps(packet).encode()).decode()
-            
-            print(f"✅ Messaggio criptato per {recipient}!")
-            print(f"📏 Lunghezza: {len(encrypted_text)} caratteri")
-            if signature:
+            print(f"✅ Messaggio criptato per {label}!")
+            print(f"📏 Lunghezza: {len(encoded)} caratteri")
+            print(f"🔒 Cifrario: {result['packet']['cipher']}")
+            if result['signed']:
                 print("✍️ Firmato digitalmente")
             print()
             print("📋 Messaggio criptato:")
             print("-" * 50)
-            print(encrypted_text)
+            print(encoded)
             print("-" * 50)
-            
-            return encrypted_text
+        return encoded
+    
+    def encrypt_message(self, recipient, message, sign=True, fmt='v3', output_file=None, session=False,
+                        archive=False, cipher=None):
+        """Cripta messaggio"""
+        # Carica chiave privata se serve firmare (o per aprire sessioni e archivio)
+        if sign or session or archive:
+            if not self.load_private_key_with_password():
+                return None
+        
+        if session and fmt == 'v2':
+            print("❌ I messaggi di sessione richiedono il formato v3")
+            return None
+        
+        if self.get_recipient_key(recipient) is None:
+            return None
+        
+        try:
+            result = self.encrypt(recipient, message, sign, fmt, armored=not output_file, session=session,
+                                  cipher=cipher)
+            encoded = self._emit_packet(result, recipient, output_file)
+            if session:
+                sid = result['session']
+                mode = 'nuova chiave' if result['new_session'] else f"solo {result['packet']['cipher']}, nessuna operazione RSA"
+                print(f"🔁 Sessione {sid[:8]}: {mode}")
+            if archive:
+                with self._phase('archive'):
+                    self.archive_message('out', result['recipients'], result['packet']['timestamp'], message,
+                                         cryptomessage_archive.packet_hash(result['packet']))
+            return encoded
+        
+        except Exception as e:
+            print(f"❌ Errore nella crittografia: {e}")
+            return None
+    
+    def encrypt_message_multi(self, recipients, message, sign=True, fmt='v3', output_file=None, archive=False,
+                              cipher=None):
+        """Cripta una sola volta per più destinatari"""
+        if sign or archive:
+            if not self.load_private_key_with_password():
+                return None
+        
+        if any(self.get_recipient_key(recipient) is None for recipient in recipients):
+            return None
+        
+        try:
+            result = self.encrypt_multi(recipients, message, sign, fmt, armored=not output_file, cipher=cipher)
+            encoded = self._emit_packet(result, f"{len(result['recipients'])} destinatari", output_file)
+            if archive:
+                with self._phase('archive'):
+                    self.archive_message('out', result['recipients'], result['packet']['timestamp'],
+                                         message, cryptomessage_archive.packet_hash(result['packet']))
+            return encoded
         
         except Exception as e:
             print(f"❌ Errore nella crittografia: {e}")
             return None
     
-    def decrypt_message(self, encrypted_text, password=None):
+    def decrypt_message(self, encrypted_text, password=None, archive=False):
         """Decripta messaggio"""
         if not self.load_private_key_with_password(password):
             return None
         
         try:
-            # Decodifica pacchetto
-            packet_json = base64.b64decode(encrypted_text).decode()
-            packet = json.loads(packet_json)
-            
-            # Estrae componenti
-            encrypted_aes_key = base64.b64decode(packet['aes_key'])
-            iv = base64.b64decode(packet['iv'])
-            encrypted_message = base64.b64decode(packet['data'])
-            signature = base64.b64decode(packet['signature']) if packet.get('signature') else None
-            timestamp = packet.get('timestamp', 'Sconosciuto')
-            sender = packet.get('to', 'Sconosciuto')
-            
-            # Decripta chiave AES con RSA
-            aes_key = self.private_key.decrypt(
-                encrypted_aes_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
+            try:
+                result = self.decrypt(encrypted_text)
+            except RetiredKeyLockedError as e:
+                if not self.unlock_retired_key(e.kid):
+                    return None
+                result = self.decrypt(encrypted_text)
             
-            # Decripta messaggio con AES
-            cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv), backend=default_backend())
-            decryptor = cipher.decryptor()
-            padded_message = decryptor.update(encrypted_message) + decryptor.finalize()
-            
-            # Rimuovi padding
-            padding_length = padded_message[-1]
-            message = padded_message[:-padding_length].decode('utf-8')
-            
-            # Verifica firma se presente
-            signature_valid = False
-            if signature:
-                # Gestione firma per messaggi auto-inviati
-                if sender.lower() in ['me', 'io', 'self', 'me stesso'] or sender == 'Me':
-                    try:
-                        # Per messaggi auto-inviati, usa la chiave pubblica corrente
-                        if self.public_key:
-                            self.public_key.verify(
-                                signature,
-                                encrypted_message,
-                                padding.PSS(
-                                    mgf=padding.MGF1(hashes.SHA256()),
-                                    salt_length=padding.PSS.MAX_LENGTH
-                                ),
-                                hashes.SHA256()
-                            )
-                            signature_valid = True
-                    except:
-                        signature_valid = False
-                elif sender in self.contacts:
-                    try:
-                        sender_key_pem = base64.b64decode(self.contacts[sender])
-                        sender_key = serialization.load_pem_public_key(
-                            sender_key_pem, backend=default_backend()
-                        )
-                        
-                        sender_key.verify(
-                            signature,
-                            encrypted_message,
-                            padding.PSS(
-                                mgf=padding.MGF1(hashes.SHA256()),
-                                salt_length=padding.PSS.MAX_LENGTH
-                            ),
-                            hashes.SHA256()
-                        )
-                        signature_valid = True
-                    except:
-                        signature_valid = False
-            
-            print("✅ Messaggio decriptato!")
-            print(f"📅 Inviato: {timestamp}")
-            if signature:
-                if signature_valid:
-                    print(f"✅ Firma verificata da: {sender}")
-                else:
-                    print("⚠️ Firma non verificata (mittente sconosciuto o firma invalida)")
-            print()
-            print("📝 Messaggio:")
-            print("-" * 50)
-            print(message)
-            print("-" * 50)
+            with self._phase('output'):
+                print("✅ Messaggio decriptato!" + (" (dalla cache)" if result['cached'] else ""))
+                print(f"📅 Inviato: {result['timestamp']}")
+                if result['signed']:
+                    if result['signature_valid']:
+                        print(f"✅ Firma verificata da: {result['sender']}")
+                    else:
+                        print("⚠️ Firma non verificata (mittente sconosciuto o firma invalida)")
+                print()
+                print("📝 Messaggio:")
+                print("-" * 50)
+                print(result['message'])
+                print("-" * 50)
+            
+            if archive:
+                with self._phase('archive'):
+                    self.archive_message('in', [result['sender']] if result['signature_valid'] else [],
+                                         result['timestamp'], result['message'], result['packet_hash'],
+                                         result['signature_valid'])
             
-            return message
+            return result['message']
         
-        except json.JSONDecodeError:
+        except InvalidPacketError:
             print("❌ Formato messaggio non valido")
             return None
         except Exception as e:
             print(f"❌ Impossibile decrittare il messaggio: {e}")
             return None
     
+    def decrypt_batch(self, source, output=None, jobs=None, password=None, archive=False):
+        """Decripta pacchetti separati da a capo, risultati JSONL nello stesso ordine"""
+        if not self.load_private_key_with_password(password):
+            return False
+        
+        message_archive = None
+        if archive:
+            try:
+                message_archive = self.get_archive()
+            except Exception as e:
+                print(f"❌ Impossibile aprire l'archivio: {e}", file=sys.stderr)
+                return False
+        
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+        
+        output = output or sys.stdout
+        jobs = jobs or os.cpu_count() or 1
+        
+        if isinstance(self.private_key, cryptomessage_agent.AgentPrivateKey):
+            # La chiave resta nell'agente: ogni worker apre la sua connessione al socket
+            # e chiede solo gli unwrap e le derivazioni, AES e verifiche restano in parallelo
+            agent = contextlib.nullcontext(self.private_key.socket_path)
+        else:
+            # Senza agente se ne avvia uno temporaneo in questo processo: ai worker
+            # arriva solo il percorso del socket, mai la chiave privata
+            agent = cryptomessage_agent.temporary_agent(self.private_key)
+        
+        failures = 0
+        total = 0
+        archived = 0
+        pending = deque()
+        with agent as agent_socket, ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_batch_worker,
+            initargs=(self.data_dir, agent_socket)
+        ) as executor:
+            def drain(limit):
+                nonlocal failures, archived
+                while len(pending) > limit:
+                    result = pending.popleft().result()
+                    if not result['ok']:
+                        failures += 1
+                    elif message_archive is not None:
+                        # Archiviazione nel processo principale: scritture in sequenza
+                        archived += message_archive.add(
+                            'in', [result['sender']] if result['signature_valid'] else [],
+                            result['timestamp'], result['message'], result['packet_hash'],
+                            result['signature_valid']
+                        )
+                    output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    output.flush()
+            
+            # Finestra limitata di richieste in volo: memoria costante, ordine preservato
+            for index, line in enumerate(source):
+                line = line.strip()
+                if not line:
+                    continue
+                pending.append(executor.submit(_open_batch_line, index, line))
+                total += 1
+                drain(jobs * 4)
+            drain(0)
+        
+        print(f"✅ {total - failures}/{total} messaggi decriptati", file=sys.stderr)
+        if message_archive is not None:
+            print(f"🗄️ {archived} messaggi archiviati", file=sys.stderr)
+        return failures == 0
+    
+    def encrypt_pipe(self, recipient, sign=True, output_file=None):
+        """Cripta stdin in flusso: armatura ASCII su stdout (o file binario con -o)"""
+        output = sys.stdout.buffer
+        # stdout porta i dati: richieste e messaggi vanno su stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            if sign:
+                if not self.load_private_key_with_password():
+                    return False
+            
+            if self.get_recipient_key(recipient) is None:
+                return False
+            
+            try:
+                if output_file:
+                    with open(output_file, 'wb') as dst:
+                        total = self.encrypt_stream(recipient, sys.stdin.buffer, dst, sign=sign)
+                else:
+                    total = self.encrypt_stream(recipient, sys.stdin.buffer, output, sign=sign, armored=True)
+            except Exception as e:
+                print(f"❌ Errore nella crittografia: {e}")
+                return False
+            
+            print(f"✅ Flusso criptato per {recipient}: {total} byte")
+            if output_file:
+                print(f"💾 Salvato in: {output_file}")
+            return True
+    
+    def decrypt_pipe(self, src, password=None):
+        """Decripta in flusso un file a blocchi (binario o armato) da src verso stdout"""
+        output = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr):
+            if not self.load_private_key_with_password(password):
+                return False
+            
+            try:
+                header, total = self.decrypt_stream(src, output, unlock_retired=self.unlock_retired_key)
+                output.flush()
+            except Exception as e:
+                # I blocchi già scritti sono autenticati, ma il flusso è incompleto
+                print(f"❌ Impossibile decrittare il flusso: {e}")
+                return False
+            
+            print(f"✅ Flusso decriptato: {total} byte")
+            if header.get('signed'):
+                if header.get('signature_valid'):
+                    print(f"✅ Firma verificata da: {header['sender']}")
+                else:
+                    print("⚠️ Firma non verificata (mittente sconosciuto o firma invalida)")
+            return True
+    
+    def encrypt_file(self, recipient, input_file, output_file=None, chunk_size=None, sign=False,
+                     detach_sign=False):
+        """Cripta un file a blocchi (memoria costante)"""
+        if not os.path.exists(input_file):
+            print(f"❌ File non trovato: {input_file}")
+            return False
+        
+        if not output_file:
+            output_file = input_file + ".cmsg"
+        
+        if sign or detach_sign:
+            if not self.load_private_key_with_password():
+                return False
+        
+        if self.get_recipient_key(recipient) is None:
+            return False
+        
+        try:
+            with open(input_file, 'rb') as src, open(output_file, 'wb') as dst:
+                # Firma separata: digest dell'output calcolato mentre viene scritto
+                writer = cryptomessage_signature.HashingWriter(dst) if detach_sign else dst
+                total = self.encrypt_stream(recipient, src, writer, chunk_size, sign=sign)
+            if detach_sign:
+                sig_file = output_file + cryptomessage_signature.SIG_SUFFIX
+                with open(sig_file, 'w') as f:
+                    f.write(self.detached_signature(writer.digest(), writer.size))
+            
+            print(f"✅ File criptato per {recipient}!")
+            print(f"📏 Dimensione: {total} byte")
+            if sign:
+                print("✍️ Firmato digitalmente")
+            print(f"💾 Salvato in: {output_file}")
+            if detach_sign:
+                print(f"✍️ Firma separata: {sig_file}")
+            return True
+        
+        except Exception as e:
+            print(f"❌ Errore nella crittografia: {e}")
+            return False
+    
+    def decrypt_file(self, input_file, output_file=None, password=None):
+        """Decripta un file cifrato a blocchi"""
+        if not os.path.exists(input_file):
+            print(f"❌ File non trovato: {input_file}")
+            return False
+        
+        if not self.load_private_key_with_password(password):
+            return False
+        
+        if not output_file:
+            if input_file.endswith(".cmsg"):
+                output_file = input_file[:-len(".cmsg")]
+            else:
+                output_file = input_file + ".dec"
+        
+        # Firma separata accanto al file: verificata prima di decifrare
+        sig_file = input_file + cryptomessage_signature.SIG_SUFFIX
+        if os.path.exists(sig_file) and not self.verify_file(input_file, sig_file):
+            return False
+        
+        try:
+            while True:
+                try:
+                    with open(input_file, 'rb') as src, open(output_file, 'wb') as dst:
+                        header, total = self.decrypt_stream(src, dst)
+                    break
+                except Exception as e:
+                    # Non lasciare in giro output parziale non autenticato
+                    if os.path.exists(output_file):
+                        os.remove(output_file)
+                    if not isinstance(e, RetiredKeyLockedError):
+                        raise
+                    if not self.unlock_retired_key(e.kid):
+                        return False
+            
+            print("✅ File decriptato!")
+            print(f"📅 Inviato: {header.get('timestamp', 'Sconosciuto')}")
+            if header.get('signed'):
+                if header.get('signature_valid'):
+                    print(f"✅ Firma verificata da: {header['sender']}")
+                else:
+                    print("⚠️ Firma non verificata (mittente sconosciuto o firma invalida)")
+            print(f"📏 Dimensione: {total} byte")
+            print(f"💾 Salvato in: {output_file}")
+            return True
+        
+        except Exception as e:
+            print(f"❌ Impossibile decrittare il file: {e}")
+            return False
+    
+    def encrypt_directory(self, recipient, directory, output_file=None, chunk_size=None, sign=False, jobs=None):
+        """Cripta una cartella intera (tar in flusso, blocchi cifrati in parallelo)"""
+        if not os.path.isdir(directory):
+            print(f"❌ Cartella non trovata: {directory}")
+            return False
+        
+        if not output_file:
+            output_file = os.path.basename(os.path.abspath(directory)) + ".tar.cmsg"
+        
+        if sign:
+            if not self.load_private_key_with_password():
+                return False
+        
+        if self.get_recipient_key(recipient) is None:
+            return False
+        
+        try:
+            with open(output_file, 'wb') as dst:
+                total = self.encrypt_dir(recipient, directory, dst, chunk_size, sign, jobs)
+        except Exception as e:
+            # Un archivio incompleto non serve a nessuno
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            print(f"❌ Errore nella crittografia: {e}")
+            return False
+        
+        print(f"✅ Cartella criptata per {recipient}!")
+        print(f"📦 Archivio tar: {total} byte")
+        if sign:
+            print("✍️ Firmato digitalmente")
+        print(f"💾 Salvato in: {output_file}")
+        return True
+    
+    def decrypt_directory(self, input_file, out_dir=None, password=None, jobs=None):
+        """Decripta un archivio creato con encrypt-dir ed estrae la cartella"""
+        if not os.path.exists(input_file):
+            print(f"❌ File non trovato: {input_file}")
+            return False
+        
+        if not self.load_private_key_with_password(password):
+            return False
+        
+        out_dir = out_dir or "."
+        try:
+            while True:
+                try:
+                    with open(input_file, 'rb') as src:
+                        header, names = self.decrypt_dir(src, out_dir, jobs)
+                    break
+                except RetiredKeyLockedError as e:
+                    if not self.unlock_retired_key(e.kid):
+                        return False
+        except Exception as e:
+            print(f"❌ Impossibile decrittare la cartella: {e}")
+            return False
+        
+        print("✅ Cartella decriptata!")
+        print(f"📅 Inviato: {header.get('timestamp', 'Sconosciuto')}")
+        if header.get('signed'):
+            if header.get('signature_valid'):
+                print(f"✅ Firma verificata da: {header['sender']}")
+            else:
+                print("⚠️ Firma non verificata (mittente sconosciuto o firma invalida)")
+        print(f"📦 Archivio tar: {header['size']} byte")
+        print(f"📁 Estratto in {out_dir}: {', '.join(names)}")
+        return True
+    
+    def sign_file(self, input_file, output_file=None):
+        """Crea una firma separata (.sig) di un file qualsiasi"""
+        if not os.path.exists(input_file):
+            print(f"❌ File non trovato: {input_file}")
+            return False
+        
+        if not self.load_private_key_with_password():
+            return False
+        
+        output_file = output_file or input_file + cryptomessage_signature.SIG_SUFFIX
+        try:
+            with open(input_file, 'rb') as src:
+                sig_text = self.sign_stream(src)
+            with open(output_file, 'w') as f:
+                f.write(sig_text)
+            
+            print(f"✍️ File firmato: {input_file}")
+            print(f"💾 Firma salvata in: {output_file}")
+            return True
+        
+        except Exception as e:
+            print(f"❌ Errore nella firma: {e}")
+            return False
+    
+    def verify_file(self, input_file, sig_file=None):
+        """Verifica la firma separata di un file"""
+        sig_file = sig_file or input_file + cryptomessage_signature.SIG_SUFFIX
+        for path in (input_file, sig_file):
+            if not os.path.exists(path):
+                print(f"❌ File non trovato: {path}")
+                return False
+        
+        try:
+            with open(sig_file, 'r') as f:
+                sig_text = f.read()
+            with open(input_file, 'rb') as src:
+                result = self.verify_stream(src, sig_text)
+        except Exception as e:
+            print(f"❌ Impossibile verificare la firma: {e}")
+            return False
+        
+        if result['valid']:
+            print(f"✅ Firma di {os.path.basename(input_file)} verificata da: {result['signer']}")
+            print(f"📅 Firmato: {result['timestamp']}")
+            return True
+        if result['signer']:
+            print(f"❌ Firma NON valida per {result['signer']}: file alterato o firma errata")
+        else:
+            print("⚠️ Firma non verificata (firmatario sconosciuto)")
+        return False
+    
+    def migrate(self, source):
+        """Importa i file dell'account di una versione precedente da una cartella"""
+        if os.path.exists(self.config_file):
+            print(f"⚠️ La cartella dati {self.data_dir} contiene già un account: nulla da importare")
+            return False
+        
+        copied = self.migrate_account(source)
+        if not copied:
+            print(f"📭 Nessun account di una versione precedente in {source}")
+            return False
+        
+        print(f"✅ Importati in {self.data_dir}:")
+        for name in copied:
+            print(f"  📄 {name}")
+        print("💡 Gli originali sono rimasti al loro posto")
+        return True
+    
     def status(self):
         """Mostra status account"""
-        if self.public_key:
+        if self.public_key_b64:
             print("✅ Account configurato e pronto")
             try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-                fingerprint = self.get_key_fingerprint(config['public_key'])
+                fingerprint = self.get_key_fingerprint(self.public_key_b64)
                 print(f"🔍 Impronta: {fingerprint[:35]}...")
+                print(f"🔑 Tipo di chiave: {self.key_type}")
+                if self.kdf:
+                    print(f"🔐 KDF: {cryptomessage_kdf.describe(self.kdf)}")
+                if self.retired_keys:
+                    print(f"🗝️ Chiavi precedenti: {', '.join(self.retired_keys)}")
             except:
                 pass
+            agent_key = self.connect_agent()
+            if agent_key is not None:
+                agent_key.close()
+                print("🔐 Agente attivo: chiave già sbloccata")
         else:
             print("⚠️ Account non configurato")
         
         print(f"👥 Contatti: {len(self.contacts)}")
+        print(f"📁 Dati: {self.data_dir}")
+
+_batch_messenger = None
+
+
+def _init_batch_worker(data_dir, agent_socket):
+    """Inizializza un processo worker del batch: account del processo principale, chiave nell'agente"""
+    global _batch_messenger
+    _batch_messenger = CryptoMessenger(data_dir)
+    _batch_messenger.private_key = cryptomessage_agent.AgentPrivateKey(agent_socket)
+
+
+def _open_batch_line(index, line):
+    """Decripta una riga del batch, senza sollevare eccezioni"""
+    try:
+        result = _batch_messenger.decrypt(line)
+        return dict(index=index, ok=True, **result)
+    except Exception as e:
+        return {'index': index, 'ok': False, 'error': str(e) or type(e).__name__}
+
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -582,6 +1093,8 @@ Esempi di utilizzo:
 
   # Configurazione iniziale
   python cryptomessage_cli.py setup
+  python cryptomessage_cli.py setup --key-type x25519
+  python cryptomessage_cli.py setup --kdf scrypt --unlock-ms 250
   python cryptomessage_cli.py export-key
   python cryptomessage_cli.py export-keypair
 
@@ -595,8 +1108,79 @@ Esempi di utilizzo:
   # Invio messaggio (ora supporta spazi!)
   python cryptomessage_cli.py encrypt Mario Ciao Mario come stai?
 
+  # Più destinatari: payload cifrato e firmato una sola volta
+  python cryptomessage_cli.py encrypt --to Mario,Luigi Riunione alle 15
+  python cryptomessage_cli.py add-group team Mario Luigi Peach
+  python cryptomessage_cli.py encrypt --group team Nuova release pronta
+
   # Ricezione messaggio
-  python cryptomessage_cli.py decrypt "messaggio_criptato_base64..."
+  python cryptomessage_cli.py decrypt "CM3:messaggio_criptato..."
+  python cryptomessage_cli.py decrypt -i messaggio.cm3
+
+  # Flussi da stdin a stdout (armatura ASCII a righe, memoria costante)
+  tar c . | python cryptomessage_cli.py encrypt Mario - | ssh host 'cat > backup.asc'
+  python cryptomessage_cli.py decrypt - < backup.asc | tar x
+
+  # Molti messaggi in una volta (uno per riga, output JSONL)
+  python cryptomessage_cli.py decrypt --batch messaggi.txt > risultati.jsonl
+  cat messaggi.txt | python cryptomessage_cli.py decrypt --batch - -j 8
+
+  # Chiave di sessione: i messaggi successivi non richiedono RSA
+  python cryptomessage_cli.py encrypt Mario Ciao di nuovo --session
+  python cryptomessage_cli.py sessions
+
+  # Archivio locale e ricerca
+  python cryptomessage_cli.py encrypt Mario Ciao Mario --archive
+  python cryptomessage_cli.py decrypt "CM3:..." --archive
+  python cryptomessage_cli.py history --from Mario --since 2026-01-01
+  python cryptomessage_cli.py history --search "riunione venerdì"
+
+  # Dove va il tempo: KDF, RSA, AES, firma, codifica (anche --timings json)
+  python cryptomessage_cli.py decrypt "CM3:..." --timings
+
+  # Cifrario AEAD: scelto da un benchmark (una volta per macchina) o indicato
+  python cryptomessage_cli.py cipher
+  python cryptomessage_cli.py encrypt Mario --cipher chacha20 Ciao Mario
+
+  # Pacchetti già letti riaperti senza RSA né verifica della firma
+  python cryptomessage_cli.py cache on --ttl 24 --max-entries 500
+  python cryptomessage_cli.py cache clear
+
+  # Formato compatto su file / formato v2 per la GUI
+  python cryptomessage_cli.py encrypt Mario -o messaggio.cm3 Testo del messaggio
+  python cryptomessage_cli.py encrypt Mario --format v2 Testo per la GUI
+
+  # File di grandi dimensioni (a blocchi, memoria costante)
+  python cryptomessage_cli.py encrypt-file Mario archivio.tar
+  python cryptomessage_cli.py decrypt-file archivio.tar.cmsg
+
+  # Cartelle intere: tar in flusso, blocchi cifrati in parallelo
+  python cryptomessage_cli.py encrypt-dir Mario progetto/ --sign
+  python cryptomessage_cli.py decrypt-dir progetto.tar.cmsg -o ripristino/
+
+  # Firme in streaming: in coda al file cifrato o separate (.sig)
+  python cryptomessage_cli.py encrypt-file Mario archivio.tar --sign
+  python cryptomessage_cli.py encrypt-file Mario archivio.tar --detach-sign
+  python cryptomessage_cli.py sign rapporto.pdf
+  python cryptomessage_cli.py verify rapporto.pdf rapporto.pdf.sig
+
+  # Agente: password chiesta una sola volta per sessione
+  python cryptomessage_cli.py agent --timeout 900 &
+  python cryptomessage_cli.py agent --stop
+
+  # Servizio JSON-RPC su socket Unix per altri programmi (chiave in memoria)
+  python cryptomessage_cli.py serve --socket ~/.cryptomessenger-rpc/cm.sock -j 8 &
+
+  # Identità di test in parallelo (tutti i core) e pacchetto contatti
+  python cryptomessage_cli.py bulk-setup 500 --out-dir staging --key-type x25519
+  python cryptomessage_cli.py import-contacts staging/contatti.json
+
+  # Benchmark (JSON) per confrontare le versioni
+  python cryptomessage_cli.py bench -o bench.json
+  python cryptomessage_cli.py bench --sizes 16,1M,1G --key-types rsa
+
+  # Account di una versione precedente (file nella cartella indicata)
+  python cryptomessage_cli.py migrate ~/vecchia-cartella
 
   # Status account
   python cryptomessage_cli.py status
@@ -607,6 +1191,29 @@ Esempi di utilizzo:
     
     # Setup
     setup_parser = subparsers.add_parser('setup', help='Configura account iniziale')
+    setup_parser.add_argument('--key-type', choices=cryptomessage_keys.KEY_TYPES,
+                              default=cryptomessage_keys.DEFAULT_KEY_TYPE,
+                              help='Tipo di chiave: rsa (RSA-2048, default) o x25519 (Ed25519 + X25519, più veloce)')
+    setup_parser.add_argument('--kdf', choices=cryptomessage_kdf.KDF_NAMES,
+                              help='KDF della password calibrata su questa macchina (default con --unlock-ms: scrypt)')
+    setup_parser.add_argument('--unlock-ms', type=int,
+                              help=f'Tempo di sblocco obiettivo in ms (default con --kdf: {cryptomessage_kdf.DEFAULT_UNLOCK_MS})')
+    
+    # Bulk setup
+    bulk_parser = subparsers.add_parser('bulk-setup', help='Crea molte identità di test in parallelo')
+    bulk_parser.add_argument('count', type=int, help='Numero di identità')
+    bulk_parser.add_argument('--out-dir', required=True, help='Cartella di destinazione (una sottocartella per identità)')
+    bulk_parser.add_argument('--prefix', default='utente', help='Prefisso dei nomi (default: utente → utente001, ...)')
+    bulk_parser.add_argument('--key-type', choices=cryptomessage_keys.KEY_TYPES,
+                             default=cryptomessage_keys.DEFAULT_KEY_TYPE, help='Tipo di chiave (default: rsa)')
+    bulk_parser.add_argument('--kdf', choices=cryptomessage_kdf.KDF_NAMES, help='KDF della password calibrata (come setup)')
+    bulk_parser.add_argument('--unlock-ms', type=int, help='Tempo di sblocco obiettivo in ms (come setup)')
+    bulk_parser.add_argument('-j', '--jobs', type=int, help='Processi paralleli (default: tutti i core)')
+    
+    # Import contacts
+    import_contacts_parser = subparsers.add_parser('import-contacts', help='Importa un pacchetto contatti (JSON)')
+    import_contacts_parser.add_argument('bundle', help='File del pacchetto (es. contatti.json di bulk-setup)')
+    import_contacts_parser.add_argument('--replace', action='store_true', help='Aggiorna i contatti già presenti')
     
     # Export key
     export_parser = subparsers.add_parser('export-key', help='Esporta chiave pubblica')
@@ -628,15 +1235,127 @@ Esempi di utilizzo:
     # List contacts
     subparsers.add_parser('list-contacts', help='Lista contatti')
     
+    # Groups
+    group_parser = subparsers.add_parser('add-group', help='Crea o aggiorna un gruppo di contatti')
+    group_parser.add_argument('name', help='Nome del gruppo')
+    group_parser.add_argument('members', nargs='+', help='Contatti membri del gruppo')
+    subparsers.add_parser('list-groups', help='Lista gruppi')
+    
     # Encrypt
     encrypt_parser = subparsers.add_parser('encrypt', help='Cripta messaggio')
-    encrypt_parser.add_argument('recipient', help='Nome destinatario')
-    encrypt_parser.add_argument('message', nargs='+', help='Messaggio da criptare (può contenere spazi)')
+    encrypt_parser.add_argument('recipient', nargs='?', help='Nome destinatario (omesso con --to/--group)')
+    encrypt_parser.add_argument('message', nargs='+', help='Messaggio da criptare (può contenere spazi, - per stdin in flusso)')
     encrypt_parser.add_argument('--no-sign', action='store_true', help='Non firmare il messaggio')
+    encrypt_parser.add_argument('--to', help='Più destinatari separati da virgola (es. Mario,Luigi)')
+    encrypt_parser.add_argument('--group', help='Invia a tutti i membri di un gruppo')
+    encrypt_parser.add_argument('--format', choices=['v3', 'v2'], default='v3',
+                                help='Formato pacchetto: v3 binario compatto (default) o v2 JSON per la GUI')
+    encrypt_parser.add_argument('-o', '--output', help='Salva il pacchetto su file (v3 in binario, senza armatura)')
+    encrypt_parser.add_argument('--session', action='store_true',
+                                help='Usa una chiave di sessione con il contatto (RSA solo al primo messaggio)')
+    encrypt_parser.add_argument('--archive', action='store_true', help='Salva il messaggio nell\'archivio locale')
+    encrypt_parser.add_argument('--cipher', choices=sorted(cryptomessage_aead.NAMES),
+                                help='Cifrario AEAD (default: il più veloce su questa macchina, misurato una volta)')
+    encrypt_parser.add_argument('--timings', nargs='?', const='text', choices=['text', 'json'],
+                                help='Tempo e memoria per fase su stderr (text o json)')
     
     # Decrypt
     decrypt_parser = subparsers.add_parser('decrypt', help='Decripta messaggio')
-    decrypt_parser.add_argument('encrypted_message', help='Messaggio criptato (base64)')
+    decrypt_parser.add_argument('encrypted_message', nargs='?', help='Messaggio criptato (CM3:... o base64 v2, - per stdin)')
+    decrypt_parser.add_argument('-i', '--input', help='Leggi il pacchetto da file (anche binario v3 o flusso)')
+    decrypt_parser.add_argument('--batch', metavar='FILE',
+                                help='Decripta un pacchetto per riga da FILE (o - per stdin), output JSONL')
+    decrypt_parser.add_argument('-j', '--jobs', type=int, help='Processi paralleli per --batch (default: tutti i core)')
+    decrypt_parser.add_argument('--archive', action='store_true', help='Salva i messaggi nell\'archivio locale')
+    decrypt_parser.add_argument('--timings', nargs='?', const='text', choices=['text', 'json'],
+                                help='Tempo e memoria per fase su stderr (text o json)')
+    
+    # History
+    history_parser = subparsers.add_parser('history', help='Cerca nei messaggi archiviati')
+    history_parser.add_argument('--from', dest='sender', metavar='NOME', help='Solo messaggi ricevuti da NOME (firma verificata)')
+    history_parser.add_argument('--to', dest='recipient', metavar='NOME', help='Solo messaggi inviati a NOME')
+    history_parser.add_argument('--since', metavar='DATA', help='Dal giorno (AAAA-MM-GG)')
+    history_parser.add_argument('--until', metavar='DATA', help='Fino al giorno incluso (AAAA-MM-GG)')
+    history_parser.add_argument('--search', metavar='TESTO', help='Messaggi che contengono tutte le parole')
+    history_parser.add_argument('-n', '--limit', type=int, default=20, help='Numero massimo di messaggi (default: 20)')
+    
+    # Encrypt file
+    encrypt_file_parser = subparsers.add_parser('encrypt-file', help='Cripta file (a blocchi, anche molto grandi)')
+    encrypt_file_parser.add_argument('recipient', help='Nome destinatario')
+    encrypt_file_parser.add_argument('input_file', help='File da criptare')
+    encrypt_file_parser.add_argument('-o', '--output', help='File di output (default: <file>.cmsg)')
+    encrypt_file_parser.add_argument('--chunk-size', type=int, help='Dimensione dei blocchi in byte (default: 1 MiB)')
+    encrypt_file_parser.add_argument('--sign', action='store_true', help='Firma il file cifrato (firma in coda)')
+    encrypt_file_parser.add_argument('--detach-sign', action='store_true',
+                                     help='Firma separata del file cifrato in <output>.sig')
+    
+    # Decrypt file
+    decrypt_file_parser = subparsers.add_parser('decrypt-file', help='Decripta file cifrato a blocchi')
+    decrypt_file_parser.add_argument('input_file', help='File da decriptare')
+    decrypt_file_parser.add_argument('-o', '--output', help='File di output')
+    
+    # Encrypt / decrypt directory
+    encrypt_dir_parser = subparsers.add_parser('encrypt-dir', help='Cripta una cartella (tar in flusso, blocchi in parallelo)')
+    encrypt_dir_parser.add_argument('recipient', help='Nome destinatario')
+    encrypt_dir_parser.add_argument('directory', help='Cartella da criptare')
+    encrypt_dir_parser.add_argument('-o', '--output', help='File di output (default: <cartella>.tar.cmsg)')
+    encrypt_dir_parser.add_argument('--chunk-size', type=int, help='Dimensione dei blocchi in byte (default: 1 MiB)')
+    encrypt_dir_parser.add_argument('--sign', action='store_true', help='Firma l\'archivio cifrato (firma in coda)')
+    encrypt_dir_parser.add_argument('-j', '--jobs', type=int, help='Thread di cifratura (default: tutti i core)')
+    
+    decrypt_dir_parser = subparsers.add_parser('decrypt-dir', help='Decripta un archivio di encrypt-dir')
+    decrypt_dir_parser.add_argument('input_file', help='Archivio cifrato (.tar.cmsg)')
+    decrypt_dir_parser.add_argument('-o', '--output', help='Cartella in cui estrarre (default: cartella corrente)')
+    decrypt_dir_parser.add_argument('-j', '--jobs', type=int, help='Thread di decifratura (default: tutti i core)')
+    
+    # Sign / verify
+    sign_parser = subparsers.add_parser('sign', help='Firma separata (.sig) di un file qualsiasi')
+    sign_parser.add_argument('input_file', help='File da firmare')
+    sign_parser.add_argument('-o', '--output', help='File di firma (default: <file>.sig)')
+    
+    verify_parser = subparsers.add_parser('verify', help='Verifica la firma separata di un file')
+    verify_parser.add_argument('input_file', help='File firmato')
+    verify_parser.add_argument('sig_file', nargs='?', help='File di firma (default: <file>.sig)')
+    
+    # Agent
+    agent_parser = subparsers.add_parser('agent', help='Avvia agente: chiave sbloccata una volta per sessione')
+    agent_parser.add_argument('--socket', help='Percorso del socket Unix')
+    agent_parser.add_argument('--timeout', type=int,
+                              help='Secondi di inattività prima dello spegnimento (default: 900, 0 = mai)')
+    agent_parser.add_argument('--stop', action='store_true', help='Ferma l\'agente in esecuzione')
+    
+    # Sessions
+    sessions_parser = subparsers.add_parser('sessions', help='Mostra le chiavi di sessione salvate')
+    sessions_parser.add_argument('--clear', action='store_true', help='Cancella tutte le sessioni')
+    
+    # Serve
+    serve_parser = subparsers.add_parser('serve', help='Servizio JSON-RPC su socket Unix (chiave e rubrica in memoria)')
+    serve_parser.add_argument('--socket', help='Percorso del socket Unix')
+    serve_parser.add_argument('-j', '--jobs', type=int, help='Thread per la crittografia (default: tutti i core)')
+    
+    # Bench
+    bench_parser = subparsers.add_parser('bench', help='Benchmark di chiavi, cifratura e firme (output JSON)')
+    cryptomessage_bench.add_arguments(bench_parser)
+    
+    # Cifrario
+    cipher_parser = subparsers.add_parser('cipher', help='Mostra il cifrario AEAD scelto dal benchmark')
+    cipher_parser.add_argument('--bench', action='store_true', help='Ripeti il benchmark su questa macchina')
+    
+    cache_parser = subparsers.add_parser('cache', help='Cache cifrata dei messaggi già decriptati')
+    cache_parser.add_argument('action', nargs='?', choices=['on', 'off', 'clear'],
+                              help='on: attiva (o aggiorna i limiti), off: disattiva e cancella, clear: svuota')
+    cache_parser.add_argument('--ttl', type=float, metavar='ORE', help='Scadenza delle voci in ore (default: 168)')
+    cache_parser.add_argument('--max-entries', type=int, metavar='N', help='Numero massimo di messaggi (default: 1000)')
+    cache_parser.add_argument('--max-mb', type=float, metavar='MB', help='Testo massimo in cache in MB (default: 4)')
+    
+    # KDF
+    kdf_parser = subparsers.add_parser('kdf', help='Mostra o ricalibra la KDF della password')
+    kdf_parser.add_argument('--kdf', choices=cryptomessage_kdf.KDF_NAMES, help='KDF da usare (default: scrypt)')
+    kdf_parser.add_argument('--unlock-ms', type=int,
+                            help=f'Tempo di sblocco obiettivo in ms (default: {cryptomessage_kdf.DEFAULT_UNLOCK_MS})')
+    
+    migrate_parser = subparsers.add_parser('migrate', help='Importa l\'account di una versione precedente')
+    migrate_parser.add_argument('source', help='Cartella con i file cryptomessenger_*.json della versione precedente')
     
     # Status
     subparsers.add_parser('status', help='Mostra status account')
@@ -648,9 +1367,21 @@ Esempi di utilizzo:
         return
     
     cli = CryptoMessengerCLI()
+    exit_code = 0
+    if getattr(args, 'timings', None):
+        cli.enable_timings()
     
     if args.command == 'setup':
-        cli.generate_keys()
+        cli.generate_keys(args.key_type, args.kdf, args.unlock_ms)
+    
+    elif args.command == 'bulk-setup':
+        if not cli.bulk_setup(args.count, args.out_dir, args.key_type, args.prefix, args.jobs, args.kdf,
+                              args.unlock_ms):
+            exit_code = 1
+    
+    elif args.command == 'import-contacts':
+        if not cli.import_contacts_file(args.bundle, args.replace):
+            exit_code = 1
     
     elif args.command == 'export-key':
         cli.export_public_key(args.output)
@@ -667,16 +1398,124 @@ Esempi di utilizzo:
     elif args.command == 'list-contacts':
         cli.list_contacts()
     
+    elif args.command == 'add-group':
+        cli.add_group(args.name, args.members)
+    
+    elif args.command == 'list-groups':
+        cli.list_groups()
+    
     elif args.command == 'encrypt':
-        # Unisce tutte le parole del messaggio con spazi
-        message = ' '.join(args.message)
-        cli.encrypt_message(args.recipient, message, not args.no_sign)
+        if args.session and (args.to or args.group):
+            parser.error("--session vale solo per un singolo destinatario")
+        elif args.to or args.group:
+            # Con --to/--group il primo argomento posizionale fa parte del messaggio
+            words = ([args.recipient] if args.recipient else []) + args.message
+            if words == ['-']:
+                parser.error("il flusso da stdin (-) vale per un solo destinatario")
+            recipients = cli.resolve_recipients(args.to, args.group)
+            if recipients:
+                cli.encrypt_message_multi(recipients, ' '.join(words), not args.no_sign,
+                                          args.format, args.output, archive=args.archive, cipher=args.cipher)
+        elif not args.recipient:
+            parser.error("specifica un destinatario oppure --to/--group")
+        elif args.message == ['-']:
+            # Messaggio da stdin in flusso (memoria costante)
+            if args.session or args.archive or args.format == 'v2' or args.cipher:
+                parser.error("con - (stdin) non valgono --session, --archive, --cipher e --format v2")
+            if not cli.encrypt_pipe(args.recipient, not args.no_sign, args.output):
+                exit_code = 1
+        else:
+            # Unisce tutte le parole del messaggio con spazi
+            message = ' '.join(args.message)
+            cli.encrypt_message(args.recipient, message, not args.no_sign, args.format, args.output,
+                                session=args.session, archive=args.archive, cipher=args.cipher)
     
     elif args.command == 'decrypt':
-        cli.decrypt_message(args.encrypted_message)
+        if args.batch:
+            if args.batch == '-':
+                ok = cli.decrypt_batch(sys.stdin, jobs=args.jobs, archive=args.archive)
+            else:
+                with open(args.batch, 'r') as f:
+                    ok = cli.decrypt_batch(f, jobs=args.jobs, archive=args.archive)
+            if not ok:
+                exit_code = 1
+        elif args.input or args.encrypted_message == '-':
+            with (open(args.input, 'rb') if args.input else contextlib.nullcontext(sys.stdin.buffer)) as f:
+                if cryptomessage_armor.is_stream(f):
+                    # Flusso a blocchi (encrypt DEST -): decifrato su stdout in memoria costante
+                    if not cli.decrypt_pipe(f):
+                        exit_code = 1
+                else:
+                    cli.decrypt_message(f.read(), archive=args.archive)
+        elif args.encrypted_message:
+            cli.decrypt_message(args.encrypted_message, archive=args.archive)
+        else:
+            parser.error("specifica il messaggio criptato oppure --input")
+    
+    elif args.command == 'history':
+        cli.history(args.sender, args.recipient, args.since, args.until, args.search, args.limit)
+    
+    elif args.command == 'encrypt-file':
+        cli.encrypt_file(args.recipient, args.input_file, args.output, args.chunk_size,
+                         args.sign, args.detach_sign)
+    
+    elif args.command == 'decrypt-file':
+        cli.decrypt_file(args.input_file, args.output)
+    
+    elif args.command == 'encrypt-dir':
+        if not cli.encrypt_directory(args.recipient, args.directory, args.output, args.chunk_size, args.sign,
+                                     args.jobs):
+            exit_code = 1
     
+    elif args.command == 'decrypt-dir':
+        if not cli.decrypt_directory(args.input_file, args.output, jobs=args.jobs):
+            exit_code = 1
+    
+    elif args.command == 'sign':
+        if not cli.sign_file(args.input_file, args.output):
+            exit_code = 1
+    
+    elif args.command == 'verify':
+        if not cli.verify_file(args.input_file, args.sig_file):
+            exit_code = 1
+    
+    elif args.command == 'agent':
+        if args.stop:
+            cli.stop_agent(args.socket)
+        else:
+            cli.run_agent(args.socket, args.timeout)
+    
+    elif args.command == 'sessions':
+        cli.list_sessions(args.clear)
+    
+    elif args.command == 'serve':
+        if not cli.serve(args.socket, args.jobs):
+            exit_code = 1
+    
+    elif args.command == 'bench':
+        if not cryptomessage_bench.main(args):
+            sys.exit(1)
+    
+    elif args.command == 'cipher':
+        cli.show_cipher(args.bench)
+    
+    elif args.command == 'cache':
+        cli.decrypt_cache(args.action, args.ttl, args.max_entries, args.max_mb)
+    
+    elif args.command == 'kdf':
+        if not cli.configure_kdf(args.kdf, args.unlock_ms):
+            exit_code = 1
+    
+    elif args.command == 'migrate':
+        if not cli.migrate(args.source):
+            exit_code = 1
     elif args.command == 'status':
         cli.status()
+    
+    if cli.timings is not None:
+        cli.timings.report(args.timings)
+    if exit_code:
+        sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
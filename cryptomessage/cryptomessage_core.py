@@ -0,0 +1,1443 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Core - Libreria senza effetti collaterali sul terminale
+Nessuna stampa, nessuna richiesta di password, nessun sys.exit: i metodi
+restituiscono dizionari e sollevano eccezioni tipizzate (CryptoMessengerError).
+La CLI è uno strato di presentazione sopra questa classe.
+
+Uso in-process (le chiavi restano caricate tra un messaggio e l'altro):
+
+    from cryptomessage_core import CryptoMessenger, PasswordRequiredError
+
+    messenger = CryptoMessenger()
+    messenger.unlock("password")
+    sent = messenger.encrypt("Mario", "Ciao Mario!")
+    print(sent['encoded'])
+    received = messenger.decrypt(sent['encoded'])
+"""
+
+import base64
+import contextlib
+import hashlib
+import importlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import cryptomessage_keyring
+import cryptomessage_keys
+import cryptomessage_packet
+import cryptomessage_paths
+
+
+class _LazyModule:
+    """Modulo importato al primo utilizzo: --help, status e list-contacts
+    non caricano mai cryptography"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+padding = _LazyModule("cryptography.hazmat.primitives.asymmetric.padding")
+serialization = _LazyModule("cryptography.hazmat.primitives.serialization")
+hashes = _LazyModule("cryptography.hazmat.primitives.hashes")
+ciphers = _LazyModule("cryptography.hazmat.primitives.ciphers")
+algorithms = _LazyModule("cryptography.hazmat.primitives.ciphers.algorithms")
+modes = _LazyModule("cryptography.hazmat.primitives.ciphers.modes")
+backends = _LazyModule("cryptography.hazmat.backends")
+cryptomessage_aead = _LazyModule("cryptomessage_aead")
+cryptomessage_agent = _LazyModule("cryptomessage_agent")
+cryptomessage_archive = _LazyModule("cryptomessage_archive")
+cryptomessage_armor = _LazyModule("cryptomessage_armor")
+cryptomessage_bulk = _LazyModule("cryptomessage_bulk")
+cryptomessage_cache = _LazyModule("cryptomessage_cache")
+cryptomessage_kdf = _LazyModule("cryptomessage_kdf")
+cryptomessage_session = _LazyModule("cryptomessage_session")
+cryptomessage_signature = _LazyModule("cryptomessage_signature")
+cryptomessage_stream = _LazyModule("cryptomessage_stream")
+cryptomessage_timings = _LazyModule("cryptomessage_timings")
+cryptomessage_server = _LazyModule("cryptomessage_server")
+
+SELF_ALIASES = ['me', 'io', 'self', 'me stesso']
+
+# Letture del flusso tar in decrypt_dir: il buffer di tarfile viene ricopiato a
+# ogni header da 512 byte, quindi né troppo piccolo (chiamate) né troppo grande (copie)
+TAR_READ_BUFSIZE = 64 * 1024
+
+
+def is_self(name):
+    """True se il destinatario indica il proprio account"""
+    return name.lower() in SELF_ALIASES or name == 'Me'
+
+
+def recipient_label(name):
+    """Nome del destinatario come appare nei pacchetti"""
+    return 'Me' if is_self(name) else name
+
+
+def _safe_tar_members(archive):
+    """Membri del tar da estrarre, senza percorsi assoluti, '..' o dispositivi
+    (per Python senza tarfile.data_filter)"""
+    for member in archive:
+        parts = member.name.replace('\\', '/').split('/')
+        if member.name.startswith('/') or '..' in parts:
+            raise ValueError(f"Percorso non consentito nell'archivio: {member.name}")
+        if member.islnk() or member.issym():
+            target = member.linkname.replace('\\', '/')
+            if target.startswith('/') or '..' in target.split('/'):
+                raise ValueError(f"Collegamento non consentito nell'archivio: {member.name}")
+        if member.isdev():
+            continue
+        yield member
+
+
+# Errori
+
+class CryptoMessengerError(Exception):
+    """Errore generico di CryptoMessenger"""
+
+
+class AccountNotConfiguredError(CryptoMessengerError):
+    """Nessun account configurato in questa cartella dati"""
+
+
+class PasswordRequiredError(CryptoMessengerError):
+    """La chiave privata è cifrata e nessun agente la custodisce"""
+
+
+class RetiredKeyLockedError(PasswordRequiredError):
+    """Il pacchetto è per una chiave ritirata non ancora sbloccata (vedi unlock_retired)"""
+
+    def __init__(self, kid):
+        self.kid = kid
+        super().__init__(f"Il messaggio è per la chiave ritirata {kid}: serve la sua password")
+
+
+class WrongPasswordError(CryptoMessengerError):
+    """Password errata o chiave privata corrotta"""
+
+
+class InvalidKeyError(CryptoMessengerError, ValueError):
+    """File chiave non valido"""
+
+
+class ContactNotFoundError(CryptoMessengerError, LookupError):
+    """Contatto (o contatti) non presente in rubrica"""
+
+    def __init__(self, names):
+        self.names = [names] if isinstance(names, str) else list(names)
+        super().__init__(f"Contatto non trovato: {', '.join(self.names)}")
+
+
+class ContactExistsError(CryptoMessengerError):
+    """Esiste già un contatto con questo nome"""
+
+
+class GroupNotFoundError(CryptoMessengerError, LookupError):
+    """Gruppo non presente"""
+
+
+class InvalidPacketError(CryptoMessengerError, ValueError):
+    """Pacchetto non decodificabile"""
+
+
+class NotForThisKeyError(CryptoMessengerError, ValueError):
+    """Il pacchetto non è indirizzato alla chiave di questo account"""
+
+
+class UnknownSessionError(CryptoMessengerError, ValueError):
+    """Messaggio di sessione di cui non si conosce la chiave"""
+
+
+class DecryptionError(CryptoMessengerError, ValueError):
+    """Decifratura o autenticazione non riuscita"""
+
+
+class CryptoMessenger:
+    """Account, rubrica e operazioni crittografiche senza I/O sul terminale"""
+
+    def __init__(self, data_dir=None):
+        # File dell'account nella cartella dati (vedi cryptomessage_paths)
+        if data_dir is None:
+            data_dir = cryptomessage_paths.data_dir()
+        self.data_dir = data_dir
+        self.config_file = os.path.join(self.data_dir, "cryptomessenger_config.json")
+        self.contacts_file = os.path.join(self.data_dir, "cryptomessenger_contacts.db")
+        self.legacy_contacts_file = os.path.join(self.data_dir, "cryptomessenger_contacts.json")
+        self.private_key = None
+        self.public_key_b64 = None
+        self._public_key = None
+        self.key_type = cryptomessage_keys.DEFAULT_KEY_TYPE
+        self.kdf = None
+        # Chiavi precedenti dell'account (key id -> voce della configurazione)
+        self.retired_keys = {}
+        self._retired_private = {}
+        self.groups_file = os.path.join(self.data_dir, "cryptomessenger_groups.json")
+        self.sessions_file = os.path.join(self.data_dir, "cryptomessenger_sessions.bin")
+        self.archive_file = os.path.join(self.data_dir, "cryptomessenger_archive.bin")
+        self.archive_index_file = os.path.join(self.data_dir, "cryptomessenger_archive.db")
+        self.cipher_file = os.path.join(self.data_dir, "cryptomessenger_cipher.json")
+        self._cipher_choice = None
+        self.cache_settings_file = os.path.join(self.data_dir, "cryptomessenger_cache.json")
+        self.cache_file = os.path.join(self.data_dir, "cryptomessenger_cache.db")
+        self._sessions = None
+        self._archive = None
+        self._decrypt_cache = None
+        self.timings = None
+        self._contacts = None
+        self._groups = None
+        # Sessioni e archivio condivisi tra thread (modalità serve)
+        self._state_lock = threading.RLock()
+
+        # Solo lettura del JSON: chiavi e rubrica vengono analizzate quando servono
+        self.load_config()
+
+    @property
+    def public_key(self):
+        """Chiave pubblica dell'account, analizzata al primo utilizzo"""
+        if self._public_key is None and self.public_key_b64:
+            try:
+                self._public_key = cryptomessage_keys.load_pem_public_key(
+                    base64.b64decode(self.public_key_b64)
+                )
+            except:
+                pass
+        return self._public_key
+
+    @public_key.setter
+    def public_key(self, public_key):
+        self._public_key = public_key
+        self.public_key_b64 = None
+        if public_key is not None:
+            public_pem = public_key.public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo
+            )
+            self.public_key_b64 = base64.b64encode(public_pem).decode()
+
+    @property
+    def contacts(self):
+        """Rubrica, caricata al primo utilizzo"""
+        if self._contacts is None:
+            self.load_contacts()
+        return self._contacts
+
+    @property
+    def groups(self):
+        """Gruppi, caricati al primo utilizzo"""
+        if self._groups is None:
+            self.load_groups()
+        return self._groups
+
+    @property
+    def is_configured(self):
+        return bool(self.public_key_b64)
+
+    @property
+    def is_unlocked(self):
+        return self.private_key is not None
+
+    def enable_timings(self):
+        """Attiva la misura di tempo e memoria per fase (--timings)"""
+        self.timings = cryptomessage_timings.PhaseTimings()
+
+    def _phase(self, name):
+        """Contesto che misura una fase, se --timings è attivo"""
+        if self.timings is None:
+            return contextlib.nullcontext()
+        return self.timings.phase(name)
+
+    # Configurazione e file
+
+    def load_config(self):
+        """Carica configurazione"""
+        if os.path.exists(self.config_file):
+            try:
+                with open(self.config_file, 'r') as f:
+                    config = json.load(f)
+
+                self.public_key_b64 = config['public_key']
+                self.key_type = config.get('key_type', cryptomessage_keys.DEFAULT_KEY_TYPE)
+                self.kdf = config.get('kdf')
+                self.retired_keys = config.get('retired_keys', {})
+            except:
+                pass
+
+    def migrate_account(self, source):
+        """Importa l'account di una versione precedente dalla cartella source
+
+        Restituisce i nomi dei file copiati (nessuno se la cartella dati ha
+        già un account o se source non contiene un account).
+        """
+        copied = cryptomessage_paths.migrate_legacy(self.data_dir, source)
+        if copied:
+            self.load_config()
+        return copied
+
+    def load_contacts(self):
+        """Carica rubrica (importa una volta il vecchio file JSON)"""
+        self._contacts = cryptomessage_keyring.SQLiteKeyring(self.contacts_file)
+        self._contacts.load(self.legacy_contacts_file)
+
+    def load_groups(self):
+        """Carica gruppi di contatti"""
+        self._groups = {}
+        if os.path.exists(self.groups_file):
+            try:
+                with open(self.groups_file, 'r') as f:
+                    self._groups = json.load(f)
+            except:
+                self._groups = {}
+
+    def save_config(self, config):
+        """Salva configurazione"""
+        cryptomessage_paths.ensure_dir(self.data_dir)
+        with open(self.config_file, 'w') as f:
+            json.dump(config, f)
+
+    def save_contacts(self):
+        """Salva rubrica"""
+        self.contacts.save()
+
+    def save_groups(self):
+        """Salva gruppi di contatti"""
+        cryptomessage_paths.ensure_dir(self.data_dir)
+        with open(self.groups_file, 'w') as f:
+            json.dump(self.groups, f)
+
+    # Chiavi dell'account
+
+    def unlock(self, password=None, use_agent=True):
+        """Carica la chiave privata (dall'agente o con la password)
+
+        Solleva PasswordRequiredError se serve una password e non è stata
+        fornita, WrongPasswordError se la password è errata.
+        """
+        if self.private_key:
+            if use_agent or not isinstance(self.private_key, cryptomessage_agent.AgentPrivateKey):
+                return self.private_key
+            self.private_key = None
+
+        if not os.path.exists(self.config_file):
+            raise AccountNotConfiguredError("Nessun account configurato!")
+
+        # Se un agente custodisce già la chiave sbloccata, niente password
+        if use_agent and not password:
+            with self._phase('agent'):
+                agent_key = self.connect_agent()
+            if agent_key:
+                self.private_key = agent_key
+                return self.private_key
+
+        if not password:
+            raise PasswordRequiredError("Password dell'account richiesta")
+
+        with self._phase('config_read'):
+            with open(self.config_file, 'r') as f:
+                config = json.load(f)
+
+        with self._phase('kdf'):
+            self.private_key = self._decrypt_private_key(config, password)
+        return self.private_key
+
+    def _decrypt_private_key(self, entry, password):
+        """Chiave privata di una voce della configurazione (attuale o ritirata)"""
+        # Derivazione della chiave dalla password (KDF) e analisi della chiave
+        try:
+            if entry.get('kdf'):
+                # KDF calibrata (vedi cryptomessage_kdf)
+                private_der = cryptomessage_kdf.decrypt_private_key(
+                    entry['private_key'], password.encode(), entry['kdf']
+                )
+                return cryptomessage_keys.load_der_private_key(private_der)
+            return cryptomessage_keys.load_pem_private_key(
+                base64.b64decode(entry['private_key']),
+                password=password.encode()
+            )
+        except Exception as e:
+            raise WrongPasswordError(f"Password errata o chiave corrotta: {e}") from e
+
+    def unlock_retired(self, kid, password):
+        """Sblocca una chiave ritirata (con la password che aveva quando era attiva)"""
+        if kid not in self.retired_keys:
+            raise NotForThisKeyError(f"Nessuna chiave ritirata con id {kid}")
+        if kid not in self._retired_private:
+            if not password:
+                raise RetiredKeyLockedError(kid)
+            self._retired_private[kid] = self._decrypt_private_key(self.retired_keys[kid], password)
+        return self._retired_private[kid]
+
+    def lock(self):
+        """Dimentica la chiave privata e le chiavi derivate"""
+        self.private_key = None
+        self._retired_private = {}
+        self._sessions = None
+        self._close_decrypt_cache()
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def connect_agent(self, socket_path=None):
+        """Collega l'agente se attivo e se custodisce la chiave di questo account"""
+        agent_key = cryptomessage_agent.connect(socket_path)
+        if agent_key is None:
+            return None
+        if self.public_key_b64 and agent_key.ping() != self.get_key_id(self.public_key_b64):
+            agent_key.close()
+            return None
+        return agent_key
+
+    def derive_local_key(self, info):
+        """Chiave simmetrica per dati locali, derivata dalla chiave privata sbloccata"""
+        self.unlock()
+        if isinstance(self.private_key, cryptomessage_agent.AgentPrivateKey):
+            return self.private_key.derive(info)
+        return cryptomessage_agent.derive_key(self.private_key, info)
+
+    def create_account(self, password, key_type=cryptomessage_keys.DEFAULT_KEY_TYPE, kdf=None, unlock_ms=None):
+        """Genera e salva un nuovo keypair, restituisce l'impronta
+
+        Con kdf ('scrypt' o 'pbkdf2') o unlock_ms la KDF viene calibrata su questa
+        macchina, altrimenti si usa la cifratura predefinita della libreria.
+        """
+        self.private_key = cryptomessage_keys.generate_private_key(key_type)
+        self.public_key = self.private_key.public_key()
+        calibrated = self.calibrate_kdf(kdf, unlock_ms) if kdf or unlock_ms else None
+        self.save_keys_with_password(password, calibrated)
+        return self.get_key_fingerprint_from_key(self.public_key)
+
+    def calibrate_kdf(self, name=None, target_ms=None):
+        """Parametri KDF per cui lo sblocco su questa macchina dura circa target_ms
+
+        Il tempo di analisi della chiave privata (non trascurabile per RSA) viene
+        sottratto dall'obiettivo: la KDF riceve solo il tempo che resta.
+        """
+        name = name or cryptomessage_kdf.DEFAULT_KDF
+        target_ms = target_ms or cryptomessage_kdf.DEFAULT_UNLOCK_MS
+        if isinstance(self.private_key, cryptomessage_agent.AgentPrivateKey) or not self.private_key:
+            raise PasswordRequiredError("La calibrazione richiede la chiave sbloccata con la password")
+
+        private_der = self.private_key.private_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        start = time.perf_counter()
+        cryptomessage_keys.load_der_private_key(private_der)
+        parse_ms = (time.perf_counter() - start) * 1000
+
+        kdf = cryptomessage_kdf.calibrate(name, max(1, round(target_ms - parse_ms)))
+        kdf['target_ms'] = target_ms
+        kdf['measured_ms'] += round(parse_ms)
+        return kdf
+
+    def save_keys_with_password(self, password, kdf=None):
+        """Salva chiavi con cifratura
+
+        Senza kdf vengono riusati i parametri già salvati (con un nuovo sale).
+        Se la chiave cambia (nuovo setup, import-keypair) la precedente resta
+        in 'retired_keys', cifrata con la sua password: i messaggi già
+        ricevuti restano leggibili.
+        """
+        kdf = kdf or self.kdf
+        self.key_type = cryptomessage_keys.key_type_of(self.private_key)
+        config = {
+            'public_key': base64.b64encode(self.public_key_pem()).decode(),
+            'key_type': self.key_type,
+            'created': datetime.now().isoformat()
+        }
+
+        retired = {}
+        if os.path.exists(self.config_file):
+            try:
+                with open(self.config_file, 'r') as f:
+                    previous = json.load(f)
+                retired = previous.get('retired_keys', {})
+                if previous.get('public_key') and previous['public_key'] != config['public_key']:
+                    entry = {name: previous[name] for name in ('public_key', 'private_key', 'key_type', 'kdf', 'created')
+                             if name in previous}
+                    entry['retired'] = datetime.now().isoformat()
+                    retired[self.get_key_id(previous['public_key'])] = entry
+            except (OSError, ValueError, KeyError):
+                pass
+        # Una chiave ritirata reimportata torna attiva
+        retired.pop(self.get_key_id(config['public_key']), None)
+        if retired:
+            config['retired_keys'] = retired
+
+        # Cifra chiave privata con password
+        if kdf:
+            private_der = self.private_key.private_bytes(
+                encoding=serialization.Encoding.DER,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption()
+            )
+            config['private_key'], config['kdf'] = cryptomessage_kdf.encrypt_private_key(
+                private_der, password.encode(), kdf
+            )
+        else:
+            private_pem = self.private_key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.BestAvailableEncryption(password.encode())
+            )
+            config['private_key'] = base64.b64encode(private_pem).decode()
+
+        self.save_config(config)
+        self.kdf = config.get('kdf')
+        self.retired_keys = retired
+        self._retired_private = {}
+
+    def public_key_pem(self):
+        """Chiave pubblica dell'account in PEM"""
+        if not self.public_key:
+            raise AccountNotConfiguredError("Nessuna chiave pubblica disponibile!")
+        return self.public_key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+
+    def private_key_pem(self, export_password=None):
+        """Chiave privata in PEM (cifrata se è indicata una password)"""
+        if isinstance(self.private_key, cryptomessage_agent.AgentPrivateKey) or not self.private_key:
+            raise PasswordRequiredError("L'esportazione richiede la chiave sbloccata con la password")
+        if export_password:
+            encryption = serialization.BestAvailableEncryption(export_password.encode())
+        else:
+            encryption = serialization.NoEncryption()
+        return self.private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=encryption
+        )
+
+    def load_private_key_pem(self, key_data, password=None):
+        """Analizza un keypair esportato e lo rende la chiave corrente (non salva)
+
+        Restituisce True se il file era protetto da password.
+        """
+        protected = True
+        try:
+            private_key = cryptomessage_keys.load_pem_private_key(
+                key_data, password=password.encode() if password else None
+            )
+        except TypeError as e:
+            if not password:
+                raise PasswordRequiredError("La chiave privata è protetta da password") from e
+            # Password indicata per una chiave in chiaro
+            private_key = cryptomessage_keys.load_pem_private_key(key_data, password=None)
+            protected = False
+        except ValueError as e:
+            message = str(e).lower()
+            if "incorrect password" in message or "bad decrypt" in message:
+                raise WrongPasswordError("Password errata!") from e
+            raise InvalidKeyError(f"Chiave non valida: {e}") from e
+        if not password:
+            protected = False
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        return protected
+
+    def get_key_fingerprint_from_key(self, public_key):
+        """Genera fingerprint da oggetto chiave pubblica"""
+        public_pem = public_key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        fingerprint = hashlib.sha256(public_pem).hexdigest().upper()
+        return cryptomessage_keyring.format_fingerprint(fingerprint)
+
+    def get_key_fingerprint(self, key_b64):
+        """Genera fingerprint leggibile della chiave"""
+        fingerprint = cryptomessage_keyring.compute_fingerprint(key_b64)
+        return cryptomessage_keyring.format_fingerprint(fingerprint)
+
+    def get_key_id(self, key_b64):
+        """Identificativo breve della chiave (prefisso dell'impronta)"""
+        return hashlib.sha256(base64.b64decode(key_b64)).hexdigest()[:16]
+
+    def get_key_id_from_key(self, public_key):
+        """Identificativo breve da oggetto chiave pubblica"""
+        public_pem = public_key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        return hashlib.sha256(public_pem).hexdigest()[:16]
+
+    # Rubrica e gruppi
+
+    def add_contact_key(self, name, key_data, replace=False):
+        """Aggiunge un contatto dalla sua chiave pubblica PEM"""
+        if name in self.contacts and not replace:
+            raise ContactExistsError(f"Contatto '{name}' già esistente!")
+        try:
+            public_key = cryptomessage_keys.load_pem_public_key(key_data)
+        except Exception as e:
+            raise InvalidKeyError(f"Chiave pubblica non valida: {e}") from e
+
+        # Salva come base64, con impronta e chiave già analizzata
+        self.contacts.add(name, base64.b64encode(key_data).decode(), public_key)
+        self.save_contacts()
+        return {
+            'name': name,
+            'fingerprint': self.contacts.fingerprint(name),
+            'key_type': self.contacts.key_type(name),
+        }
+
+    def import_contacts(self, bundle_text, replace=False):
+        """Importa un pacchetto contatti (vedi cryptomessage_bulk) in una sola transazione
+
+        Restituisce {'added', 'replaced', 'skipped'} (liste di nomi). La propria
+        chiave e, senza replace, i nomi già presenti vengono saltati.
+        """
+        try:
+            entries = cryptomessage_bulk.read_bundle(bundle_text)
+        except ValueError as e:
+            raise InvalidKeyError(str(e)) from e
+
+        own_fingerprint = cryptomessage_keyring.compute_fingerprint(self.public_key_b64) if self.public_key_b64 else None
+        existing = set(self.contacts.keys())
+        result = {'added': [], 'replaced': [], 'skipped': []}
+        rows = []
+        for entry in entries:
+            name = entry['name']
+            if entry['fingerprint'] == own_fingerprint or (name in existing and not replace):
+                result['skipped'].append(name)
+                continue
+            try:
+                cryptomessage_keys.load_pem_public_key(entry['public_key'].encode('ascii'))
+            except Exception as e:
+                raise InvalidKeyError(f"Chiave pubblica non valida per {name}: {e}") from e
+            result['replaced' if name in existing else 'added'].append(name)
+            rows.append((name, base64.b64encode(entry['public_key'].encode('ascii')).decode(), entry['fingerprint']))
+
+        self.contacts.add_many(rows)
+        return result
+
+    def contact_list(self):
+        """Contatti come dizionari (nome, impronta, tipo di chiave)"""
+        return [
+            {'name': name, 'fingerprint': fingerprint, 'key_type': key_type}
+            for name, fingerprint, key_type in self.contacts.entries()
+        ]
+
+    def recipient_key(self, recipient):
+        """Chiave pubblica del destinatario ('Me' e alias indicano il proprio account)"""
+        if is_self(recipient):
+            if not self.public_key:
+                raise AccountNotConfiguredError("Nessuna chiave pubblica disponibile!")
+            return self.public_key
+        if recipient not in self.contacts:
+            raise ContactNotFoundError(recipient)
+        # Chiave pubblica destinatario (analizzata una sola volta)
+        return self.contacts.public_key(recipient)
+
+    def set_group(self, name, members):
+        """Crea o aggiorna un gruppo di contatti"""
+        missing = [m for m in members if m not in self.contacts and not is_self(m)]
+        if missing:
+            raise ContactNotFoundError(missing)
+        self.groups[name] = list(dict.fromkeys(members))
+        self.save_groups()
+        return self.groups[name]
+
+    def resolve_recipients(self, to=None, group=None):
+        """Espande --to e --group in una lista di destinatari senza duplicati"""
+        recipients = []
+        if group:
+            if group not in self.groups:
+                raise GroupNotFoundError(f"Gruppo '{group}' non trovato!")
+            recipients.extend(self.groups[group])
+        if to:
+            recipients.extend(r.strip() for r in to.split(',') if r.strip())
+        return list(dict.fromkeys(recipients))
+
+    # Sessioni e archivio
+
+    def get_session_store(self):
+        """Sessioni salvate (richiede la chiave privata caricata)"""
+        with self._state_lock:
+            if self._sessions is None:
+                store_key = self.derive_local_key("sessions")
+                self._sessions = cryptomessage_session.SessionStore(self.sessions_file, store_key).load()
+            return self._sessions
+
+    def get_archive(self):
+        """Archivio dei messaggi (richiede la chiave privata caricata)"""
+        if self._archive is None:
+            cryptomessage_paths.ensure_dir(self.data_dir)
+            self._archive = cryptomessage_archive.MessageArchive(
+                self.archive_file,
+                self.archive_index_file,
+                self.derive_local_key("archive"),
+                self.derive_local_key("archive-search")
+            ).open()
+        return self._archive
+
+    def archive(self, direction, contacts, timestamp, message, packet_id, signature_valid=None):
+        """Salva un messaggio nell'archivio; False se era già presente"""
+        return self.get_archive().add(direction, contacts, timestamp, message, packet_id, signature_valid)
+
+    def search_archive(self, sender=None, recipient=None, since=None, until=None, search=None, limit=None):
+        """Messaggi archiviati che soddisfano i filtri (date ISO, AAAA-MM-GG)"""
+        try:
+            since = self._parse_date(since) if since else None
+            until = self._parse_date(until, end=True) if until else None
+        except ValueError as e:
+            raise CryptoMessengerError("Data non valida: usa il formato AAAA-MM-GG o AAAA-MM-GGTHH:MM") from e
+
+        if not os.path.exists(self.archive_index_file):
+            return []
+
+        direction = 'in' if sender else 'out' if recipient else None
+        return self.get_archive().query(
+            direction=direction,
+            contact=sender or recipient,
+            since=since,
+            until=until,
+            search=search,
+            limit=limit
+        )
+
+    def _parse_date(self, value, end=False):
+        """Data ISO per i filtri; una data senza ora vale tutto il giorno"""
+        parsed = datetime.fromisoformat(value)
+        if end and len(value) <= 10:
+            parsed += timedelta(days=1)
+        return parsed.isoformat()
+
+    def get_decrypt_cache(self):
+        """Cache dei risultati di decrypt, o None se disattivata (richiede la chiave privata caricata)"""
+        with self._state_lock:
+            if self._decrypt_cache is None:
+                settings = cryptomessage_cache.load_settings(self.cache_settings_file)
+                if settings is None:
+                    return None
+                self._decrypt_cache = cryptomessage_cache.DecryptCache(
+                    self.cache_file,
+                    self.derive_local_key("decrypt-cache"),
+                    self.derive_local_key("decrypt-cache-index"),
+                    **settings
+                ).open()
+            return self._decrypt_cache
+
+    def _close_decrypt_cache(self):
+        with self._state_lock:
+            if self._decrypt_cache is not None:
+                self._decrypt_cache.close()
+                self._decrypt_cache = None
+
+    def decrypt_cache_settings(self):
+        """Impostazioni della cache di decifratura, o None se disattivata"""
+        return cryptomessage_cache.load_settings(self.cache_settings_file)
+
+    def enable_decrypt_cache(self, ttl=None, max_entries=None, max_bytes=None):
+        """Attiva (o aggiorna) la cache di decifratura, restituisce le impostazioni"""
+        current = self.decrypt_cache_settings() or {}
+        settings = {
+            'ttl': ttl or current.get('ttl', cryptomessage_cache.TTL),
+            'max_entries': max_entries or current.get('max_entries', cryptomessage_cache.MAX_ENTRIES),
+            'max_bytes': max_bytes or current.get('max_bytes', cryptomessage_cache.MAX_BYTES),
+        }
+        cryptomessage_paths.ensure_dir(self.data_dir)
+        with self._state_lock:
+            self._close_decrypt_cache()
+            return cryptomessage_cache.save_settings(self.cache_settings_file, **settings)
+
+    def clear_decrypt_cache(self, disable=False):
+        """Cancella i risultati in cache (e con disable=True disattiva la cache)"""
+        with self._state_lock:
+            self._close_decrypt_cache()
+            if not disable:
+                cryptomessage_cache.clear(self.cache_file)
+                return
+            cryptomessage_cache.remove(self.cache_file)
+            try:
+                os.remove(self.cache_settings_file)
+            except FileNotFoundError:
+                pass
+
+    def _sender_fingerprint(self, sender):
+        """Impronta attuale della chiave del mittente (None se non è più in rubrica)"""
+        if is_self(sender):
+            return cryptomessage_keyring.compute_fingerprint(self.public_key_b64)
+        try:
+            return self.contacts.fingerprint(sender)
+        except KeyError:
+            return None
+
+    def _cached_result(self, cache, digest):
+        """Risultato in cache del pacchetto, se la chiave del firmatario non è cambiata"""
+        entry = cache.get(digest)
+        if entry is None:
+            return None
+        result = entry['result']
+        if result['signed'] and self._sender_fingerprint(result['sender']) != entry['signer_fingerprint']:
+            cache.discard(digest)
+            return None
+        return dict(result, cached=True)
+
+    # Cifratura
+
+    def cipher_choice(self, remeasure=False):
+        """Cifrario AEAD più veloce su questa macchina (benchmark una volta, poi in cache)"""
+        with self._state_lock:
+            if remeasure or self._cipher_choice is None:
+                choice = None if remeasure else cryptomessage_aead.load_choice(self.cipher_file)
+                if choice is None:
+                    cryptomessage_paths.ensure_dir(self.data_dir)
+                    choice = cryptomessage_aead.measure_choice(self.cipher_file)
+                self._cipher_choice = choice
+            return self._cipher_choice
+
+    def _payload_cipher(self, cipher, fmt):
+        """Cifrario del pacchetto: AES-CBC per il v2 (GUI), altrimenti AEAD scelto o indicato"""
+        if fmt == 'v2':
+            if cipher not in (None, 'AES-256-CBC'):
+                raise CryptoMessengerError("Il formato v2 supporta solo AES-256-CBC")
+            return 'AES-256-CBC'
+        if cipher is None:
+            with self._phase('cipher_choice'):
+                return self.cipher_choice()['cipher']
+        cipher = cryptomessage_aead.NAMES.get(cipher, cipher)
+        if cipher not in cryptomessage_aead.CIPHERS + ('AES-256-CBC',):
+            raise CryptoMessengerError(f"Cifrario non supportato: {cipher}")
+        return cipher
+
+    def _encrypt_payload(self, message, cipher='AES-256-CBC'):
+        """Cifra il messaggio con una chiave nuova, restituisce (chiave, iv o nonce, ciphertext)"""
+        # Genera chiave AES casuale
+        aes_key = os.urandom(32)  # 256 bit
+        message_bytes = message.encode('utf-8') if isinstance(message, str) else message
+        if cipher != 'AES-256-CBC':
+            # AEAD: ciphertext e tag in un solo passaggio, senza padding
+            nonce, encrypted_message = cryptomessage_aead.encrypt(cipher, aes_key, message_bytes)
+            return aes_key, nonce, encrypted_message
+
+        iv = os.urandom(16)
+
+        # Cripta messaggio con AES
+        cipher = ciphers.Cipher(algorithms.AES(aes_key), modes.CBC(iv), backend=backends.default_backend())
+        encryptor = cipher.encryptor()
+
+        # Padding PKCS7 passato al cifrario a parte: nessuna copia del messaggio
+        padding_length = 16 - (len(message_bytes) % 16)
+
+        # Un solo buffer di uscita (update_into chiede un blocco di margine)
+        encrypted_message = bytearray(len(message_bytes) + padding_length + 15)
+        written = encryptor.update_into(memoryview(message_bytes), encrypted_message)
+        del message_bytes
+        written += encryptor.update_into(bytes([padding_length] * padding_length),
+                                         memoryview(encrypted_message)[written:])
+        encryptor.finalize()
+        del encrypted_message[written:]
+        return aes_key, iv, encrypted_message
+
+    def _wrap_key(self, recipient_key, aes_key):
+        """Cripta chiave AES per il destinatario (RSA-OAEP o X25519)"""
+        return recipient_key.encrypt(
+            aes_key,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
+        )
+
+    def _sign_payload(self, encrypted_message):
+        """Firma il ciphertext con la chiave privata"""
+        if self.key_type == 'rsa':
+            # PSS su digest calcolato qui: stessa firma, e all'agente arrivano solo 32 byte
+            return cryptomessage_keys.sign_digest(self.private_key, hashlib.sha256(encrypted_message).digest())
+        return self.private_key.sign(
+            encrypted_message,
+            padding.PSS(
+                mgf=padding.MGF1(hashes.SHA256()),
+                salt_length=padding.PSS.MAX_LENGTH
+            ),
+            hashes.SHA256()
+        )
+
+    def encode_packet(self, packet, fmt='v3', armored=True):
+        """Codifica il pacchetto (v3 armato/binario o v2)"""
+        with self._phase('encode'):
+            return cryptomessage_packet.encode(packet, fmt, armored)
+
+    def encrypt(self, recipient, message, sign=True, fmt='v3', armored=True, session=False, cipher=None):
+        """Cripta un messaggio per un destinatario
+
+        cipher: 'AES-256-GCM' o 'ChaCha20-Poly1305' (anche 'aes-gcm', 'chacha20');
+        None sceglie il più veloce su questa macchina. Il v2 usa sempre AES-256-CBC.
+        Restituisce {'packet', 'encoded', 'recipients', 'signed', 'session', 'new_session'}.
+        """
+        if session and fmt == 'v2':
+            raise CryptoMessengerError("I messaggi di sessione richiedono il formato v3")
+        cipher = self._payload_cipher(cipher, fmt)
+        if session and cipher == 'AES-256-CBC':
+            raise CryptoMessengerError("I messaggi di sessione richiedono un cifrario AEAD")
+        if sign or session:
+            self.unlock()
+
+        with self._phase('recipient_key'):
+            recipient_key = self.recipient_key(recipient)
+            label = recipient_label(recipient)
+            kid = self.get_key_id_from_key(recipient_key)
+            key_type = cryptomessage_keys.key_type_of(recipient_key)
+
+        is_new = False
+        if session:
+            # Chiave di sessione: RSA solo nel primo messaggio, poi solo il cifrario AEAD
+            with self._phase('session_store'), self._state_lock:
+                store = self.get_session_store()
+                sid, session_key, is_new = store.outgoing_session(label, kid)
+            with self._phase('aes'):
+                iv, encrypted_message = cryptomessage_session.encrypt(
+                    session_key, sid, message.encode('utf-8'), cipher
+                )
+            recipients = []
+            if is_new:
+                with self._phase('key_wrap'):
+                    recipients = [{'to': label, 'kid': kid, 'key_type': key_type,
+                                   'aes_key': self._wrap_key(recipient_key, session_key)}]
+        else:
+            sid = None
+            with self._phase('aes'):
+                aes_key, iv, encrypted_message = self._encrypt_payload(message, cipher)
+            with self._phase('key_wrap'):
+                recipients = [{'to': label, 'kid': kid, 'key_type': key_type,
+                               'aes_key': self._wrap_key(recipient_key, aes_key)}]
+
+        # Firma (opzionale)
+        signature = b""
+        if sign:
+            with self._phase('sign'):
+                signature = self._sign_payload(encrypted_message)
+
+        # Crea pacchetto finale
+        packet = {
+            'cipher': cipher,
+            'multi': False,
+            'session': sid,
+            'recipients': recipients,
+            'iv': iv,
+            'data': encrypted_message,
+            'signature': signature,
+            'signer_kid': self.get_key_id(self.public_key_b64) if signature else None,
+            'timestamp': datetime.now().isoformat(),
+            'to': label
+        }
+        encoded = self.encode_packet(packet, fmt, armored)
+
+        # La sessione si salva solo a pacchetto pronto
+        if session:
+            with self._phase('session_store'), self._state_lock:
+                store.save()
+
+        return {
+            'packet': packet,
+            'encoded': encoded,
+            'recipients': [label],
+            'signed': bool(signature),
+            'session': sid,
+            'new_session': is_new,
+        }
+
+    def encrypt_multi(self, recipients, message, sign=True, fmt='v3', armored=True, cipher=None):
+        """Cripta una sola volta per più destinatari (stesso risultato di encrypt)"""
+        cipher = self._payload_cipher(cipher, fmt)
+        if sign:
+            self.unlock()
+
+        recipient_keys = []
+        with self._phase('recipient_key'):
+            missing = [r for r in recipients if not is_self(r) and r not in self.contacts]
+            if missing:
+                raise ContactNotFoundError(missing)
+            for recipient in recipients:
+                recipient_keys.append((recipient_label(recipient), self.recipient_key(recipient)))
+
+        # Payload cifrato e firmato una sola volta
+        with self._phase('aes'):
+            aes_key, iv, encrypted_message = self._encrypt_payload(message, cipher)
+        signature = b""
+        if sign:
+            with self._phase('sign'):
+                signature = self._sign_payload(encrypted_message)
+
+        # Solo la chiave AES viene cifrata per ogni destinatario, in parallelo
+        def wrap(entry):
+            label, recipient_key = entry
+            return {
+                'to': label,
+                'kid': self.get_key_id_from_key(recipient_key),
+                'key_type': cryptomessage_keys.key_type_of(recipient_key),
+                'aes_key': self._wrap_key(recipient_key, aes_key)
+            }
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        workers = max(1, min(len(recipient_keys), os.cpu_count() or 1))
+        with self._phase('key_wrap'), ThreadPoolExecutor(max_workers=workers) as executor:
+            wrapped_keys = list(executor.map(wrap, recipient_keys))
+
+        packet = {
+            'cipher': cipher,
+            'multi': True,
+            'recipients': wrapped_keys,
+            'iv': iv,
+            'data': encrypted_message,
+            'signature': signature,
+            'signer_kid': self.get_key_id(self.public_key_b64) if signature else None,
+            'timestamp': datetime.now().isoformat(),
+            'to': ', '.join(label for label, _ in recipient_keys)
+        }
+        return {
+            'packet': packet,
+            'encoded': self.encode_packet(packet, fmt, armored),
+            'recipients': [label for label, _ in recipient_keys],
+            'signed': bool(signature),
+            'session': None,
+            'new_session': False,
+        }
+
+    # Decifratura
+
+    def _verify_signature(self, signature, encrypted_message, sender, multi=False, signer_kid=None):
+        """Verifica la firma, restituisce (valida, mittente)"""
+        pss = padding.PSS(
+            mgf=padding.MGF1(hashes.SHA256()),
+            salt_length=padding.PSS.MAX_LENGTH
+        )
+
+        # Key id del firmatario nel pacchetto: una sola chiave da provare
+        if signer_kid:
+            name, signer_key = self.find_signer(signer_kid)
+            if signer_key is not None:
+                try:
+                    signer_key.verify(signature, encrypted_message, pss, hashes.SHA256())
+                    return True, name
+                except Exception:
+                    return False, name
+
+        # Gestione firma per messaggi auto-inviati
+        if is_self(sender):
+            try:
+                # Per messaggi auto-inviati, usa la chiave pubblica corrente
+                if self.public_key:
+                    self.public_key.verify(signature, encrypted_message, pss, hashes.SHA256())
+                    return True, sender
+            except:
+                pass
+            return False, sender
+
+        if multi:
+            # Il campo 'to' elenca i destinatari: cerca il firmatario tra i contatti
+            candidates = [('Me', self.public_key)] if self.public_key else []
+            candidates += [(name, None) for name in self.contacts]
+            for name, candidate_key in candidates:
+                try:
+                    if candidate_key is None:
+                        candidate_key = self.contacts.public_key(name)
+                    candidate_key.verify(signature, encrypted_message, pss, hashes.SHA256())
+                    return True, name
+                except:
+                    continue
+            return False, None
+
+        if sender in self.contacts:
+            try:
+                sender_key = self.contacts.public_key(sender)
+                sender_key.verify(signature, encrypted_message, pss, hashes.SHA256())
+                return True, sender
+            except:
+                pass
+        return False, sender
+
+    def _own_recipient_entry(self, packet):
+        """Sceglie la propria chiave cifrata tramite key id, restituisce (voce, chiave privata)
+
+        I key id vengono confrontati con la chiave attuale e con quelle ritirate
+        (ricerca diretta): nessun tentativo di decifratura. Senza key id
+        (pacchetti v2 a destinatario singolo) si usa la chiave attuale.
+        """
+        own_kid = self.get_key_id(self.public_key_b64)
+        retired = None
+        for entry in packet['recipients']:
+            if entry['kid'] == own_kid or entry['kid'] is None:
+                key_type, private_key = self.key_type, self.private_key
+                break
+            if retired is None and entry['kid'] in self.retired_keys:
+                retired = entry
+        else:
+            if retired is None:
+                raise NotForThisKeyError("Il messaggio non è indirizzato alla tua chiave")
+            entry = retired
+            key_type = self.retired_keys[entry['kid']].get('key_type', 'rsa')
+            private_key = self.unlock_retired(entry['kid'], None)
+        if entry.get('key_type', 'rsa') != key_type:
+            raise NotForThisKeyError(f"Chiave cifrata di tipo {entry['key_type']}, il tuo account usa {key_type}")
+        return entry, private_key
+
+    def _unwrap_key(self, encrypted_key, private_key=None):
+        """Decripta una chiave simmetrica con la chiave privata (RSA-OAEP o X25519)"""
+        try:
+            return (private_key or self.private_key).decrypt(
+                encrypted_key,
+                padding.OAEP(
+                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                    algorithm=hashes.SHA256(),
+                    label=None
+                )
+            )
+        except (ConnectionError, OSError):
+            raise
+        except Exception as e:
+            raise DecryptionError(f"Impossibile decifrare la chiave del messaggio: {e or type(e).__name__}") from e
+
+    def _open_session_payload(self, packet):
+        """Decripta un messaggio di sessione (RSA solo al primo messaggio)"""
+        store = self.get_session_store()
+        sid = packet['session']
+
+        if packet['recipients']:
+            entry, private_key = self._own_recipient_entry(packet)
+            session_key = self._unwrap_key(entry['aes_key'], private_key)
+            with self._state_lock:
+                store.add_incoming(sid, session_key)
+                store.save()
+        else:
+            with self._state_lock:
+                session_key = store.incoming_key(sid)
+            if session_key is None:
+                raise UnknownSessionError(f"Sessione {sid[:8]} sconosciuta o scaduta: chiedi al mittente un nuovo messaggio")
+
+        try:
+            plaintext = cryptomessage_session.decrypt(session_key, sid, packet['iv'], packet['data'], packet['cipher'])
+        except Exception as e:
+            raise DecryptionError("Messaggio di sessione alterato o chiave errata") from e
+        return plaintext.decode('utf-8')
+
+    def decode_packet(self, encrypted):
+        """Decodifica un pacchetto (v3 binario/armato o v2 legacy)"""
+        with self._phase('decode'):
+            try:
+                return cryptomessage_packet.decode(encrypted)
+            except Exception as e:
+                raise InvalidPacketError(f"Formato messaggio non valido: {e or type(e).__name__}") from e
+
+    def decrypt(self, encrypted, use_cache=True):
+        """Decripta un pacchetto (richiede la chiave privata o l'agente)
+
+        Restituisce {'message', 'timestamp', 'sender', 'signed', 'signature_valid',
+        'packet_hash', 'cached'}. Con la cache attiva (vedi cryptomessage_cache)
+        un pacchetto già letto non viene decifrato né verificato di nuovo.
+        """
+        self.unlock()
+        cache = self.get_decrypt_cache() if use_cache else None
+        if cache is not None:
+            with self._phase('cache'), self._state_lock:
+                digest = cache.digest(encrypted)
+                result = self._cached_result(cache, digest)
+            if result is not None:
+                return result
+
+        result = self._decrypt_packet(encrypted)
+
+        # Le firme non verificate non vanno in cache: il mittente potrebbe entrare in rubrica
+        if cache is not None and (not result['signed'] or result['signature_valid']):
+            with self._phase('cache'), self._state_lock:
+                signer_fingerprint = self._sender_fingerprint(result['sender']) if result['signed'] else None
+                cache.put(digest, result, signer_fingerprint)
+        return dict(result, cached=False)
+
+    def _decrypt_packet(self, encrypted):
+        """Decifra e verifica un pacchetto, senza cache"""
+        packet = self.decode_packet(encrypted)
+        encrypted_message = packet['data']
+
+        if packet['session']:
+            with self._phase('session'):
+                message = self._open_session_payload(packet)
+        else:
+            # Decripta chiave AES con la chiave privata
+            with self._phase('key_unwrap'):
+                entry, private_key = self._own_recipient_entry(packet)
+                aes_key = self._unwrap_key(entry['aes_key'], private_key)
+
+            # Decripta messaggio con il cifrario indicato nel pacchetto
+            with self._phase('aes'):
+                if packet['cipher'] != 'AES-256-CBC':
+                    try:
+                        plaintext = cryptomessage_aead.decrypt(packet['cipher'], aes_key, packet['iv'], encrypted_message)
+                    except Exception as e:
+                        raise DecryptionError("Messaggio alterato o chiave errata") from e
+                    with memoryview(plaintext) as view:
+                        message = str(view, 'utf-8')
+                    del plaintext
+                else:
+                    try:
+                        cipher = ciphers.Cipher(algorithms.AES(aes_key), modes.CBC(packet['iv']), backend=backends.default_backend())
+                        decryptor = cipher.decryptor()
+                        padded_message = bytearray(len(encrypted_message) + 15)
+                        written = decryptor.update_into(encrypted_message, padded_message)
+                        decryptor.finalize()
+
+                        # Rimuovi padding senza copiare il messaggio
+                        padding_length = padded_message[written - 1]
+                        with memoryview(padded_message) as view:
+                            message = str(view[:written - padding_length], 'utf-8')
+                        del padded_message
+                    except Exception as e:
+                        raise DecryptionError(f"Messaggio danneggiato: {e or type(e).__name__}") from e
+
+        # Verifica firma se presente
+        signature_valid = False
+        sender = packet['to']
+        if packet['signature']:
+            with self._phase('verify'):
+                signature_valid, sender = self._verify_signature(
+                    packet['signature'], encrypted_message, sender, packet['multi'], packet['signer_kid']
+                )
+
+        return {
+            'message': message,
+            'timestamp': packet['timestamp'],
+            'sender': sender,
+            'signed': bool(packet['signature']),
+            'signature_valid': signature_valid,
+            'packet_hash': cryptomessage_archive.packet_hash(packet),
+        }
+
+    # File a blocchi
+
+    def _stream_header(self, recipient, sign):
+        """Chiave AES del flusso e header con la chiave cifrata per il destinatario"""
+        if sign:
+            self.unlock()
+        recipient_key = self.recipient_key(recipient)
+
+        # Chiave AES generata una sola volta e cifrata per il destinatario nell'header
+        content_key = os.urandom(32)
+        encrypted_key = self._wrap_key(recipient_key, content_key)
+
+        header = {
+            'version': 1,
+            'kid': self.get_key_id_from_key(recipient_key),
+            'key_type': cryptomessage_keys.key_type_of(recipient_key),
+            'aes_key': base64.b64encode(encrypted_key).decode(),
+            'timestamp': datetime.now().isoformat(),
+            'to': recipient_label(recipient)
+        }
+        if sign:
+            header['signer_kid'] = self.get_key_id(self.public_key_b64)
+        return content_key, header
+
+    def _open_stream(self, src, unlock_retired=None):
+        """Legge l'header di un flusso cifrato, restituisce (header, header_bytes, chiave AES, verify)
+
+        unlock_retired(kid) -> bool sblocca una chiave ritirata senza rileggere
+        l'header (per sorgenti che non si possono riavvolgere, come stdin).
+        """
+        self.unlock()
+        try:
+            header, header_bytes = cryptomessage_stream.read_header(src)
+        except ValueError as e:
+            raise InvalidPacketError(str(e)) from e
+
+        # Decripta chiave AES (una sola volta per file), con la chiave indicata dal key id
+        recipients = {'recipients': [{'kid': header.get('kid'), 'key_type': header.get('key_type', 'rsa')}]}
+        try:
+            entry, private_key = self._own_recipient_entry(recipients)
+        except RetiredKeyLockedError as e:
+            if unlock_retired is None or not unlock_retired(e.kid):
+                raise
+            entry, private_key = self._own_recipient_entry(recipients)
+        content_key = self._unwrap_key(base64.b64decode(header['aes_key']), private_key)
+
+        def verify(signature, digest):
+            header['signature_valid'], header['sender'] = self.verify_digest(
+                signature, digest, header.get('signer_kid')
+            )
+
+        return header, header_bytes, content_key, verify
+
+    def encrypt_stream(self, recipient, src, dst, chunk_size=None, sign=False, armored=False):
+        """Cripta il flusso src in dst per il destinatario, restituisce i byte cifrati
+
+        Con sign=True il file è firmato in coda (digest calcolato durante la scrittura).
+        Con armored=True l'output è armatura ASCII a righe, scritta in flusso.
+        """
+        content_key, header = self._stream_header(recipient, sign)
+        writer = cryptomessage_armor.ArmorWriter(dst) if armored else dst
+        total = cryptomessage_stream.encrypt_stream(
+            src, writer, content_key, header,
+            chunk_size=chunk_size or cryptomessage_stream.CHUNK_SIZE,
+            sign=self.sign_digest if sign else None
+        )
+        if armored:
+            writer.close()
+        return total
+
+    def decrypt_stream(self, src, dst, unlock_retired=None):
+        """Decripta il flusso src in dst, restituisce (header, byte scritti)
+
+        Per i file firmati l'header riporta anche 'signature_valid' e 'sender'.
+        Un flusso con armatura ASCII viene riconosciuto e decodificato in flusso.
+        """
+        # Il riconoscimento dell'armatura legge i primi byte senza consumarli
+        src = cryptomessage_armor.peekable(src)
+        try:
+            if cryptomessage_armor.is_armored(src):
+                src = cryptomessage_armor.ArmorReader(src)
+        except ValueError as e:
+            raise InvalidPacketError(str(e)) from e
+        header, header_bytes, content_key, verify = self._open_stream(src, unlock_retired)
+        try:
+            total = cryptomessage_stream.decrypt_stream(src, dst, content_key, header, header_bytes, verify)
+        except Exception as e:
+            raise DecryptionError(str(e) or "File alterato o troncato") from e
+        return header, total
+
+    # Cartelle (archivio tar cifrato a blocchi)
+
+    def encrypt_dir(self, recipient, directory, dst, chunk_size=None, sign=False, jobs=None):
+        """Archivia la cartella in tar e la cripta a blocchi in parallelo, restituisce i byte in chiaro
+
+        Il tar viene prodotto e cifrato in flusso: nessuna copia su disco o in memoria.
+        """
+        import tarfile
+
+        if not os.path.isdir(directory):
+            raise CryptoMessengerError(f"Cartella non trovata: {directory}")
+        content_key, header = self._stream_header(recipient, sign)
+        header['content'] = 'tar'
+
+        with cryptomessage_stream.EncryptingWriter(
+            dst, content_key, header,
+            chunk_size=chunk_size or cryptomessage_stream.CHUNK_SIZE,
+            jobs=jobs,
+            sign=self.sign_digest if sign else None
+        ) as writer:
+            # Modalità 'w' (non 'w|'): i dati dei file arrivano al cifrario a blocchi grandi, senza
+            # il buffer di record da 10 KiB del flusso tar; serve solo writer.tell()
+            with self._phase('tar'), tarfile.open(fileobj=writer, mode='w', format=tarfile.PAX_FORMAT,
+                                                  copybufsize=writer.chunk_size) as archive:
+                archive.add(directory, arcname=os.path.basename(os.path.abspath(directory)))
+        return writer.total
+
+    def decrypt_dir(self, src, out_dir, jobs=None):
+        """Decripta un archivio di encrypt_dir ed estrae il contenuto in out_dir
+
+        L'estrazione avviene in una cartella temporanea dentro out_dir: il
+        contenuto viene spostato al suo posto solo dopo la verifica di tutto il
+        flusso (blocco finale e firma). Restituisce (header, nomi estratti).
+        """
+        import shutil
+        import tarfile
+        import tempfile
+
+        header, header_bytes, content_key, verify = self._open_stream(src)
+        if header.get('content') != 'tar':
+            raise InvalidPacketError("Il file non contiene una cartella: usa decrypt-file")
+
+        os.makedirs(out_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".cryptomessenger-", dir=out_dir)
+        try:
+            try:
+                with cryptomessage_stream.DecryptingReader(src, content_key, header, header_bytes, jobs, verify) as reader:
+                    with self._phase('tar'), tarfile.open(fileobj=reader, mode='r|', bufsize=TAR_READ_BUFSIZE,
+                                                          copybufsize=TAR_READ_BUFSIZE) as archive:
+                        if hasattr(tarfile, 'data_filter'):
+                            archive.extractall(staging, filter='data')
+                        else:
+                            archive.extractall(staging, members=_safe_tar_members(archive))
+                    header['size'] = reader.finish()
+            except (tarfile.TarError, ValueError) as e:
+                raise DecryptionError(str(e) or "Archivio alterato o troncato") from e
+
+            names = sorted(os.listdir(staging))
+            existing = [name for name in names if os.path.lexists(os.path.join(out_dir, name))]
+            if existing:
+                raise CryptoMessengerError(f"Esiste già in {out_dir}: {', '.join(existing)}")
+            for name in names:
+                os.replace(os.path.join(staging, name), os.path.join(out_dir, name))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return header, names
+
+    # Firme in streaming e firme separate
+
+    def sign_digest(self, digest):
+        """Firma un digest SHA-256 con la propria chiave (locale o agente)"""
+        self.unlock()
+        with self._phase('sign'):
+            return cryptomessage_keys.sign_digest(self.private_key, digest)
+
+    def find_signer(self, kid):
+        """Firmatario dal key id: (nome, chiave pubblica) oppure (None, None)
+
+        Ricerca diretta: chiave attuale, chiavi ritirate e indice delle impronte
+        della rubrica (il key id è il prefisso dell'impronta).
+        """
+        if not kid:
+            return None, None
+        if self.public_key_b64 and self.get_key_id(self.public_key_b64) == kid:
+            return 'Me', self.public_key
+        if kid in self.retired_keys:
+            return 'Me', cryptomessage_keys.load_pem_public_key(
+                base64.b64decode(self.retired_keys[kid]['public_key'])
+            )
+        name = self.contacts.find_by_key_id(kid)
+        if name is None:
+            return None, None
+        return name, self.contacts.public_key(name)
+
+    def verify_digest(self, signature, digest, kid):
+        """Verifica la firma di un digest SHA-256, restituisce (valida, firmatario)"""
+        name, public_key = self.find_signer(kid)
+        if public_key is None:
+            return False, None
+        with self._phase('verify'):
+            try:
+                cryptomessage_keys.verify_digest(public_key, signature, digest)
+            except Exception:
+                return False, name
+        return True, name
+
+    def detached_signature(self, digest, size):
+        """Contenuto del file .sig per un digest già calcolato"""
+        signature = self.sign_digest(digest)
+        return cryptomessage_signature.dumps(
+            signature, self.key_type, self.get_key_id(self.public_key_b64), size, datetime.now().isoformat()
+        )
+
+    def sign_stream(self, src):
+        """Firma separata di un flusso letto a blocchi, restituisce il contenuto del file .sig"""
+        self.unlock()
+        with self._phase('hash'):
+            digest, size = cryptomessage_signature.hash_stream(src)
+        return self.detached_signature(digest, size)
+
+    def verify_stream(self, src, sig_text):
+        """Verifica una firma separata
+
+        Restituisce {'valid', 'signer', 'timestamp', 'size'}.
+        """
+        try:
+            info = cryptomessage_signature.loads(sig_text)
+        except ValueError as e:
+            raise InvalidPacketError(str(e)) from e
+        with self._phase('hash'):
+            digest, size = cryptomessage_signature.hash_stream(src)
+        valid, signer = self.verify_digest(info['signature'], digest, info.get('signer_kid'))
+        return {'valid': valid, 'signer': signer, 'timestamp': info.get('timestamp'), 'size': size}
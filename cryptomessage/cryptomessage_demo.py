@@ -2,124 +2,176 @@
 # -*- coding: utf-8 -*-
 
 """
-Esempio di utilizzo di CryptoMessenger CLI
-Dimostra come automatizzare l'invio di messaggi criptati
+Esempio di utilizzo di CryptoMessenger come libreria
+Dimostra come automatizzare l'invio di messaggi criptati in-process:
+nessun sottoprocesso, la chiave viene sbloccata una sola volta
 """
 
-import subprocess
+import getpass
 import sys
 import os
 
-def run_command(cmd):
-    """Esegue comando e restituisce output"""
+from cryptomessage_core import (
+    CryptoMessenger, CryptoMessengerError, ContactNotFoundError, PasswordRequiredError
+)
+
+messenger = CryptoMessenger()
+
+
+def unlock():
+    """Sblocca la chiave una volta sola (agente o password)"""
+    if messenger.is_unlocked:
+        return True
     try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Errore: {result.stderr}")
-            return None
-        return result.stdout.strip()
-    except Exception as e:
-        print(f"❌ Errore nell'esecuzione: {e}")
-        return None
+        try:
+            messenger.unlock()
+        except PasswordRequiredError:
+            messenger.unlock(getpass.getpass("🔐 Password del tuo account: "))
+        return True
+    except CryptoMessengerError as e:
+        print(f"❌ {e}")
+        return False
 
 def check_setup():
     """Verifica se l'account è configurato"""
-    status = run_command("python cryptomessage_cli.py status")
-    if status and "Account configurato" in status:
-        return True
-    return False
+    return messenger.is_configured
+
+def show_status():
+    """Mostra lo stato dell'account"""
+    if messenger.is_configured:
+        print("✅ Account configurato e pronto")
+        print(f"🔍 Impronta: {messenger.get_key_fingerprint(messenger.public_key_b64)[:35]}...")
+        print(f"🔑 Tipo di chiave: {messenger.key_type}")
+    else:
+        print("⚠️ Account non configurato")
+    print(f"👥 Contatti: {len(messenger.contacts)}")
 
 def setup_account():
     """Configura account se non esiste"""
     print("🔑 Configurazione account...")
-    result = run_command("python cryptomessage_cli.py setup")
-    if result:
-        print("✅ Account configurato!")
-        return True
-    return False
+    password = getpass.getpass("🔐 Crea una password per proteggere la tua chiave privata: ")
+    if password != getpass.getpass("🔐 Conferma la password: "):
+        print("❌ Le password non corrispondono!")
+        return False
+    try:
+        fingerprint = messenger.create_account(password)
+    except Exception as e:
+        print(f"❌ Errore: {e}")
+        return False
+    print("✅ Account configurato!")
+    print(f"🔍 Impronta digitale: {fingerprint}")
+    return True
 
 def export_public_key():
     """Esporta chiave pubblica"""
     print("📤 Esportazione chiave pubblica...")
-    result = run_command("python cryptomessage_cli.py export-key -o mia_chiave_pubblica.pem")
-    if result:
-        print("✅ Chiave pubblica esportata!")
-        return True
-    return False
+    try:
+        with open("mia_chiave_pubblica.pem", 'wb') as f:
+            f.write(messenger.public_key_pem())
+    except Exception as e:
+        print(f"❌ Errore: {e}")
+        return False
+    print("✅ Chiave pubblica esportata!")
+    return True
 
 def add_contact(name, key_file):
     """Aggiunge contatto"""
     print(f"👤 Aggiunta contatto {name}...")
-    result = run_command(f"python cryptomessage_cli.py add-contact {name} {key_file}")
-    if result:
-        print(f"✅ Contatto {name} aggiunto!")
-        return True
-    return False
+    try:
+        with open(key_file, 'rb') as f:
+            contact = messenger.add_contact_key(name, f.read())
+    except (OSError, CryptoMessengerError) as e:
+        print(f"❌ Errore: {e}")
+        return False
+    print(f"✅ Contatto {name} aggiunto! (chiave {contact['key_type']})")
+    return True
 
 def list_contacts():
     """Lista contatti"""
     print("👥 Lista contatti:")
-    result = run_command("python cryptomessage_cli.py list-contacts")
-    if result:
-        print(result)
-        return True
-    return False
+    contacts = messenger.contact_list()
+    if not contacts:
+        print("📭 Nessun contatto nella rubrica")
+    for contact in contacts:
+        print(f"  👤 {contact['name']} ({contact['key_type']})")
+    return contacts
 
 def send_message(recipient, message):
     """Invia messaggio criptato"""
     print(f"📤 Invio messaggio a {recipient}...")
-    result = run_command(f'python cryptomessage_cli.py encrypt "{recipient}" "{message}"')
-    if result:
-        print("✅ Messaggio criptato!")
-        return True
-    return False
+    if not unlock():
+        return None
+    try:
+        result = messenger.encrypt(recipient, message)
+    except ContactNotFoundError as e:
+        print(f"❌ {e}")
+        return None
+    except CryptoMessengerError as e:
+        print(f"❌ Errore: {e}")
+        return None
+    print("✅ Messaggio criptato!")
+    print(result['encoded'])
+    return result['encoded']
 
 def decrypt_message(encrypted_message):
     """Decripta messaggio"""
     print("🔓 Decriptazione messaggio...")
-    result = run_command(f'python cryptomessage_cli.py decrypt "{encrypted_message}"')
-    if result:
-        print("✅ Messaggio decriptato!")
-        return True
-    return False
+    if not unlock():
+        return None
+    try:
+        result = messenger.decrypt(encrypted_message)
+    except CryptoMessengerError as e:
+        print(f"❌ Errore: {e}")
+        return None
+    print("✅ Messaggio decriptato!")
+    if result['signature_valid']:
+        print(f"✅ Firma verificata da: {result['sender']}")
+    print(f"📝 {result['message']}")
+    return result['message']
 
 def demo_workflow():
     """Dimostra il workflow completo"""
-    print("🚀 Demo CryptoMessenger CLI")
+    print("🚀 Demo CryptoMessenger")
     print("=" * 50)
-    
+
     # 1. Verifica setup
     if not check_setup():
         print("⚠️ Account non configurato, procedo con la configurazione...")
         if not setup_account():
             print("❌ Impossibile configurare l'account")
             return False
-    
+
     # 2. Esporta chiave pubblica
     if not os.path.exists("mia_chiave_pubblica.pem"):
         export_public_key()
-    
+
     # 3. Lista contatti
-    list_contacts()
-    
-    # 4. Esempio di invio messaggio (se ci sono contatti)
-    contacts_result = run_command("python cryptomessage_cli.py list-contacts")
-    if contacts_result and "Nessun contatto" not in contacts_result:
+    contacts = list_contacts()
+
+    # 4. Messaggio a se stessi: cifratura e decifratura con la stessa chiave sbloccata
+    print("\n🔁 Andata e ritorno (a te stesso):")
+    encrypted = send_message("Me", "Questo è un messaggio di test criptato.")
+    if encrypted:
+        decrypt_message(encrypted)
+
+    # 5. Esempio di invio messaggio (se ci sono contatti)
+    if contacts:
         print("\n📤 Esempio invio messaggio:")
-        send_message("Mario", "Ciao Mario! Questo è un messaggio di test criptato.")
+        name = contacts[0]['name']
+        send_message(name, f"Ciao {name}! Questo è un messaggio di test criptato.")
     else:
         print("\n💡 Per testare l'invio messaggi:")
         print("1. Aggiungi un contatto: python cryptomessage_cli.py add-contact Nome chiave.pem")
         print("2. Invia messaggio: python cryptomessage_cli.py encrypt Nome 'Il tuo messaggio'")
-    
+
     print("\n✅ Demo completata!")
     return True
 
 def interactive_mode():
     """Modalità interattiva"""
-    print("🎯 Modalità Interattiva CryptoMessenger CLI")
+    print("🎯 Modalità Interattiva CryptoMessenger")
     print("=" * 50)
-    
+
     while True:
         print("\nComandi disponibili:")
         print("1. Status account")
@@ -130,14 +182,14 @@ def interactive_mode():
         print("6. Esporta chiave pubblica")
         print("7. Demo completa")
         print("0. Esci")
-        
+
         choice = input("\nScegli un'opzione (0-7): ").strip()
-        
+
         if choice == "0":
             print("👋 Arrivederci!")
             break
         elif choice == "1":
-            run_command("python cryptomessage_cli.py status")
+            show_status()
         elif choice == "2":
             list_contacts()
         elif choice == "3":
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger KDF - Password della chiave privata con costo calibrato
+Con BestAvailableEncryption il costo dello sblocco è quello scelto dalla
+libreria. Qui i parametri di scrypt o PBKDF2 vengono misurati su questa
+macchina per un tempo di sblocco obiettivo e salvati accanto alla chiave:
+il lavoro richiesto a ogni tentativo di password è esplicito e riproducibile.
+
+Nella configurazione:
+    "private_key": base64(nonce (12) | AES-256-GCM(chiave privata PKCS8 DER))
+    "kdf": {"name": "scrypt", "n": 32768, "r": 8, "p": 1, "salt": "<b64>",
+            "target_ms": 250, "measured_ms": 241}
+           {"name": "pbkdf2", "iterations": 800000, "salt": "<b64>", ...}
+
+I dati associati di AES-GCM sono i parametri KDF stessi: parametri alterati
+(ad esempio un costo abbassato) fanno fallire lo sblocco.
+"""
+
+import base64
+import json
+import math
+import os
+import time
+
+KDF_NAMES = ('scrypt', 'pbkdf2')
+DEFAULT_KDF = 'scrypt'
+DEFAULT_UNLOCK_MS = 250
+
+SALT_SIZE = 16
+NONCE_SIZE = 12
+KEY_SIZE = 32
+
+SCRYPT_R = 8
+MIN_SCRYPT_N = 2 ** 14   # 16 MiB, minimo indipendente dalla calibrazione
+MAX_SCRYPT_N = 2 ** 20   # 1 GiB: oltre si aumenta p (tempo, non memoria)
+MIN_PBKDF2_ITERATIONS = 100_000
+
+
+def derive(password, kdf):
+    """Chiave AES-256 dalla password con i parametri indicati"""
+    salt = base64.b64decode(kdf['salt'])
+    if kdf['name'] == 'scrypt':
+        from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+        return Scrypt(salt=salt, length=KEY_SIZE, n=int(kdf['n']), r=int(kdf['r']), p=int(kdf['p'])).derive(password)
+    if kdf['name'] == 'pbkdf2':
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+        return PBKDF2HMAC(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=salt,
+                          iterations=int(kdf['iterations'])).derive(password)
+    raise ValueError(f"KDF non supportata: {kdf['name']}")
+
+
+def measure(kdf, runs=2):
+    """Tempo di una derivazione in secondi (il migliore di runs tentativi)"""
+    kdf = dict(kdf, salt=base64.b64encode(os.urandom(SALT_SIZE)).decode())
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        derive(b"calibrazione", kdf)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(name=DEFAULT_KDF, target_ms=DEFAULT_UNLOCK_MS):
+    """Parametri per cui una derivazione su questa macchina dura circa target_ms
+
+    I minimi (MIN_SCRYPT_N, MIN_PBKDF2_ITERATIONS) valgono anche per obiettivi
+    molto bassi. Il tempo di import delle librerie, uguale per ogni KDF, è escluso.
+    """
+    if name not in KDF_NAMES:
+        raise ValueError(f"KDF non supportata: {name}")
+    if target_ms <= 0:
+        raise ValueError("Il tempo obiettivo deve essere positivo")
+    target = target_ms / 1000
+
+    if name == 'scrypt':
+        # n raddoppia finché resta nell'obiettivo (il costo non è lineare
+        # oltre la cache), poi p copre il tempo restante senza altra memoria
+        n = MIN_SCRYPT_N
+        elapsed = measure({'name': name, 'n': n, 'r': SCRYPT_R, 'p': 1})
+        while n < MAX_SCRYPT_N and elapsed * 2 <= target * 1.25:
+            doubled = measure({'name': name, 'n': n * 2, 'r': SCRYPT_R, 'p': 1}, runs=1)
+            if doubled > target * 1.25:
+                break
+            n, elapsed = n * 2, doubled
+        # p intero più vicino all'obiettivo (almeno 1)
+        p = max(1, round(target / elapsed))
+        kdf = {'name': name, 'n': n, 'r': SCRYPT_R, 'p': p}
+    else:
+        # PBKDF2 è lineare nel numero di iterazioni
+        elapsed = measure({'name': name, 'iterations': MIN_PBKDF2_ITERATIONS})
+        iterations = int(round(MIN_PBKDF2_ITERATIONS * target / elapsed, -3))
+        kdf = {'name': name, 'iterations': max(MIN_PBKDF2_ITERATIONS, iterations)}
+
+    kdf['target_ms'] = target_ms
+    kdf['measured_ms'] = round(measure(kdf, runs=1) * 1000)
+    return kdf
+
+
+def _associated_data(kdf):
+    return json.dumps(kdf, sort_keys=True, separators=(",", ":")).encode()
+
+
+def encrypt_private_key(private_der, password, kdf):
+    """Cifra la chiave privata, restituisce (blob base64, parametri KDF con nuovo sale)"""
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    kdf = dict(kdf, salt=base64.b64encode(os.urandom(SALT_SIZE)).decode())
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = AESGCM(derive(password, kdf)).encrypt(nonce, private_der, _associated_data(kdf))
+    return base64.b64encode(nonce + ciphertext).decode(), kdf
+
+
+def decrypt_private_key(blob, password, kdf):
+    """Chiave privata DER dal blob (solleva InvalidTag se la password è errata)"""
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    data = base64.b64decode(blob)
+    return AESGCM(derive(password, kdf)).decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], _associated_data(kdf))
+
+
+def describe(kdf):
+    """Descrizione leggibile dei parametri"""
+    if kdf is None:
+        return "predefinita della libreria (PKCS8 BestAvailableEncryption)"
+    if kdf['name'] == 'scrypt':
+        cost = f"scrypt N=2^{int(math.log2(kdf['n']))} r={kdf['r']} p={kdf['p']} ({128 * kdf['r'] * kdf['n'] // 2**20} MiB)"
+    else:
+        cost = f"PBKDF2-HMAC-SHA256 {kdf['iterations']} iterazioni"
+    if 'measured_ms' in kdf:
+        cost += f", ~{kdf['measured_ms']} ms misurati (obiettivo {kdf['target_ms']} ms)"
+    return cost
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Keyring - Rubrica contatti con chiavi già pronte all'uso
+Ogni chiave pubblica viene decodificata e analizzata una sola volta (cache LRU)
+e l'impronta SHA-256 viene salvata accanto alla chiave
+
+SQLiteKeyring (usata da CLI e GUI): database SQLite indicizzato per nome e
+per impronta; aprire la rubrica non legge i contatti, ogni inserimento scrive
+solo la propria riga.
+
+ContactKeyring: file JSON delle versioni precedenti, letto solo per
+l'importazione nel database (compatibile con il formato name -> base64):
+    {"Mario": {"key": "<base64 PEM>", "fingerprint": "<SHA-256 hex>", "type": "rsa"}}
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import cryptomessage_keys
+
+CACHE_SIZE = 256
+
+
+def compute_fingerprint(key_b64):
+    """Impronta SHA-256 (hex maiuscolo) della chiave PEM in base64"""
+    return hashlib.sha256(base64.b64decode(key_b64)).hexdigest().upper()
+
+
+def format_fingerprint(fingerprint):
+    """Formatta l'impronta in blocchi di 4"""
+    return ' '.join([fingerprint[i:i+4] for i in range(0, len(fingerprint), 4)])
+
+
+class _KeyCache:
+    """Cache LRU delle chiavi pubbliche già analizzate"""
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # Usata anche da più thread (destinatari multipli, modalità serve)
+        self._cache_lock = threading.Lock()
+
+    def public_key(self, name):
+        """Chiave pubblica analizzata, dalla cache LRU quando possibile"""
+        with self._cache_lock:
+            key = self._cache.get(name)
+            if key is not None:
+                self._cache.move_to_end(name)
+                return key
+
+        # Import di cryptography differito: elencare i contatti non lo richiede
+        key = cryptomessage_keys.load_pem_public_key(base64.b64decode(self[name]))
+        self._remember(name, key)
+        return key
+
+    def _remember(self, name, key):
+        with self._cache_lock:
+            self._cache[name] = key
+            self._cache.move_to_end(name)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, name):
+        with self._cache_lock:
+            self._cache.pop(name, None)
+
+
+class ContactKeyring(_KeyCache):
+    """Rubrica JSON: si comporta come un dizionario nome -> chiave base64"""
+
+    def __init__(self, path, cache_size=CACHE_SIZE):
+        super().__init__(cache_size)
+        self.path = path
+        self._keys = {}
+        self._fingerprints = {}
+        self._types = {}
+
+    def load(self):
+        """Carica la rubrica dal file (accetta anche il formato precedente)"""
+        self._keys = {}
+        self._fingerprints = {}
+        self._types = {}
+        self._cache.clear()
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except:
+            return
+
+        for name, entry in data.items():
+            if isinstance(entry, dict):
+                self._keys[name] = entry['key']
+                if entry.get('fingerprint'):
+                    self._fingerprints[name] = entry['fingerprint']
+                if entry.get('type'):
+                    self._types[name] = entry['type']
+            else:
+                self._keys[name] = entry
+
+    def save(self):
+        """Salva la rubrica con le impronte accanto alle chiavi"""
+        data = {
+            name: {'key': key_b64, 'fingerprint': self.fingerprint(name), 'type': self.key_type(name)}
+            for name, key_b64 in self._keys.items()
+        }
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+
+    def add(self, name, key_b64, public_key=None, fingerprint=None):
+        """Aggiunge un contatto (eventualmente con la chiave già analizzata)"""
+        self._keys[name] = key_b64
+        self._fingerprints[name] = fingerprint or compute_fingerprint(key_b64)
+        self._types.pop(name, None)
+        self._forget(name)
+        if public_key is not None:
+            self._remember(name, public_key)
+
+    def remove(self, name):
+        """Rimuove un contatto"""
+        del self._keys[name]
+        self._fingerprints.pop(name, None)
+        self._types.pop(name, None)
+        self._forget(name)
+
+    def fingerprint(self, name):
+        """Impronta del contatto (calcolata una volta sola)"""
+        fingerprint = self._fingerprints.get(name)
+        if fingerprint is None:
+            fingerprint = compute_fingerprint(self._keys[name])
+            self._fingerprints[name] = fingerprint
+        return fingerprint
+
+    def key_type(self, name):
+        """Tipo di chiave del contatto ('rsa' o 'x25519')"""
+        key_type = self._types.get(name)
+        if key_type is None:
+            key_type = cryptomessage_keys.detect_key_type(base64.b64decode(self._keys[name]))
+            self._types[name] = key_type
+        return key_type
+
+    def entries(self):
+        """Tuple (nome, impronta, tipo di chiave) di tutti i contatti"""
+        for name in self._keys:
+            yield name, self.fingerprint(name), self.key_type(name)
+
+    # Interfaccia dizionario (nome -> chiave base64)
+
+    def __getitem__(self, name):
+        return self._keys[name]
+
+    def __contains__(self, name):
+        return name in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return self._keys.keys()
+
+    def items(self):
+        return self._keys.items()
+
+
+class SQLiteKeyring(_KeyCache):
+    """Rubrica SQLite: stessa interfaccia di ContactKeyring, senza caricare tutto"""
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path, cache_size=CACHE_SIZE):
+        super().__init__(cache_size)
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+
+    def load(self, legacy_path=None):
+        """Apre il database (creandolo) e importa una volta la rubrica JSON"""
+        import sqlite3
+
+        self._cache.clear()
+        if self._db is not None:
+            self._db.close()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        # La rubrica è condivisa tra i thread del batch: accesso serializzato dal lock
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._db:
+            if self._db.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                self._db.executescript("""
+                    CREATE TABLE IF NOT EXISTS contacts (
+                        name TEXT PRIMARY KEY,
+                        key TEXT NOT NULL,
+                        fingerprint TEXT NOT NULL,
+                        key_type TEXT NOT NULL DEFAULT 'rsa'
+                    );
+                    CREATE INDEX IF NOT EXISTS contacts_fingerprint ON contacts (fingerprint);
+                    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                """)
+                self._db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+        if legacy_path and os.path.exists(legacy_path) and self._meta('migrated_from') is None:
+            self.migrate(legacy_path)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _write(self, sql, params=()):
+        with self._lock, self._db:
+            self._db.execute(sql, params)
+
+    def _meta(self, key):
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def migrate(self, legacy_path):
+        """Importa la rubrica JSON (il file resta al suo posto)"""
+        legacy = ContactKeyring(legacy_path)
+        legacy.load()
+        rows = [(name, legacy[name], legacy.fingerprint(name), legacy.key_type(name)) for name in legacy]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO contacts (name, key, fingerprint, key_type) VALUES (?, ?, ?, ?)", rows
+            )
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)",
+                             (os.path.abspath(legacy_path),))
+        return len(rows)
+
+    def save(self):
+        """Ogni modifica è già salvata: nulla da riscrivere"""
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def add(self, name, key_b64, public_key=None, fingerprint=None):
+        """Aggiunge (o sostituisce) un contatto con una sola scrittura"""
+        key_type = cryptomessage_keys.detect_key_type(base64.b64decode(key_b64))
+        self._write(
+            "INSERT OR REPLACE INTO contacts (name, key, fingerprint, key_type) VALUES (?, ?, ?, ?)",
+            (name, key_b64, fingerprint or compute_fingerprint(key_b64), key_type)
+        )
+        self._forget(name)
+        if public_key is not None:
+            self._remember(name, public_key)
+
+    def add_many(self, contacts):
+        """Aggiunge (o sostituisce) più contatti in una sola transazione
+
+        contacts: tuple (nome, chiave base64, impronta o None).
+        """
+        rows = [
+            (name, key_b64, fingerprint or compute_fingerprint(key_b64),
+             cryptomessage_keys.detect_key_type(base64.b64decode(key_b64)))
+            for name, key_b64, fingerprint in contacts
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO contacts (name, key, fingerprint, key_type) VALUES (?, ?, ?, ?)", rows
+            )
+        for name, _, _, _ in rows:
+            self._forget(name)
+        return len(rows)
+
+    def remove(self, name):
+        """Rimuove un contatto"""
+        if name not in self:
+            raise KeyError(name)
+        self._write("DELETE FROM contacts WHERE name = ?", (name,))
+        self._forget(name)
+
+    def _column(self, name, column):
+        rows = self._query(f"SELECT {column} FROM contacts WHERE name = ?", (name,))
+        if not rows:
+            raise KeyError(name)
+        return rows[0][0]
+
+    def fingerprint(self, name):
+        """Impronta del contatto (salvata nel database)"""
+        return self._column(name, "fingerprint")
+
+    def key_type(self, name):
+        """Tipo di chiave del contatto ('rsa' o 'x25519')"""
+        return self._column(name, "key_type")
+
+    def find_by_fingerprint(self, fingerprint):
+        """Nome del contatto con questa impronta (o None), tramite indice"""
+        rows = self._query("SELECT name FROM contacts WHERE fingerprint = ? LIMIT 1", (fingerprint.upper(),))
+        return rows[0][0] if rows else None
+
+    def find_by_key_id(self, kid):
+        """Nome del contatto il cui key id (prefisso dell'impronta) è kid, tramite indice"""
+        prefix = kid.upper()
+        # Intervallo sull'indice: dopo il prefisso l'impronta ha solo cifre hex (< 'G')
+        rows = self._query("SELECT name FROM contacts WHERE fingerprint >= ? AND fingerprint < ? LIMIT 1",
+                           (prefix, prefix + "G"))
+        return rows[0][0] if rows else None
+
+    def entries(self):
+        """Tuple (nome, impronta, tipo di chiave) di tutti i contatti, in una sola query"""
+        return self._query("SELECT name, fingerprint, key_type FROM contacts ORDER BY rowid")
+
+    # Interfaccia dizionario (nome -> chiave base64)
+
+    def __getitem__(self, name):
+        return self._column(name, "key")
+
+    def __contains__(self, name):
+        return bool(self._query("SELECT 1 FROM contacts WHERE name = ?", (name,)))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM contacts")[0][0]
+
+    def keys(self):
+        return [row[0] for row in self._query("SELECT name FROM contacts ORDER BY rowid")]
+
+    def items(self):
+        return self._query("SELECT name, key FROM contacts ORDER BY rowid")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Keys - Tipi di chiave dell'account
+    rsa     RSA-2048, OAEP per cifrare le chiavi e PSS per le firme
+    x25519  Ed25519 per le firme e X25519 (ECDH) per cifrare le chiavi
+
+Le chiavi x25519 espongono la stessa interfaccia delle chiavi RSA di
+cryptography (encrypt/decrypt, sign/verify, public_bytes/private_bytes), così
+il resto della CLI non distingue i due tipi. Gli argomenti di padding e
+algoritmo vengono ignorati, come nell'agente.
+
+La chiave privata salvata è solo quella Ed25519 (PKCS8 standard, cifrabile
+con password): la chiave X25519 ne viene derivata con HKDF. La chiave
+pubblica è un blocco PEM dedicato con le due chiavi pubbliche grezze:
+    -----BEGIN CRYPTOMESSENGER X25519 PUBLIC KEY-----
+    base64(Ed25519 pubblica (32) | X25519 pubblica (32))
+
+Chiave cifrata per un destinatario x25519:
+    X25519 effimera pubblica (32) | AES-256-GCM(chiave) (32 + 16)
+con chiave AES = HKDF-SHA256(ECDH, salt = effimera | destinatario).
+
+Firme su digest (sign_digest/verify_digest) per dati letti in streaming: il
+chiamante calcola SHA-256 a blocchi e firma solo i 32 byte finali.
+    rsa     RSA-PSS con Prehashed(SHA-256): identica a una firma sui dati completi
+    x25519  Ed25519 non ha una variante prehashed in cryptography: si firma
+            DIGEST_CONTEXT | SHA-256(dati), distinto da ogni firma sui dati
+"""
+
+import base64
+
+KEY_TYPES = ('rsa', 'x25519')
+DEFAULT_KEY_TYPE = 'rsa'
+
+PEM_LABEL = b"CRYPTOMESSENGER X25519 PUBLIC KEY"
+_PEM_BEGIN = b"-----BEGIN " + PEM_LABEL + b"-----"
+_PEM_END = b"-----END " + PEM_LABEL + b"-----"
+
+RAW_KEY_SIZE = 32
+_NONCE = b"\x00" * 12  # ogni chiave AES è usata una sola volta (chiave effimera)
+DIGEST_CONTEXT = b"CryptoMessenger SHA-256 digest\x00"
+DIGEST_SIZE = 32
+
+
+def detect_key_type(public_pem):
+    """Tipo di una chiave pubblica PEM, senza analizzarla"""
+    return 'x25519' if public_pem.lstrip().startswith(_PEM_BEGIN) else 'rsa'
+
+
+def _hkdf(secret, salt, info):
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        info=b"cryptomessenger/" + info
+    ).derive(secret)
+
+
+class X25519PublicKey:
+    """Chiave pubblica x25519: verifica Ed25519 e cifratura via ECDH"""
+
+    key_type = 'x25519'
+
+    def __init__(self, verify_key, exchange_key):
+        self.verify_key = verify_key
+        self.exchange_key = exchange_key
+
+    @classmethod
+    def from_pem(cls, data):
+        from cryptography.hazmat.primitives.asymmetric import ed25519, x25519
+
+        body = data.strip()
+        if not body.startswith(_PEM_BEGIN) or not body.endswith(_PEM_END):
+            raise ValueError("Chiave pubblica x25519 non valida")
+        raw = base64.b64decode(b"".join(body[len(_PEM_BEGIN):-len(_PEM_END)].split()))
+        if len(raw) != 2 * RAW_KEY_SIZE:
+            raise ValueError("Chiave pubblica x25519 non valida")
+        return cls(
+            ed25519.Ed25519PublicKey.from_public_bytes(raw[:RAW_KEY_SIZE]),
+            x25519.X25519PublicKey.from_public_bytes(raw[RAW_KEY_SIZE:])
+        )
+
+    def _raw(self, key):
+        from cryptography.hazmat.primitives import serialization
+
+        return key.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+
+    def public_bytes(self, encoding=None, format=None):
+        """Sempre il blocco PEM dedicato (l'unico formato usato dalla CLI)"""
+        body = base64.b64encode(self._raw(self.verify_key) + self._raw(self.exchange_key))
+        return _PEM_BEGIN + b"\n" + body + b"\n" + _PEM_END + b"\n"
+
+    def encrypt(self, plaintext, padding=None):
+        """Cifra una chiave simmetrica per questo destinatario (ECDH effimero)"""
+        from cryptography.hazmat.primitives.asymmetric import x25519
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        ephemeral = x25519.X25519PrivateKey.generate()
+        ephemeral_public = self._raw(ephemeral.public_key())
+        shared = ephemeral.exchange(self.exchange_key)
+        wrap_key = _hkdf(shared, ephemeral_public + self._raw(self.exchange_key), b"wrap")
+        return ephemeral_public + AESGCM(wrap_key).encrypt(_NONCE, plaintext, None)
+
+    def verify(self, signature, data, padding=None, algorithm=None):
+        """Verifica una firma Ed25519 (solleva InvalidSignature se non valida)"""
+        self.verify_key.verify(bytes(signature), bytes(data))
+
+    def verify_digest(self, signature, digest):
+        """Verifica una firma fatta con X25519PrivateKey.sign_digest"""
+        self.verify_key.verify(bytes(signature), DIGEST_CONTEXT + bytes(digest))
+
+
+class X25519PrivateKey:
+    """Chiave privata x25519: Ed25519 salvata, X25519 derivata"""
+
+    key_type = 'x25519'
+
+    def __init__(self, signing_key):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import x25519
+
+        self.signing_key = signing_key
+        seed = signing_key.private_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PrivateFormat.Raw,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        self.exchange_key = x25519.X25519PrivateKey.from_private_bytes(_hkdf(seed, None, b"x25519"))
+        self._public_key = None
+
+    @classmethod
+    def generate(cls):
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+
+        return cls(ed25519.Ed25519PrivateKey.generate())
+
+    def public_key(self):
+        if self._public_key is None:
+            self._public_key = X25519PublicKey(self.signing_key.public_key(), self.exchange_key.public_key())
+        return self._public_key
+
+    def private_bytes(self, encoding, format, encryption_algorithm):
+        """Serializza la chiave Ed25519 (la X25519 si rigenera al caricamento)"""
+        return self.signing_key.private_bytes(encoding, format, encryption_algorithm)
+
+    def decrypt(self, ciphertext, padding=None):
+        """Decifra una chiave simmetrica cifrata con X25519PublicKey.encrypt"""
+        from cryptography.hazmat.primitives.asymmetric import x25519
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        ciphertext = bytes(ciphertext)
+        if len(ciphertext) <= RAW_KEY_SIZE:
+            raise ValueError("Chiave cifrata x25519 non valida")
+        ephemeral_public = ciphertext[:RAW_KEY_SIZE]
+        shared = self.exchange_key.exchange(x25519.X25519PublicKey.from_public_bytes(ephemeral_public))
+        own_public = self.public_key()._raw(self.exchange_key.public_key())
+        wrap_key = _hkdf(shared, ephemeral_public + own_public, b"wrap")
+        return AESGCM(wrap_key).decrypt(_NONCE, ciphertext[RAW_KEY_SIZE:], None)
+
+    def sign(self, data, padding=None, algorithm=None):
+        """Firma Ed25519"""
+        return self.signing_key.sign(bytes(data))
+
+    def sign_digest(self, digest):
+        """Firma Ed25519 di un digest SHA-256 (con contesto dedicato)"""
+        return self.signing_key.sign(DIGEST_CONTEXT + bytes(digest))
+
+
+def _pss():
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    return padding.PSS(
+        mgf=padding.MGF1(hashes.SHA256()),
+        salt_length=padding.PSS.MAX_LENGTH
+    )
+
+
+def sign_digest(private_key, digest):
+    """Firma un digest SHA-256 già calcolato (chiave locale, x25519 o agente)"""
+    if len(digest) != DIGEST_SIZE:
+        raise ValueError("Digest SHA-256 non valido")
+    if hasattr(private_key, 'sign_digest'):
+        return private_key.sign_digest(digest)
+
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import utils
+
+    return private_key.sign(bytes(digest), _pss(), utils.Prehashed(hashes.SHA256()))
+
+
+def verify_digest(public_key, signature, digest):
+    """Verifica la firma di un digest SHA-256 (solleva InvalidSignature se non valida)"""
+    if hasattr(public_key, 'verify_digest'):
+        return public_key.verify_digest(signature, digest)
+
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import utils
+
+    public_key.verify(bytes(signature), bytes(digest), _pss(), utils.Prehashed(hashes.SHA256()))
+
+
+def key_type_of(key):
+    """Tipo di un oggetto chiave (pubblica o privata)"""
+    return getattr(key, 'key_type', 'rsa')
+
+
+def generate_private_key(key_type=DEFAULT_KEY_TYPE):
+    """Genera una nuova chiave privata del tipo richiesto"""
+    if key_type == 'x25519':
+        return X25519PrivateKey.generate()
+    if key_type != 'rsa':
+        raise ValueError(f"Tipo di chiave non supportato: {key_type}")
+
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def _wrap_private_key(private_key):
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return X25519PrivateKey(private_key)
+    return private_key
+
+
+def load_pem_private_key(data, password=None):
+    """Come serialization.load_pem_private_key, ma riconosce le chiavi x25519"""
+    from cryptography.hazmat.primitives import serialization
+
+    return _wrap_private_key(serialization.load_pem_private_key(data, password=password))
+
+
+def load_der_private_key(data, password=None):
+    """Come serialization.load_der_private_key, ma riconosce le chiavi x25519"""
+    from cryptography.hazmat.primitives import serialization
+
+    return _wrap_private_key(serialization.load_der_private_key(data, password=password))
+
+
+def load_pem_public_key(data):
+    """Analizza una chiave pubblica PEM di qualunque tipo supportato"""
+    if detect_key_type(data) == 'x25519':
+        return X25519PublicKey.from_pem(data)
+
+    from cryptography.hazmat.primitives import serialization
+
+    return serialization.load_pem_public_key(data)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Packet - Codifica e decodifica dei pacchetti messaggio
+
+v2 (legacy): base64(JSON) con ciphertext, chiave, IV e firma a loro volta in base64.
+v3: formato binario con campi a lunghezza prefissata, opzionalmente con un
+    unico strato di armatura ASCII ("CM3:" + base64).
+
+Layout v3 (interi big-endian):
+    b"CM" | u8 versione (3) | u8 cifrario | u8 flag
+    u8  len | timestamp (utf-8)
+    u16 len | to (utf-8)
+    u8  numero destinatari, per ciascuno:  [u8 tipo chiave] | u8 len | key id | u16 len | chiave cifrata
+                                        (tipo chiave solo con il flag FLAG_KEY_TYPES)
+    [u8 len | id sessione]              solo con il flag FLAG_SESSION
+    [u8 len | key id del firmatario]    solo con il flag FLAG_SIGNER
+    u8  len | iv
+    u32 len | ciphertext
+    u16 len | firma
+
+Tutti i decoder restituiscono lo stesso dizionario:
+    {'version', 'cipher', 'multi', 'session', 'recipients': [{'to', 'kid', 'key_type', 'aes_key'}],
+     'iv', 'data', 'signature', 'signer_kid', 'timestamp', 'to'}
+
+'kid' e 'signer_kid' sono identificativi brevi delle chiavi (prefisso
+dell'impronta SHA-256): chi decifra sceglie la propria chiave e il
+firmatario con una ricerca diretta, senza tentativi. Sono None nei
+pacchetti che non li riportano (v2 a destinatario singolo, versioni precedenti).
+
+'key_type' ('rsa' o 'x25519') indica come è cifrata la chiave del destinatario;
+i pacchetti senza indicazione sono RSA. Un pacchetto solo RSA è codificato
+esattamente come prima dell'introduzione dei tipi di chiave.
+
+Nei pacchetti di sessione 'recipients' contiene la chiave di sessione cifrata
+solo nel primo messaggio; nei successivi è vuoto.
+Nel v3 'data' è una memoryview sul buffer ricevuto: nessuna copia del ciphertext.
+
+'cipher' è AES-256-CBC (v2 e pacchetti precedenti) oppure un cifrario AEAD,
+AES-256-GCM o ChaCha20-Poly1305: in quel caso 'iv' è il nonce da 12 byte e
+'data' termina con il tag di autenticazione (vedi cryptomessage_aead).
+"""
+
+import base64
+import binascii
+import json
+import struct
+
+MAGIC = b"CM"
+VERSION_3 = 3
+ARMOR_PREFIX = "CM3:"
+_ARMOR_CHUNK = 3 * 256 * 1024  # multiplo di 3: nessun padding intermedio
+_DEARMOR_CHUNK = 4 * 256 * 1024
+
+CIPHERS = {1: 'AES-256-CBC', 2: 'AES-256-GCM', 3: 'ChaCha20-Poly1305'}
+CIPHER_IDS = {name: cipher_id for cipher_id, name in CIPHERS.items()}
+
+FLAG_SIGNED = 0x01
+FLAG_MULTI = 0x02
+FLAG_SESSION = 0x04
+FLAG_KEY_TYPES = 0x08
+FLAG_SIGNER = 0x10
+
+KEY_TYPES = {1: 'rsa', 2: 'x25519'}
+KEY_TYPE_IDS = {name: type_id for type_id, name in KEY_TYPES.items()}
+
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _key_type(recipient):
+    return recipient.get('key_type') or 'rsa'
+
+
+# Formato v2 (JSON)
+
+def encode_v2(packet):
+    """Pacchetto v2: base64(JSON) compatibile con la GUI e le versioni precedenti"""
+    if packet.get('session'):
+        raise ValueError("I messaggi di sessione richiedono il formato v3")
+    fields = {}
+    if packet.get('multi'):
+        fields['version'] = '2.1'
+        fields['recipients'] = []
+        for r in packet['recipients']:
+            entry = {'to': r['to'], 'kid': r['kid'], 'aes_key': _b64(r['aes_key'])}
+            if _key_type(r) != 'rsa':
+                entry['key_type'] = _key_type(r)
+            fields['recipients'].append(entry)
+    else:
+        fields['version'] = '2.0'
+        fields['aes_key'] = _b64(packet['recipients'][0]['aes_key'])
+        if packet['recipients'][0].get('kid'):
+            fields['kid'] = packet['recipients'][0]['kid']
+        if _key_type(packet['recipients'][0]) != 'rsa':
+            fields['key_type'] = _key_type(packet['recipients'][0])
+    fields['iv'] = _b64(packet['iv'])
+    fields['data'] = _b64(packet['data'])
+    fields['signature'] = _b64(packet['signature']) if packet.get('signature') else ""
+    if packet.get('signature') and packet.get('signer_kid'):
+        fields['signer_kid'] = packet['signer_kid']
+    fields['timestamp'] = packet['timestamp']
+    fields['to'] = packet['to']
+    return base64.b64encode(json.dumps(fields).encode()).decode()
+
+
+def decode_v2(encrypted_text):
+    """Decodifica un pacchetto v2 (base64 di JSON)"""
+    fields = json.loads(base64.b64decode(encrypted_text).decode())
+
+    if 'recipients' in fields:
+        recipients = [
+            {'to': r.get('to'), 'kid': r.get('kid'), 'key_type': r.get('key_type', 'rsa'),
+             'aes_key': base64.b64decode(r['aes_key'])}
+            for r in fields['recipients']
+        ]
+    else:
+        recipients = [{'to': fields.get('to'), 'kid': fields.get('kid'), 'key_type': fields.get('key_type', 'rsa'),
+                       'aes_key': base64.b64decode(fields['aes_key'])}]
+
+    return {
+        'version': fields.get('version', '2.0'),
+        'cipher': 'AES-256-CBC',
+        'multi': 'recipients' in fields,
+        'session': None,
+        'recipients': recipients,
+        'iv': base64.b64decode(fields['iv']),
+        'data': base64.b64decode(fields['data']),
+        'signature': base64.b64decode(fields['signature']) if fields.get('signature') else b"",
+        'signer_kid': fields.get('signer_kid'),
+        'timestamp': fields.get('timestamp', 'Sconosciuto'),
+        'to': fields.get('to', 'Sconosciuto'),
+    }
+
+
+# Formato v3 (binario)
+
+def encode_v3(packet):
+    """Pacchetto v3 binario a lunghezza prefissata"""
+    return b"".join(_encode_v3_parts(packet))
+
+
+def _encode_v3_parts(packet):
+    """Campi del pacchetto v3 in ordine, senza concatenarli (il ciphertext non viene copiato)"""
+    flags = 0
+    if packet.get('signature'):
+        flags |= FLAG_SIGNED
+    if packet.get('multi'):
+        flags |= FLAG_MULTI
+    if packet.get('session'):
+        flags |= FLAG_SESSION
+    if any(_key_type(r) != 'rsa' for r in packet['recipients']):
+        flags |= FLAG_KEY_TYPES
+    if packet.get('signature') and packet.get('signer_kid'):
+        flags |= FLAG_SIGNER
+
+    timestamp = packet['timestamp'].encode()
+    to = packet['to'].encode()
+    recipients = packet['recipients']
+    if len(recipients) > 255:
+        raise ValueError("Troppi destinatari per un pacchetto v3 (massimo 255)")
+
+    parts = [
+        MAGIC,
+        _U8.pack(VERSION_3),
+        _U8.pack(CIPHER_IDS[packet.get('cipher', 'AES-256-CBC')]),
+        _U8.pack(flags),
+        _U8.pack(len(timestamp)), timestamp,
+        _U16.pack(len(to)), to,
+        _U8.pack(len(recipients)),
+    ]
+    for recipient in recipients:
+        if flags & FLAG_KEY_TYPES:
+            parts.append(_U8.pack(KEY_TYPE_IDS[_key_type(recipient)]))
+        kid = bytes.fromhex(recipient['kid']) if recipient.get('kid') else b""
+        parts += [_U8.pack(len(kid)), kid, _U16.pack(len(recipient['aes_key'])), recipient['aes_key']]
+    if packet.get('session'):
+        session_id = bytes.fromhex(packet['session'])
+        parts += [_U8.pack(len(session_id)), session_id]
+    if flags & FLAG_SIGNER:
+        signer_kid = bytes.fromhex(packet['signer_kid'])
+        parts += [_U8.pack(len(signer_kid)), signer_kid]
+
+    signature = packet.get('signature') or b""
+    parts += [
+        _U8.pack(len(packet['iv'])), packet['iv'],
+        _U32.pack(len(packet['data'])), packet['data'],
+        _U16.pack(len(signature)), signature,
+    ]
+    return parts
+
+
+class _Reader:
+    """Legge campi a lunghezza prefissata da una memoryview senza copiarla"""
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.offset = 0
+
+    def take(self, size):
+        end = self.offset + size
+        if end > len(self.view):
+            raise ValueError("Pacchetto troncato")
+        chunk = self.view[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def int(self, fmt):
+        return fmt.unpack(self.take(fmt.size))[0]
+
+    def field(self, fmt):
+        return self.take(self.int(fmt))
+
+
+def decode_v3(data):
+    """Decodifica un pacchetto v3 binario"""
+    reader = _Reader(data)
+    if reader.take(len(MAGIC)) != MAGIC:
+        raise ValueError("Formato pacchetto non valido")
+    version = reader.int(_U8)
+    if version != VERSION_3:
+        raise ValueError(f"Versione pacchetto non supportata: {version}")
+
+    cipher_id = reader.int(_U8)
+    if cipher_id not in CIPHERS:
+        raise ValueError(f"Cifrario non supportato: {cipher_id}")
+    flags = reader.int(_U8)
+
+    timestamp = str(reader.field(_U8), 'utf-8')
+    to = str(reader.field(_U16), 'utf-8')
+
+    recipients = []
+    for _ in range(reader.int(_U8)):
+        key_type = 'rsa'
+        if flags & FLAG_KEY_TYPES:
+            type_id = reader.int(_U8)
+            if type_id not in KEY_TYPES:
+                raise ValueError(f"Tipo di chiave non supportato: {type_id}")
+            key_type = KEY_TYPES[type_id]
+        kid = reader.field(_U8)
+        recipients.append({
+            'to': None,
+            'kid': kid.hex() if len(kid) else None,
+            'key_type': key_type,
+            # RSA richiede bytes: la chiave cifrata è piccola, la copia è trascurabile
+            'aes_key': bytes(reader.field(_U16)),
+        })
+
+    session = reader.field(_U8).hex() if flags & FLAG_SESSION else None
+    signer_kid = reader.field(_U8).hex() if flags & FLAG_SIGNER else None
+
+    iv = bytes(reader.field(_U8))
+    ciphertext = reader.field(_U32)
+    signature = bytes(reader.field(_U16))
+    if reader.offset != len(reader.view):
+        raise ValueError("Dati inattesi in coda al pacchetto")
+
+    return {
+        'version': VERSION_3,
+        'cipher': CIPHERS[cipher_id],
+        'multi': bool(flags & FLAG_MULTI),
+        'session': session,
+        'recipients': recipients,
+        'iv': iv,
+        'data': ciphertext,
+        'signature': signature,
+        'signer_kid': signer_kid,
+        'timestamp': timestamp,
+        'to': to,
+    }
+
+
+# Armatura ASCII
+
+def armor(data):
+    """Unico strato ASCII sopra il pacchetto binario (dati o lista di parti)"""
+    parts = data if isinstance(data, list) else [data]
+    prefix = ARMOR_PREFIX.encode()
+    total = sum(len(part) for part in parts)
+
+    # Base64 a blocchi in un buffer preallocato: le parti non vengono concatenate
+    out = bytearray(len(prefix) + 4 * ((total + 2) // 3))
+    out[:len(prefix)] = prefix
+    position = len(prefix)
+    carry = b""
+    for part in parts:
+        view = memoryview(part)
+        if carry:
+            # Completa il gruppo di 3 byte rimasto dalla parte precedente
+            needed = 3 - len(carry)
+            carry += bytes(view[:needed])
+            view = view[needed:]
+            if len(carry) < 3:
+                continue
+            out[position:position + 4] = binascii.b2a_base64(carry, newline=False)
+            position += 4
+        usable = len(view) - len(view) % 3
+        for start in range(0, usable, _ARMOR_CHUNK):
+            encoded = binascii.b2a_base64(view[start:min(start + _ARMOR_CHUNK, usable)], newline=False)
+            out[position:position + len(encoded)] = encoded
+            position += len(encoded)
+        carry = bytes(view[usable:])
+    if carry:
+        out[position:] = binascii.b2a_base64(carry, newline=False)
+    return out.decode('ascii')
+
+
+def dearmor(text):
+    """Rimuove l'armatura ASCII"""
+    text = text.rstrip()
+    start = len(ARMOR_PREFIX)
+    length = len(text) - start
+    if length % 4 or text[start:start + 1].isspace():
+        return base64.b64decode(text[start:].strip())
+
+    # Decodifica a blocchi in un buffer preallocato, senza copiare il testo;
+    # con caratteri estranei (a capo, spazi) le lunghezze non tornano e si
+    # ripiega sulla decodifica completa
+    size = length // 4 * 3 - (len(text[-2:]) - len(text[-2:].rstrip('=')))
+    out = bytearray(size)
+    position = 0
+    try:
+        for offset in range(start, len(text), _DEARMOR_CHUNK):
+            decoded = binascii.a2b_base64(text[offset:offset + _DEARMOR_CHUNK])
+            if position + len(decoded) > size:
+                raise binascii.Error("Lunghezza non valida")
+            out[position:position + len(decoded)] = decoded
+            position += len(decoded)
+    except (binascii.Error, ValueError):
+        position = -1
+    if position != size:
+        return base64.b64decode(text[start:])
+    return out
+
+
+# Interfaccia generale
+
+def encode(packet, fmt='v3', armored=True):
+    """Codifica il pacchetto nel formato richiesto ('v3' o 'v2')"""
+    if fmt == 'v2':
+        return encode_v2(packet)
+    if armored:
+        return armor(_encode_v3_parts(packet))
+    return encode_v3(packet)
+
+
+def decode(encrypted):
+    """Riconosce il formato (v3 binario, v3 armato, v2) e decodifica"""
+    if isinstance(encrypted, (bytes, bytearray, memoryview)):
+        if bytes(encrypted[:len(MAGIC) + 1]) == MAGIC + _U8.pack(VERSION_3):
+            return decode_v3(encrypted)
+        encrypted = bytes(encrypted).decode('ascii')
+
+    encrypted = encrypted.strip()
+    if encrypted.startswith(ARMOR_PREFIX):
+        try:
+            return decode_v3(dearmor(encrypted))
+        except binascii.Error:
+            raise ValueError("Armatura ASCII non valida")
+    return decode_v2(encrypted)
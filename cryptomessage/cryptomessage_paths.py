@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Paths - Cartella dei dati dell'account
+
+Ordine di ricerca (mai la cartella corrente):
+    1. variabile CRYPTOMESSENGER_HOME
+    2. cartella di configurazione dell'utente:
+       %APPDATA%\\cryptomessenger su Windows, altrimenti
+       $XDG_CONFIG_HOME/cryptomessenger (default ~/.config/cryptomessenger)
+
+I file di una versione precedente (che li salvava nella cartella corrente) si
+importano solo da una cartella indicata esplicitamente, con il comando
+migrate della CLI (vedi migrate_legacy). Gli originali restano dove sono.
+"""
+
+import os
+import shutil
+
+APP_NAME = "cryptomessenger"
+
+LEGACY_FILES = (
+    "cryptomessenger_config.json",
+    "cryptomessenger_contacts.json",
+)
+
+# File dell'account che le versioni precedenti della CLI creavano nella cartella corrente
+ACCOUNT_FILES = LEGACY_FILES + (
+    "cryptomessenger_contacts.db",
+    "cryptomessenger_groups.json",
+    "cryptomessenger_sessions.bin",
+    "cryptomessenger_archive.bin",
+    "cryptomessenger_archive.db",
+)
+
+
+def config_dir():
+    """Cartella di configurazione dell'utente per CryptoMessenger"""
+    if os.name == "nt" and os.environ.get("APPDATA"):
+        base = os.environ["APPDATA"]
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, APP_NAME)
+
+
+def data_dir():
+    """Cartella in cui leggere e salvare i file dell'account"""
+    home = os.environ.get("CRYPTOMESSENGER_HOME")
+    if home:
+        return os.path.abspath(home)
+    return config_dir()
+
+
+def migrate_legacy(path, source):
+    """Copia in path i file dell'account trovati nella cartella source
+
+    Solo se path non contiene ancora un account (configurazione): la copia
+    avviene una volta e non sovrascrive mai file esistenti, come una rubrica
+    vuota creata prima del setup. Restituisce i nomi dei file copiati.
+    """
+    source = os.path.abspath(source)
+    if source == os.path.abspath(path) or os.path.exists(os.path.join(path, LEGACY_FILES[0])):
+        return []
+    found = [name for name in ACCOUNT_FILES
+             if os.path.isfile(os.path.join(source, name)) and not os.path.exists(os.path.join(path, name))]
+    if not any(name in LEGACY_FILES for name in found):
+        return []
+
+    ensure_dir(path)
+    for name in found:
+        target = os.path.join(path, name)
+        shutil.copyfile(os.path.join(source, name), target)
+        # Configurazione e rubrica leggibili solo dall'utente
+        os.chmod(target, 0o600)
+    return found
+
+
+def ensure_dir(path):
+    """Crea la cartella dei dati (accessibile solo all'utente) se manca"""
+    if path:
+        os.makedirs(path, mode=0o700, exist_ok=True)
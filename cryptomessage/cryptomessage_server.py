@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Server - Cifratura e decifratura come servizio locale
+Il processo resta attivo con rubrica, chiavi analizzate e chiave privata
+sbloccata in memoria, e risponde a richieste JSON-RPC 2.0 su un socket Unix.
+
+Protocollo: una richiesta JSON per riga, una risposta JSON per riga. Le
+richieste di una stessa connessione vengono eseguite in parallelo: le
+risposte possono arrivare in ordine diverso e vanno abbinate tramite "id".
+Sono accettati anche i batch JSON-RPC (lista di richieste).
+
+    ping                                      -> {"key_id", "key_type", "contacts"}
+    public_key                                -> {"public_key": "<PEM>", "fingerprint"}
+    contacts                                  -> [{"name", "fingerprint", "key_type"}]
+    encrypt {"recipient" | "recipients" | "group", "message",
+             "sign": true, "format": "v3", "session": false, "cipher": null}
+                                              -> {"packet", "recipients", "signed", "session", "new_session",
+                                                  "cipher"}
+    decrypt {"packet"}                        -> {"message", "timestamp", "sender", "signed",
+                                                  "signature_valid", "packet_hash"}
+    shutdown                                  -> true
+
+Gli errori di CryptoMessenger hanno codice -32000 e il nome dell'eccezione
+in error.data.type (es. ContactNotFoundError).
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cryptomessage_agent
+from cryptomessage_core import CryptoMessengerError
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+APPLICATION_ERROR = -32000
+
+MAX_LINE = 64 * 1024 * 1024  # una richiesta (pacchetto armato) per riga
+IN_FLIGHT_PER_WORKER = 4
+
+
+def default_socket_path():
+    """Socket nella stessa cartella privata dell'agente (vedi cryptomessage_agent.socket_dir)"""
+    path = os.environ.get("CRYPTOMESSENGER_SERVER_SOCK")
+    if path:
+        return path
+    return os.path.join(cryptomessage_agent.socket_dir(), "server.sock")
+
+
+class RPCError(Exception):
+    """Errore JSON-RPC con codice"""
+
+    def __init__(self, code, message, data=None):
+        super().__init__(message)
+        self.code = code
+        self.data = data
+
+
+class MessengerServer:
+    """Server JSON-RPC: ciclo asyncio per le connessioni, crittografia nei thread"""
+
+    def __init__(self, messenger, socket_path=None, jobs=None):
+        self.messenger = messenger
+        self.socket_path = socket_path or default_socket_path()
+        self.jobs = jobs or os.cpu_count() or 1
+        self.requests = 0
+        self._executor = None
+        self._stopped = None
+        self._connections = {}
+        self._methods = {
+            'ping': self.rpc_ping,
+            'public_key': self.rpc_public_key,
+            'contacts': self.rpc_contacts,
+            'encrypt': self.rpc_encrypt,
+            'decrypt': self.rpc_decrypt,
+        }
+        self._signatures = {name: inspect.signature(handler) for name, handler in self._methods.items()}
+
+    # Metodi (eseguiti nel pool di thread)
+
+    def rpc_ping(self):
+        messenger = self.messenger
+        return {
+            'key_id': messenger.get_key_id(messenger.public_key_b64),
+            'key_type': messenger.key_type,
+            'contacts': len(messenger.contacts),
+        }
+
+    def rpc_public_key(self):
+        return {
+            'public_key': self.messenger.public_key_pem().decode(),
+            'fingerprint': self.messenger.get_key_fingerprint(self.messenger.public_key_b64),
+        }
+
+    def rpc_contacts(self):
+        return self.messenger.contact_list()
+
+    def rpc_encrypt(self, message, recipient=None, recipients=None, group=None, sign=True, format='v3',
+                    session=False, cipher=None):
+        if not isinstance(message, str):
+            raise RPCError(INVALID_PARAMS, "message deve essere una stringa")
+        if format not in ('v3', 'v2'):
+            raise RPCError(INVALID_PARAMS, f"Formato non supportato: {format}")
+        if recipients is not None and (
+                not isinstance(recipients, list) or not all(isinstance(name, str) for name in recipients)):
+            raise RPCError(INVALID_PARAMS, "recipients deve essere una lista di stringhe")
+        for name, value in (('recipient', recipient), ('group', group)):
+            if value is not None and not isinstance(value, str):
+                raise RPCError(INVALID_PARAMS, f"{name} deve essere una stringa")
+        if recipients or group:
+            if session:
+                raise RPCError(INVALID_PARAMS, "session vale solo per un singolo destinatario")
+            names = self.messenger.resolve_recipients(','.join(recipients or []), group)
+            if not names:
+                raise RPCError(INVALID_PARAMS, "Nessun destinatario")
+            result = self.messenger.encrypt_multi(names, message, sign, format, cipher=cipher)
+        elif recipient:
+            result = self.messenger.encrypt(recipient, message, sign, format, session=session, cipher=cipher)
+        else:
+            raise RPCError(INVALID_PARAMS, "Specifica recipient, recipients o group")
+
+        return {
+            'packet': result['encoded'],
+            'recipients': result['recipients'],
+            'signed': result['signed'],
+            'session': result['session'],
+            'new_session': result['new_session'],
+            'cipher': result['packet']['cipher'],
+        }
+
+    def rpc_decrypt(self, packet):
+        if not isinstance(packet, str):
+            raise RPCError(INVALID_PARAMS, "packet deve essere una stringa (CM3:... o base64 v2)")
+        return self.messenger.decrypt(packet)
+
+    # Protocollo
+
+    def _call(self, method, params):
+        """Esegue un metodo con i parametri della richiesta (in un thread del pool)"""
+        # Parametri mancanti o sconosciuti: solo un bind fallito è INVALID_PARAMS
+        try:
+            if isinstance(params, dict):
+                bound = self._signatures[method].bind(**params)
+            else:
+                bound = self._signatures[method].bind(*params)
+        except TypeError as e:
+            raise RPCError(INVALID_PARAMS, str(e)) from e
+        return self._methods[method](*bound.args, **bound.kwargs)
+
+    async def _handle(self, request):
+        """Risposta a una singola richiesta (None per le notifiche)"""
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or \
+                not isinstance(request.get('method'), str):
+            return _error(None, INVALID_REQUEST, "Richiesta JSON-RPC non valida")
+
+        request_id = request.get('id')
+        method = request['method']
+        params = request.get('params', {})
+        try:
+            if method == 'shutdown':
+                self._stopped.set()
+                result = True
+            elif method not in self._methods:
+                raise RPCError(METHOD_NOT_FOUND, f"Metodo sconosciuto: {method}")
+            elif not isinstance(params, (dict, list)):
+                raise RPCError(INVALID_PARAMS, "params deve essere un oggetto o una lista")
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._executor, self._call, method, params)
+        except RPCError as e:
+            response = _error(request_id, e.code, str(e), e.data)
+        except CryptoMessengerError as e:
+            response = _error(request_id, APPLICATION_ERROR, str(e), {'type': type(e).__name__})
+        except Exception as e:
+            response = _error(request_id, INTERNAL_ERROR, str(e) or type(e).__name__,
+                              {'type': type(e).__name__})
+        else:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+        self.requests += 1
+
+        if 'id' not in request:
+            return None
+        return response
+
+    async def _handle_payload(self, payload, send, slots, weight):
+        """Esegue una richiesta o un batch che occupa weight posti della connessione"""
+        try:
+            if isinstance(payload, list):
+                if not payload:
+                    await send(_error(None, INVALID_REQUEST, "Batch vuoto"))
+                    return
+                # Il batch non supera i posti che ha ottenuto
+                limit = asyncio.Semaphore(weight)
+
+                async def limited(request):
+                    async with limit:
+                        return await self._handle(request)
+
+                responses = await asyncio.gather(*(limited(r) for r in payload))
+                responses = [r for r in responses if r is not None]
+                if responses:
+                    await send(responses)
+            else:
+                response = await self._handle(payload)
+                if response is not None:
+                    await send(response)
+        finally:
+            for _ in range(weight):
+                slots.release()
+
+    async def _connection(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None and not cryptomessage_agent.peer_allowed(sock):
+            writer.close()
+            return
+
+        self._connections[asyncio.current_task()] = writer
+        write_lock = asyncio.Lock()
+
+        async def send(response):
+            data = json.dumps(response, ensure_ascii=False).encode() + b"\n"
+            async with write_lock:
+                writer.write(data)
+                await writer.drain()
+
+        # Richieste in volo limitate per connessione: memoria costante. Un batch
+        # conta una volta per richiesta (fino a tutti i posti); solo questo ciclo
+        # acquisisce posti, quindi due batch non possono bloccarsi a vicenda
+        capacity = self.jobs * IN_FLIGHT_PER_WORKER
+        slots = asyncio.Semaphore(capacity)
+        tasks = set()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    await send(_error(None, INVALID_REQUEST, "Richiesta troppo grande"))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    payload = json.loads(line)
+                except ValueError:
+                    await send(_error(None, PARSE_ERROR, "JSON non valido"))
+                    continue
+                weight = min(len(payload), capacity) if isinstance(payload, list) and payload else 1
+                for _ in range(weight):
+                    await slots.acquire()
+                task = asyncio.ensure_future(self._handle_payload(payload, send, slots, weight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.pop(asyncio.current_task(), None)
+            writer.close()
+
+    async def _serve(self, ready=None):
+        self._stopped = asyncio.Event()
+        cryptomessage_agent.private_dir(self.socket_path)
+        if os.path.lexists(self.socket_path):
+            os.remove(self.socket_path)
+
+        old_umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._connection, self.socket_path, limit=MAX_LINE)
+        finally:
+            os.umask(old_umask)
+
+        if ready is not None:
+            ready()
+        try:
+            async with server:
+                await self._stopped.wait()
+                # Le connessioni aperte vengono chiuse (dopo l'invio delle risposte già pronte)
+                connections = list(self._connections.items())
+                for _, writer in connections:
+                    writer.close()
+                await asyncio.gather(*(task for task, _ in connections), return_exceptions=True)
+        finally:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def serve(self, ready=None):
+        """Resta in ascolto fino a 'shutdown' o Ctrl+C"""
+        # Rubrica aperta e chiave pubblica analizzata prima della prima richiesta
+        len(self.messenger.contacts)
+        self.messenger.public_key
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="cryptomessenger-rpc")
+        try:
+            asyncio.run(self._serve(ready))
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+def _error(request_id, code, message, data=None):
+    error = {'code': code, 'message': message}
+    if data is not None:
+        error['data'] = data
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': error}
+
+
+class RPCClient:
+    """Client sincrono per il server (thread-safe, una connessione)"""
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or default_socket_path()
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+        self._next_id = 0
+
+    def call(self, method, **params):
+        """Chiama un metodo e restituisce il risultato (solleva RPCError)"""
+        with self._lock:
+            if self._sock is None:
+                self._sock = cryptomessage_agent.open_socket(self.socket_path)
+                self._file = self._sock.makefile('rwb')
+            self._next_id += 1
+            request = {'jsonrpc': '2.0', 'id': self._next_id, 'method': method, 'params': params}
+            self._file.write(json.dumps(request).encode() + b"\n")
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError("Server non raggiungibile")
+        response = json.loads(line)
+        if 'error' in response:
+            error = response['error']
+            raise RPCError(error['code'], error['message'], error.get('data'))
+        return response['result']
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._file.close()
+                self._sock.close()
+                self._sock = None
+                self._file = None
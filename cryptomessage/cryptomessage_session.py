@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Session - Chiavi di sessione per contatto
+Il primo pacchetto verso un contatto trasporta una chiave simmetrica cifrata
+con RSA; i successivi usano solo un cifrario AEAD (AES-256-GCM o
+ChaCha20-Poly1305, vedi cryptomessage_aead) con quella chiave, senza
+operazioni RSA per il destinatario
+
+Le sessioni sono salvate su disco cifrate (AES-256-GCM) con una chiave
+derivata dalla chiave privata dell'account:
+    MAGIC | nonce (12) | ciphertext del JSON
+
+Il salvataggio rilegge il file e vi unisce solo le sessioni modificate, sotto
+un lock esclusivo (file .lock accanto): più processi CLI non si sovrascrivono.
+"""
+
+import base64
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: nessun lock tra processi, resta la scrittura atomica
+    fcntl = None
+
+import cryptomessage_aead
+
+MAGIC = b"CMS1"
+NONCE_SIZE = 12
+SESSION_ID_SIZE = 8
+
+# Regole di rotazione
+MAX_MESSAGES = 1000
+MAX_AGE = 7 * 24 * 3600  # secondi
+INCOMING_GRACE = 2  # le sessioni in arrivo restano valide MAX_AGE * INCOMING_GRACE
+
+
+class SessionStore:
+    """Sessioni in uscita (per contatto) e in arrivo (per id di sessione)"""
+
+    def __init__(self, path, store_key, max_messages=MAX_MESSAGES, max_age=MAX_AGE):
+        self.path = path
+        self.store_key = store_key
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.outgoing = {}
+        self.incoming = {}
+        self._dirty_outgoing = set()
+        self._dirty_incoming = set()
+
+    def _read(self):
+        """Legge e decifra il file delle sessioni"""
+        if not os.path.exists(self.path):
+            return {'outgoing': {}, 'incoming': {}}
+
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("File delle sessioni non valido")
+        nonce = data[len(MAGIC):len(MAGIC) + NONCE_SIZE]
+        plaintext = AESGCM(self.store_key).decrypt(nonce, data[len(MAGIC) + NONCE_SIZE:], MAGIC)
+        return json.loads(plaintext)
+
+    def load(self):
+        """Carica le sessioni ed elimina quelle scadute"""
+        data = self._read()
+        self.outgoing = data.get('outgoing', {})
+        self.incoming = data.get('incoming', {})
+        self._prune()
+        return self
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Lock esclusivo tra processi per la durata di lettura, unione e scrittura"""
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def save(self):
+        """Salva le sessioni, unendo le modifiche di altri processi"""
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        with self._locked():
+            data = self._read()
+            for name in self._dirty_outgoing:
+                if name in self.outgoing:
+                    data['outgoing'][name] = self.outgoing[name]
+                else:
+                    data['outgoing'].pop(name, None)
+            for sid in self._dirty_incoming:
+                if sid in self.incoming:
+                    data['incoming'][sid] = self.incoming[sid]
+                else:
+                    data['incoming'].pop(sid, None)
+            self.outgoing = data['outgoing']
+            self.incoming = data['incoming']
+            self._prune()
+
+            nonce = os.urandom(NONCE_SIZE)
+            ciphertext = AESGCM(self.store_key).encrypt(nonce, json.dumps(data).encode(), MAGIC)
+            # File temporaneo proprio di questo processo (mkstemp crea con permessi 0600)
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".",
+                                            suffix=".tmp", dir=os.path.dirname(self.path) or ".")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(MAGIC + nonce + ciphertext)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(tmp_path)
+                raise
+        self._dirty_outgoing.clear()
+        self._dirty_incoming.clear()
+
+    def clear(self):
+        """Dimentica tutte le sessioni"""
+        self._dirty_outgoing.update(self.outgoing)
+        self._dirty_incoming.update(self.incoming)
+        self.outgoing = {}
+        self.incoming = {}
+
+    def _prune(self):
+        now = time.time()
+        for name, session in list(self.outgoing.items()):
+            if now - session['created'] > self.max_age:
+                del self.outgoing[name]
+                self._dirty_outgoing.add(name)
+        for sid, session in list(self.incoming.items()):
+            if now - session['created'] > self.max_age * INCOMING_GRACE:
+                del self.incoming[sid]
+                self._dirty_incoming.add(sid)
+
+    def outgoing_session(self, name, kid):
+        """Sessione verso il contatto, restituisce (sid, chiave, nuova)
+
+        Ruota la chiave dopo max_messages messaggi, dopo max_age secondi o se
+        la chiave pubblica del contatto è cambiata.
+        """
+        session = self.outgoing.get(name)
+        is_new = (
+            session is None
+            or session['kid'] != kid
+            or session['count'] >= self.max_messages
+            or time.time() - session['created'] > self.max_age
+        )
+        if is_new:
+            session = {
+                'sid': os.urandom(SESSION_ID_SIZE).hex(),
+                'key': base64.b64encode(os.urandom(32)).decode(),
+                'kid': kid,
+                'created': time.time(),
+                'count': 0,
+            }
+            self.outgoing[name] = session
+
+        session['count'] += 1
+        self._dirty_outgoing.add(name)
+        return session['sid'], base64.b64decode(session['key']), is_new
+
+    def add_incoming(self, sid, key):
+        """Registra una sessione ricevuta"""
+        if sid not in self.incoming:
+            self.incoming[sid] = {
+                'key': base64.b64encode(key).decode(),
+                'created': time.time(),
+            }
+            self._dirty_incoming.add(sid)
+
+    def incoming_key(self, sid):
+        """Chiave di una sessione ricevuta (o None se sconosciuta o scaduta)"""
+        session = self.incoming.get(sid)
+        if session is None:
+            return None
+        return base64.b64decode(session['key'])
+
+
+def encrypt(key, sid, plaintext, cipher=cryptomessage_aead.AES_GCM):
+    """Cifra con la chiave di sessione, restituisce (nonce, ciphertext)"""
+    return cryptomessage_aead.encrypt(cipher, key, plaintext, bytes.fromhex(sid))
+
+
+def decrypt(key, sid, nonce, ciphertext, cipher=cryptomessage_aead.AES_GCM):
+    """Decifra e autentica un messaggio di sessione"""
+    return cryptomessage_aead.decrypt(cipher, key, nonce, ciphertext, bytes.fromhex(sid))
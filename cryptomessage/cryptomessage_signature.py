@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Signature - Firme in streaming e file .sig separati
+Il contenuto viene letto a blocchi e passato a SHA-256: firma e verifica
+lavorano sul digest (cryptomessage_keys.sign_digest), in memoria costante
+anche per file di diversi GB.
+
+File .sig (JSON):
+    {"version": 1, "hash": "SHA-256", "key_type": "rsa", "signer_kid": "...",
+     "size": 123, "timestamp": "...", "signature": "<b64>"}
+
+signer_kid è l'identificativo breve della chiave del firmatario: chi verifica
+lo cerca tra la propria chiave e i contatti.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+
+SIG_SUFFIX = ".sig"
+HASH_NAME = "SHA-256"
+CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+
+def hash_stream(src, chunk_size=CHUNK_SIZE):
+    """SHA-256 di un flusso letto a blocchi, restituisce (digest, byte letti)"""
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    size = 0
+    while True:
+        count = src.readinto(buffer)
+        if not count:
+            break
+        digest.update(view[:count])
+        size += count
+    return digest.digest(), size
+
+
+class HashingWriter:
+    """Scrive su un file e calcola SHA-256 di quanto scritto (firma separata
+    dell'output senza rileggerlo)"""
+
+    def __init__(self, dst):
+        self.dst = dst
+        self.size = 0
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self.dst.write(data)
+
+    def flush(self):
+        self.dst.flush()
+
+    def digest(self):
+        return self._digest.digest()
+
+
+def dumps(signature, key_type, signer_kid, size, timestamp):
+    """Contenuto di un file .sig"""
+    return json.dumps({
+        'version': 1,
+        'hash': HASH_NAME,
+        'key_type': key_type,
+        'signer_kid': signer_kid,
+        'size': size,
+        'timestamp': timestamp,
+        'signature': base64.b64encode(signature).decode(),
+    }, indent=2) + "\n"
+
+
+def loads(text):
+    """Legge un file .sig, solleva ValueError se non valido"""
+    try:
+        info = json.loads(text)
+        if info.get('hash') != HASH_NAME:
+            raise ValueError(f"Hash non supportato: {info.get('hash')}")
+        info['signature'] = base64.b64decode(info['signature'])
+        info['size'] = int(info['size'])
+    except (KeyError, TypeError, AttributeError, json.JSONDecodeError, binascii.Error) as e:
+        raise ValueError(f"File di firma non valido: {e}") from e
+    return info
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Controllo di regressione del tempo di avvio di CryptoMessenger CLI
+I comandi leggeri (--help, status, list-contacts) non devono importare
+cryptography e devono restare sotto una soglia di tempo
+
+Uso:
+    python cryptomessage_startup_check.py
+    python cryptomessage_startup_check.py --runs 20 --max-ms 120
+
+Codice di uscita 1 se un comando importa cryptography o supera la soglia.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cryptomessage_cli.py")
+
+LIGHT_COMMANDS = [
+    ["--help"],
+    ["status"],
+    ["list-contacts"],
+    ["list-groups"],
+]
+
+# Esegue la CLI nello stesso interprete e riporta se cryptography è stato importato
+_PROBE = """
+import runpy, sys
+sys.argv = [{cli!r}] + {args!r}
+try:
+    runpy.run_path({cli!r}, run_name="__main__")
+except SystemExit:
+    pass
+sys.stderr.write("\\nIMPORTED=%d\\n" % any(m.split(".")[0] == "cryptography" for m in sys.modules))
+"""
+
+
+def probe_imports(args):
+    """True se il comando importa cryptography"""
+    code = _PROBE.format(cli=CLI, args=args)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    return "IMPORTED=1" in result.stderr
+
+
+def _time_process(cmd, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, capture_output=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def time_command(args, runs):
+    """Tempo mediano (ms) di avvio completo del processo"""
+    return statistics.median(_time_process([sys.executable, CLI] + args, runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Controllo tempo di avvio di CryptoMessenger CLI")
+    parser.add_argument("--runs", type=int, default=10, help="Esecuzioni per comando (default: 10)")
+    parser.add_argument("--max-ms", type=float, default=150.0,
+                        help="Soglia sul tempo mediano in millisecondi (default: 150)")
+    args = parser.parse_args()
+
+    interpreter_ms = statistics.median(_time_process([sys.executable, "-c", "pass"], args.runs))
+    print(f"🐍 Avvio interprete: {interpreter_ms:.1f} ms")
+
+    failures = 0
+    for command in LIGHT_COMMANDS:
+        label = " ".join(command)
+        imported = probe_imports(command)
+        median_ms = time_command(command, args.runs)
+
+        ok = not imported and median_ms <= args.max_ms
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {label:<15} {median_ms:7.1f} ms"
+              f"{'  (importa cryptography!)' if imported else ''}")
+
+    if failures:
+        print(f"❌ {failures} comandi oltre la soglia di {args.max_ms:.0f} ms o con import pesanti")
+        sys.exit(1)
+    print("✅ Avvio rapido confermato")
+
+
+if __name__ == "__main__":
+    main()
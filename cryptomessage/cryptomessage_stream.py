@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Stream - Formato file cifrato a blocchi
+Cifra e decifra flussi di dimensione arbitraria in memoria costante
+
+Layout del file:
+    MAGIC | u32 lunghezza header | header JSON | record...
+    record = u8 flag | u32 lunghezza | ciphertext AES-256-GCM (con tag)
+
+Ogni blocco usa il nonce  prefisso(7) | contatore(4) | flag(1)  e l'header
+completo come dati associati: blocchi riordinati, troncati o un header
+alterato fanno fallire l'autenticazione.
+
+Con header['signed'] il file termina con  u16 lunghezza | firma : la firma
+copre SHA-256 di tutti i byte precedenti (header e record), calcolato a
+blocchi durante la scrittura e la lettura, e viene fatta e verificata sul
+digest (vedi cryptomessage_keys.sign_digest).
+
+I file regolari vengono mappati in memoria (mmap) e i blocchi passano al
+cifrario come memoryview, con update_into in un buffer preallocato: nessuna
+copia per blocco oltre alla scrittura su disco.
+
+EncryptingWriter e DecryptingReader usano lo stesso formato come file
+scrivibile e leggibile (ad esempio per tarfile in modalità flusso): i blocchi
+sono indipendenti, quindi vengono cifrati e decifrati in parallelo in un pool
+di thread (update_into rilascia il GIL) e scritti o restituiti in ordine,
+con un numero limitato di blocchi in volo.
+"""
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+from collections import deque
+
+MAGIC = b"CMF1"
+CHUNK_SIZE = 1024 * 1024  # 1 MiB
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+
+FLAG_LAST = 0x01
+
+_HEADER_LEN = struct.Struct(">I")
+_RECORD = struct.Struct(">BI")
+_COUNTER = struct.Struct(">I")
+_SIGNATURE_LEN = struct.Struct(">H")
+_MAX_HEADER = 64 * 1024
+
+
+def _read_exact(src, size):
+    """Legge esattamente size byte (o meno solo a fine flusso)"""
+    data = src.read(size)
+    if data is None:
+        data = b""
+    if len(data) == size or not data:
+        return data
+    parts = [data]
+    remaining = size - len(data)
+    while remaining:
+        part = src.read(remaining)
+        if not part:
+            break
+        parts.append(part)
+        remaining -= len(part)
+    return b"".join(parts)
+
+
+class _Source:
+    """Blocchi di input come memoryview: fette di un mmap per i file regolari,
+    altrimenti due buffer preallocati usati a turno (il blocco letto resta
+    valido fino alla lettura successiva alla prossima)"""
+
+    def __init__(self, src):
+        self.src = src
+        self._map = None
+        self._view = None
+        self._position = 0
+        self._previous = 0
+        self._released = 0
+        self._buffers = [bytearray(), bytearray()]
+        self._turn = 0
+        try:
+            fd = src.fileno()
+            size = os.fstat(fd).st_size
+            offset = src.tell()
+            if size > offset:
+                self._map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+                self._position = self._previous = offset
+                self._released = offset - offset % mmap.PAGESIZE
+                if hasattr(self._map, 'madvise'):
+                    self._map.madvise(mmap.MADV_SEQUENTIAL)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            self._map = None
+
+    def read(self, size):
+        """Fino a size byte (meno solo a fine flusso)"""
+        if self._view is not None:
+            # Le pagine prima del blocco precedente (ancora in uso) non servono
+            # più: liberarle mantiene costante la memoria residente
+            release = self._previous - self._previous % mmap.PAGESIZE
+            if release - self._released >= mmap.PAGESIZE * 256 and hasattr(self._map, 'madvise'):
+                self._map.madvise(mmap.MADV_DONTNEED, self._released, release - self._released)
+                self._released = release
+            start = self._previous = self._position
+            self._position = min(start + size, len(self._view))
+            return self._view[start:self._position]
+
+        buffer = self._buffers[self._turn]
+        if len(buffer) < size:
+            # Buffer nuovo invece di estenderlo: le fette date in precedenza
+            # possono essere ancora in uso (un bytearray esportato non cresce)
+            buffer = self._buffers[self._turn] = bytearray(size)
+        self._turn ^= 1
+        view = memoryview(buffer)[:size]
+        filled = 0
+        while filled < size:
+            count = self.src.readinto(view[filled:]) if hasattr(self.src, 'readinto') else None
+            if count is None:
+                # Flussi senza readinto (es. stdin in modalità testo)
+                data = _read_exact(self.src, size - filled)
+                view[filled:filled + len(data)] = data
+                filled += len(data)
+                break
+            if not count:
+                break
+            filled += count
+        return view[:filled]
+
+    def close(self):
+        if self._map is not None:
+            # Sposta il file alla fine dei dati consumati, come una lettura normale
+            self.src.seek(self._position)
+            self._view.release()
+            try:
+                self._map.close()
+            except BufferError:
+                # Restano fette esportate: il mapping si chiude quando vengono liberate
+                pass
+            self._map = None
+
+
+def _hashing_write(dst, digest):
+    """dst.write che aggiorna anche il digest"""
+    def write(data):
+        digest.update(data)
+        return dst.write(data)
+    return write
+
+
+def _nonce(prefix, counter, flag):
+    """Costruisce il nonce del blocco"""
+    return prefix + _COUNTER.pack(counter) + bytes([flag])
+
+
+def write_header(dst, header):
+    """Scrive magic e header, restituisce i byte usati come dati associati"""
+    header_json = json.dumps(header, separators=(",", ":"), sort_keys=True).encode()
+    header_bytes = MAGIC + _HEADER_LEN.pack(len(header_json)) + header_json
+    dst.write(header_bytes)
+    return header_bytes
+
+
+def read_header(src):
+    """Legge l'header di un flusso cifrato, restituisce (header, header_bytes)"""
+    magic = _read_exact(src, len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("Formato file non valido (magic errato)")
+
+    raw_len = _read_exact(src, _HEADER_LEN.size)
+    if len(raw_len) != _HEADER_LEN.size:
+        raise ValueError("Header troncato")
+    (header_len,) = _HEADER_LEN.unpack(raw_len)
+    if header_len > _MAX_HEADER:
+        raise ValueError("Header troppo grande")
+
+    header_json = _read_exact(src, header_len)
+    if len(header_json) != header_len:
+        raise ValueError("Header troncato")
+
+    header = json.loads(header_json.decode())
+    return header, magic + raw_len + header_json
+
+
+def _stream_header(header, chunk_size, prefix, signed):
+    """Header completo dei parametri di cifratura"""
+    if chunk_size <= 0 or chunk_size > 0xFFFFFFFF - TAG_SIZE:
+        raise ValueError("Dimensione blocco non valida")
+    header = dict(header)
+    header['cipher'] = 'AES-256-GCM'
+    header['chunk_size'] = chunk_size
+    header['nonce_prefix'] = prefix.hex()
+    if signed:
+        header['signed'] = True
+    return header
+
+
+def _stream_params(header):
+    """Prefisso del nonce e dimensione dei blocchi dall'header letto"""
+    prefix = bytes.fromhex(header['nonce_prefix'])
+    chunk_size = int(header['chunk_size'])
+    if len(prefix) != NONCE_PREFIX_SIZE:
+        raise ValueError("Nonce non valido")
+    return prefix, chunk_size
+
+
+def encrypt_stream(src, dst, content_key, header, chunk_size=CHUNK_SIZE, sign=None):
+    """Cifra src in dst a blocchi autenticati, restituisce i byte in chiaro letti
+
+    sign(digest) -> firma: se indicata, il file viene firmato in coda.
+    """
+    prefix = os.urandom(NONCE_PREFIX_SIZE)
+    header = _stream_header(header, chunk_size, prefix, sign is not None)
+    if sign is not None:
+        digest = hashlib.sha256()
+        write = _hashing_write(dst, digest)
+    else:
+        write = dst.write
+
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    aad = write_header(dst, header)
+    if sign is not None:
+        digest.update(aad)
+    algorithm = algorithms.AES(content_key)
+    # Buffer di uscita unico: update_into richiede un blocco AES di margine
+    output = bytearray(chunk_size + 15)
+    output_view = memoryview(output)
+
+    source = _Source(src)
+    try:
+        total = 0
+        counter = 0
+        current = source.read(chunk_size)
+        while True:
+            # Lettura anticipata per sapere se il blocco corrente è l'ultimo
+            following = source.read(chunk_size) if len(current) == chunk_size else b""
+            flag = 0 if following else FLAG_LAST
+
+            encryptor = Cipher(algorithm, modes.GCM(_nonce(prefix, counter, flag))).encryptor()
+            encryptor.authenticate_additional_data(aad)
+            written = encryptor.update_into(current, output)
+            encryptor.finalize()
+            write(_RECORD.pack(flag, written + TAG_SIZE))
+            write(output_view[:written])
+            write(encryptor.tag)
+
+            total += len(current)
+            counter += 1
+            if flag & FLAG_LAST:
+                if sign is not None:
+                    signature = sign(digest.digest())
+                    dst.write(_SIGNATURE_LEN.pack(len(signature)) + signature)
+                return total
+            if counter > 0xFFFFFFFF:
+                raise ValueError("Flusso troppo lungo per una singola chiave")
+            current = following
+    finally:
+        current = following = None
+        source.close()
+
+
+def decrypt_stream(src, dst, content_key, header, header_bytes, verify=None):
+    """Decifra i blocchi di src in dst, restituisce i byte in chiaro scritti
+
+    Per i file firmati chiama verify(firma, digest) dopo l'ultimo blocco.
+    """
+    prefix, chunk_size = _stream_params(header)
+
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    algorithm = algorithms.AES(content_key)
+    output = bytearray(chunk_size + 15)
+    output_view = memoryview(output)
+    signed = bool(header.get('signed'))
+    digest = hashlib.sha256(header_bytes) if signed else None
+
+    source = _Source(src)
+    try:
+        total = 0
+        counter = 0
+        while True:
+            raw = source.read(_RECORD.size)
+            if len(raw) != _RECORD.size:
+                raise ValueError("File troncato: manca il blocco finale")
+            flag, length = _RECORD.unpack(raw)
+            if length < TAG_SIZE or length > chunk_size + TAG_SIZE:
+                raise ValueError("Lunghezza blocco non valida")
+
+            record = source.read(length)
+            if len(record) != length:
+                raise ValueError("File troncato")
+            if signed:
+                digest.update(raw)
+                digest.update(record)
+
+            # Il flag fa parte del nonce: se alterato l'autenticazione fallisce.
+            # Il blocco viene scritto solo dopo la verifica del tag.
+            tag = bytes(record[-TAG_SIZE:])
+            decryptor = Cipher(algorithm, modes.GCM(_nonce(prefix, counter, flag), tag)).decryptor()
+            decryptor.authenticate_additional_data(header_bytes)
+            written = decryptor.update_into(record[:-TAG_SIZE], output)
+            try:
+                decryptor.finalize()
+            except InvalidTag:
+                raise ValueError("Blocco alterato o chiave errata") from None
+            dst.write(output_view[:written])
+
+            total += written
+            counter += 1
+            if flag & FLAG_LAST:
+                break
+
+        if signed:
+            raw = source.read(_SIGNATURE_LEN.size)
+            if len(raw) != _SIGNATURE_LEN.size:
+                raise ValueError("File troncato: manca la firma")
+            signature = source.read(_SIGNATURE_LEN.unpack(raw)[0])
+            if len(signature) != _SIGNATURE_LEN.unpack(raw)[0]:
+                raise ValueError("File troncato: firma incompleta")
+            if verify is not None:
+                verify(bytes(signature), digest.digest())
+
+        if len(source.read(1)):
+            raise ValueError("Dati inattesi dopo il blocco finale")
+        return total
+    finally:
+        raw = record = signature = None
+        source.close()
+
+
+class EncryptingWriter:
+    """File scrivibile che cifra a blocchi in parallelo (stesso formato di encrypt_stream)
+
+    L'ultimo blocco resta in attesa finché non arrivano altri dati o close():
+    solo allora si sa se porta il flag FLAG_LAST. Un blocco è una lista di
+    memoryview sui bytes ricevuti da write(): nessuna copia prima del cifrario.
+    """
+
+    def __init__(self, dst, content_key, header, chunk_size=CHUNK_SIZE, jobs=None, sign=None):
+        from concurrent.futures import ThreadPoolExecutor
+        from cryptography.hazmat.primitives.ciphers import algorithms
+
+        self.chunk_size = chunk_size
+        self.total = 0
+        self._prefix = os.urandom(NONCE_PREFIX_SIZE)
+        header = _stream_header(header, chunk_size, self._prefix, sign is not None)
+        self._dst = dst
+        self._sign = sign
+        self._digest = hashlib.sha256() if sign is not None else None
+        self._write = _hashing_write(dst, self._digest) if sign is not None else dst.write
+        self._aad = write_header(dst, header)
+        if sign is not None:
+            self._digest.update(self._aad)
+        self._algorithm = algorithms.AES(content_key)
+
+        self.jobs = jobs or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="cryptomessenger-enc")
+        self._pending = deque()
+        self._pieces = []
+        self._buffered = 0
+        self._counter = 0
+        self._closed = False
+
+    def _encrypt(self, counter, flag, pieces, size):
+        from cryptography.hazmat.primitives.ciphers import Cipher, modes
+
+        encryptor = Cipher(self._algorithm, modes.GCM(_nonce(self._prefix, counter, flag))).encryptor()
+        encryptor.authenticate_additional_data(self._aad)
+        output = bytearray(size + 15)
+        view = memoryview(output)
+        written = 0
+        for piece in pieces:
+            written += encryptor.update_into(piece, view[written:])
+        encryptor.finalize()
+        view.release()
+        del output[written:]
+        return flag, output, encryptor.tag
+
+    def _submit(self, flag):
+        if self._counter > 0xFFFFFFFF:
+            raise ValueError("Flusso troppo lungo per una singola chiave")
+        self._pending.append(self._executor.submit(self._encrypt, self._counter, flag, self._pieces, self._buffered))
+        self._counter += 1
+        self.total += self._buffered
+        self._pieces = []
+        self._buffered = 0
+        # Blocchi in volo limitati: memoria costante anche per archivi enormi
+        self._drain(self.jobs * 2)
+
+    def _drain(self, limit):
+        """Scrive in ordine i blocchi completati oltre il limite di quelli in volo"""
+        while len(self._pending) > limit:
+            flag, output, tag = self._pending.popleft().result()
+            self._write(_RECORD.pack(flag, len(output) + TAG_SIZE))
+            self._write(output)
+            self._write(tag)
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError("Scrittura su un flusso chiuso")
+        if not isinstance(data, bytes):
+            # Buffer modificabili: chi scrive potrebbe riusarli prima della cifratura
+            data = bytes(data)
+        view = memoryview(data)
+        while view:
+            # Un blocco completo parte solo quando arrivano altri dati (potrebbe essere l'ultimo)
+            if self._buffered == self.chunk_size:
+                self._submit(0)
+            take = min(len(view), self.chunk_size - self._buffered)
+            self._pieces.append(view[:take])
+            self._buffered += take
+            view = view[take:]
+        return len(data)
+
+    def tell(self):
+        """Byte in chiaro scritti finora (tarfile lo usa come posizione)"""
+        return self.total + self._buffered
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Cifra l'ultimo blocco, scrive la firma e restituisce i byte in chiaro"""
+        if self._closed:
+            return self.total
+        try:
+            self._submit(FLAG_LAST)
+            self._drain(0)
+            if self._sign is not None:
+                signature = self._sign(self._digest.digest())
+                self._dst.write(_SIGNATURE_LEN.pack(len(signature)) + signature)
+        finally:
+            self._closed = True
+            self._executor.shutdown(wait=True)
+        return self.total
+
+    def abort(self):
+        """Interrompe senza scrivere l'ultimo blocco (il file resta incompleto e non valido)"""
+        self._closed = True
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._pending.clear()
+        self._pieces = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class DecryptingReader:
+    """File leggibile che decifra a blocchi in parallelo (stesso formato di decrypt_stream)
+
+    Ogni blocco viene restituito solo dopo la verifica del suo tag. Blocco
+    finale, firma e assenza di dati in coda si controllano con finish(),
+    anche se chi legge si ferma prima della fine (es. tarfile).
+    """
+
+    def __init__(self, src, content_key, header, header_bytes, jobs=None, verify=None):
+        from concurrent.futures import ThreadPoolExecutor
+        from cryptography.hazmat.primitives.ciphers import algorithms
+
+        self._prefix, self.chunk_size = _stream_params(header)
+        self._src = src
+        self._aad = header_bytes
+        self._verify = verify
+        self._digest = hashlib.sha256(header_bytes) if header.get('signed') else None
+        self._algorithm = algorithms.AES(content_key)
+
+        self.jobs = jobs or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="cryptomessenger-dec")
+        self._pending = deque()
+        self._counter = 0
+        self._last_read = False
+        self._view = memoryview(b"")
+        self._position = 0
+        self.total = 0
+
+    def _decrypt(self, counter, flag, record):
+        from cryptography.exceptions import InvalidTag
+        from cryptography.hazmat.primitives.ciphers import Cipher, modes
+
+        # Il flag fa parte del nonce: se alterato l'autenticazione fallisce
+        view = memoryview(record)
+        decryptor = Cipher(self._algorithm, modes.GCM(_nonce(self._prefix, counter, flag),
+                                                      bytes(view[-TAG_SIZE:]))).decryptor()
+        decryptor.authenticate_additional_data(self._aad)
+        output = bytearray(len(record) - TAG_SIZE + 15)
+        written = decryptor.update_into(view[:-TAG_SIZE], output)
+        try:
+            decryptor.finalize()
+        except InvalidTag:
+            raise ValueError("Blocco alterato o chiave errata") from None
+        del output[written:]
+        return output
+
+    def _fill(self):
+        """Legge i record successivi e li mette in decifratura (fino al limite in volo)"""
+        while not self._last_read and len(self._pending) < self.jobs * 2:
+            raw = _read_exact(self._src, _RECORD.size)
+            if len(raw) != _RECORD.size:
+                raise ValueError("File troncato: manca il blocco finale")
+            flag, length = _RECORD.unpack(raw)
+            if length < TAG_SIZE or length > self.chunk_size + TAG_SIZE:
+                raise ValueError("Lunghezza blocco non valida")
+            record = _read_exact(self._src, length)
+            if len(record) != length:
+                raise ValueError("File troncato")
+            if self._digest is not None:
+                self._digest.update(raw)
+                self._digest.update(record)
+            self._pending.append(self._executor.submit(self._decrypt, self._counter, flag, record))
+            self._counter += 1
+            self._last_read = bool(flag & FLAG_LAST)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        while self._position >= len(self._view):
+            self._fill()
+            if not self._pending:
+                return b""
+            self._view = memoryview(self._pending.popleft().result())
+            self._position = 0
+            self.total += len(self._view)
+        data = bytes(self._view[self._position:self._position + size])
+        self._position += len(data)
+        return data
+
+    def readall(self):
+        parts = []
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                return b"".join(parts)
+            parts.append(data)
+
+    def finish(self):
+        """Decifra il resto del flusso e controlla blocco finale e firma"""
+        while self.read(self.chunk_size):
+            pass
+        if self._digest is not None:
+            raw = _read_exact(self._src, _SIGNATURE_LEN.size)
+            if len(raw) != _SIGNATURE_LEN.size:
+                raise ValueError("File troncato: manca la firma")
+            length = _SIGNATURE_LEN.unpack(raw)[0]
+            signature = _read_exact(self._src, length)
+            if len(signature) != length:
+                raise ValueError("File troncato: firma incompleta")
+            if self._verify is not None:
+                self._verify(signature, self._digest.digest())
+        if _read_exact(self._src, 1):
+            raise ValueError("Dati inattesi dopo il blocco finale")
+        return self.total
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._pending.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CryptoMessenger Timings - Tempo e memoria per fase (opzione --timings)
+
+Ogni fase registra il tempo reale e, tramite tracemalloc, il picco di memoria
+allocata durante la fase e quella ancora occupata alla fine. Le fasi non
+vanno annidate: il picco di tracemalloc viene azzerato all'inizio di ognuna.
+"""
+
+import contextlib
+import json
+import sys
+import time
+import tracemalloc
+
+
+class PhaseTimings:
+    """Raccoglie le misure delle fasi di un comando"""
+
+    def __init__(self):
+        self.phases = []
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Misura il blocco come una fase (sommata se ripetuta)"""
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            self._record(name, elapsed, max(0, peak - before), current - before)
+
+    def _record(self, name, seconds, allocated, retained):
+        for entry in self.phases:
+            if entry['phase'] == name:
+                entry['seconds'] += seconds
+                entry['allocated_bytes'] = max(entry['allocated_bytes'], allocated)
+                entry['retained_bytes'] += retained
+                entry['calls'] += 1
+                return
+        self.phases.append({
+            'phase': name,
+            'seconds': seconds,
+            'allocated_bytes': allocated,
+            'retained_bytes': retained,
+            'calls': 1,
+        })
+
+    def stop(self):
+        """Chiude la misura e restituisce il riepilogo"""
+        total = time.perf_counter() - self._start
+        _, peak = tracemalloc.get_traced_memory()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return {'phases': self.phases, 'total_seconds': total, 'peak_traced_bytes': peak}
+
+    def report(self, fmt='text', stream=None):
+        """Stampa il riepilogo (su stderr, per non mescolarlo con l'output del comando)"""
+        stream = stream or sys.stderr
+        summary = self.stop()
+        if fmt == 'json':
+            print(json.dumps(summary), file=stream)
+            return summary
+
+        print("⏱️ Tempi per fase:", file=stream)
+        for entry in summary['phases']:
+            calls = f" ×{entry['calls']}" if entry['calls'] > 1 else ""
+            print(f"  {entry['phase'] + calls:<18} {entry['seconds'] * 1000:9.2f} ms"
+                  f"  {_format_bytes(entry['allocated_bytes']):>10} allocati", file=stream)
+        print(f"  {'totale':<18} {summary['total_seconds'] * 1000:9.2f} ms"
+              f"  {_format_bytes(summary['peak_traced_bytes']):>10} picco", file=stream)
+        return summary
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
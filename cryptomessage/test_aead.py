@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test dei cifrari AEAD dei pacchetti e della scelta per macchina (python -m pytest -q)"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import cryptomessage_aead
+from cryptomessage_core import CryptoMessenger, CryptoMessengerError, DecryptionError
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+class AeadPacketTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.messenger = _account(cls.home.name, 'x25519')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def _packet(self, cipher, sign=False):
+        return dict(self.messenger.encrypt("Me", "ciao cifrario", sign=sign, cipher=cipher)['packet'])
+
+    def _decrypt(self, packet):
+        return self.messenger.decrypt(self.messenger.encode_packet(packet), use_cache=False)
+
+    def test_round_trip(self):
+        for name, cipher in list(cryptomessage_aead.NAMES.items()) + [('AES-256-CBC', 'AES-256-CBC')]:
+            for armored in (True, False):
+                result = self.messenger.encrypt("Me", "ciao cifrario", cipher=name, armored=armored)
+                self.assertEqual(result['packet']['cipher'], cipher)
+                opened = self.messenger.decrypt(result['encoded'], use_cache=False)
+                self.assertEqual(opened['message'], "ciao cifrario", name)
+                self.assertTrue(opened['signature_valid'])
+
+    def test_unsupported(self):
+        with self.assertRaises(CryptoMessengerError):
+            self.messenger.encrypt("Me", "ciao", cipher='des')
+        with self.assertRaises(CryptoMessengerError):
+            self.messenger.encrypt("Me", "ciao", cipher='chacha20', fmt='v2')
+
+    def test_tampered_tag(self):
+        # Senza firma: è il tag a rifiutare il messaggio alterato
+        for cipher in cryptomessage_aead.CIPHERS:
+            packet = self._packet(cipher)
+            data = bytearray(packet['data'])
+            data[-1] ^= 0x01
+            packet['data'] = bytes(data)
+            with self.assertRaises(DecryptionError):
+                self._decrypt(packet)
+
+    def test_tampered_nonce(self):
+        for cipher in cryptomessage_aead.CIPHERS:
+            packet = self._packet(cipher)
+            nonce = bytearray(packet['iv'])
+            nonce[0] ^= 0x01
+            packet['iv'] = bytes(nonce)
+            with self.assertRaises(DecryptionError):
+                self._decrypt(packet)
+
+    def test_swapped_cipher_id(self):
+        for cipher, other in zip(cryptomessage_aead.CIPHERS, reversed(cryptomessage_aead.CIPHERS)):
+            packet = self._packet(cipher, sign=True)
+            packet['cipher'] = other
+            with self.assertRaises(DecryptionError):
+                self._decrypt(packet)
+
+
+class CipherChoiceTest(unittest.TestCase):
+
+    def test_fastest_cipher_cached(self):
+        rates = {cryptomessage_aead.AES_GCM: 900.0, cryptomessage_aead.CHACHA20: 1400.0}
+        with tempfile.TemporaryDirectory() as home:
+            messenger = CryptoMessenger(data_dir=home)
+            with mock.patch.object(cryptomessage_aead, 'benchmark', return_value=rates) as benchmark:
+                self.assertEqual(messenger.cipher_choice()['cipher'], cryptomessage_aead.CHACHA20)
+                # Seconda istanza: la scelta arriva dal file, nessuna nuova misura
+                self.assertEqual(CryptoMessenger(data_dir=home).cipher_choice()['cipher'], cryptomessage_aead.CHACHA20)
+                self.assertEqual(benchmark.call_count, 1)
+
+            # Misura fatta su un'altra macchina: non vale qui
+            with open(messenger.cipher_file) as f:
+                choice = json.load(f)
+            choice['machine'] = "altra/macchina"
+            with open(messenger.cipher_file, 'w') as f:
+                json.dump(choice, f)
+            self.assertIsNone(cryptomessage_aead.load_choice(messenger.cipher_file))
+            self.assertIsNone(cryptomessage_aead.load_choice(os.path.join(home, "mancante.json")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test dell'agente della chiave privata (python -m pytest -q)"""
+
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import cryptomessage_agent
+import cryptomessage_keys
+
+
+@unittest.skipUnless(cryptomessage_agent.is_supported(), "socket Unix non disponibili")
+class AgentTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.socket_path = os.path.join(cls.home.name, "agent.sock")
+        cls.private_key = cryptomessage_keys.generate_private_key('x25519')
+        cls.agent = cryptomessage_agent.KeyAgent(cls.private_key, cls.socket_path, timeout=60)
+        cls.thread = threading.Thread(target=cls.agent.serve, daemon=True)
+        cls.thread.start()
+        for _ in range(100):
+            if os.path.exists(cls.socket_path):
+                break
+            time.sleep(0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        agent_key = cryptomessage_agent.connect(cls.socket_path)
+        if agent_key is not None:
+            agent_key.stop()
+        cls.thread.join(5)
+        cls.home.cleanup()
+
+    def setUp(self):
+        self.agent_key = cryptomessage_agent.connect(self.socket_path)
+        self.assertIsNotNone(self.agent_key)
+
+    def tearDown(self):
+        self.agent_key.close()
+
+    def test_derive_allowed_labels(self):
+        for info in sorted(cryptomessage_agent.DERIVE_LABELS):
+            self.assertEqual(
+                self.agent_key.derive(info),
+                cryptomessage_agent.derive_key(self.private_key, info)
+            )
+
+    def test_derive_rejects_other_labels(self):
+        for info in ("", "sessions/../archive", "qualsiasi", "decrypt-cache "):
+            with self.assertRaises(ValueError):
+                self.agent_key.derive(info)
+            with self.assertRaises(ValueError):
+                cryptomessage_agent.derive_key(self.private_key, info)
+
+
+@unittest.skipUnless(cryptomessage_agent.is_supported(), "socket Unix non disponibili")
+class SocketDirTest(unittest.TestCase):
+    """Cartella del socket prevedibile: va rifiutata se non è privata dell'utente"""
+
+    OTHER_UID = 65534  # nobody
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.home.name, "sock")
+        self.socket_path = os.path.join(self.directory, "agent.sock")
+
+    def tearDown(self):
+        self.home.cleanup()
+
+    def _agent(self):
+        private_key = cryptomessage_keys.generate_private_key('x25519')
+        return cryptomessage_agent.KeyAgent(private_key, self.socket_path, timeout=1)
+
+    def test_creates_private_dir(self):
+        cryptomessage_agent.private_dir(self.socket_path)
+        self.assertEqual(os.stat(self.directory).st_mode & 0o777, 0o700)
+
+    def test_rejects_wrong_mode(self):
+        os.mkdir(self.directory, 0o755)
+        os.chmod(self.directory, 0o755)
+        with self.assertRaises(PermissionError):
+            self._agent().serve()
+        with self.assertRaises(PermissionError):
+            cryptomessage_agent.open_socket(self.socket_path)
+        self.assertIsNone(cryptomessage_agent.connect(self.socket_path))
+
+    def test_rejects_symlink(self):
+        target = os.path.join(self.home.name, "altrove")
+        os.mkdir(target, 0o700)
+        os.symlink(target, self.directory)
+        with self.assertRaises(PermissionError):
+            cryptomessage_agent.private_dir(self.socket_path)
+
+    @unittest.skipUnless(hasattr(os, "geteuid") and os.geteuid() == 0, "serve root per cambiare proprietario")
+    def test_rejects_other_owner(self):
+        os.mkdir(self.directory, 0o700)
+        os.chown(self.directory, self.OTHER_UID, -1)
+        with self.assertRaises(PermissionError):
+            self._agent().serve()
+        with self.assertRaises(PermissionError):
+            cryptomessage_agent.open_socket(self.socket_path)
+
+    @unittest.skipUnless(hasattr(socket, "SO_PEERCRED") and hasattr(os, "geteuid") and os.geteuid() == 0,
+                         "serve SO_PEERCRED e root per cambiare utente")
+    def test_rejects_server_of_other_user(self):
+        cryptomessage_agent.private_dir(self.socket_path)
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Figlio: crea il socket nella cartella privata, poi ascolta come un altro utente
+            try:
+                server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                server.bind(self.socket_path)
+                os.setuid(self.OTHER_UID)
+                server.listen(1)
+                os.write(write_end, b"x")
+                server.accept()[0].recv(1)
+            finally:
+                os._exit(0)
+        os.close(write_end)
+        try:
+            os.read(read_end, 1)
+            with self.assertRaisesRegex(PermissionError, "servito da un altro utente"):
+                cryptomessage_agent.open_socket(self.socket_path)
+        finally:
+            os.close(read_end)
+            os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
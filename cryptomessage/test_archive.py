@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test dell'archivio cifrato dei messaggi e della ricerca (python -m pytest -q)"""
+
+import os
+import tempfile
+import unittest
+
+import cryptomessage_archive
+from cryptomessage_core import CryptoMessenger, CryptoMessengerError
+
+MESSAGES = [
+    ('in', ["Mario"], "2026-01-05T09:00:00", "Riunione domani alle nove"),
+    ('out', ["Mario"], "2026-01-06T10:30:00", "Va bene, porto il bilancio"),
+    ('in', ["Lucia"], "2026-02-01T18:00:00", "Bilancio approvato, riunione annullata"),
+    ('in', ["Mario"], "2026-03-10T08:15:00", "Ciao di nuovo"),
+]
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.messenger = _account(self.home.name, 'x25519')
+        for i, (direction, contacts, timestamp, message) in enumerate(MESSAGES):
+            self.assertTrue(self.messenger.archive(direction, contacts, timestamp, message, f"{i:064x}", True))
+
+    def tearDown(self):
+        self.messenger.get_archive().close()
+        self.home.cleanup()
+
+    def _messages(self, **filters):
+        return [r['message'] for r in self.messenger.search_archive(**filters)]
+
+    def test_round_trip(self):
+        records = self.messenger.search_archive()
+        self.assertEqual([r['message'] for r in records], [m[3] for m in MESSAGES])
+        self.assertEqual(records[1]['direction'], 'out')
+        self.assertEqual(records[1]['contacts'], ["Mario"])
+        # Stesso pacchetto, stessa direzione: non viene duplicato
+        self.assertFalse(self.messenger.archive('in', ["Mario"], "2026-01-05T09:00:00", "x", f"{0:064x}"))
+        self.assertEqual(len(self.messenger.get_archive()), len(MESSAGES))
+
+    def test_archived_packet(self):
+        result = self.messenger.encrypt("Me", "pacchetto archiviato")
+        packet_id = cryptomessage_archive.packet_hash(result['packet'])
+        opened = self.messenger.decrypt(result['encoded'], use_cache=False)
+        self.assertTrue(self.messenger.archive('in', [opened['sender']], opened['timestamp'], opened['message'], packet_id))
+        self.assertEqual(self._messages(search="archiviato"), ["pacchetto archiviato"])
+
+    def test_search(self):
+        self.assertEqual(self._messages(search="BILANCIO"), [MESSAGES[1][3], MESSAGES[2][3]])
+        self.assertEqual(self._messages(search="riunione bilancio"), [MESSAGES[2][3]])
+        self.assertEqual(self._messages(search="inesistente"), [])
+        self.assertEqual(self._messages(sender="Mario"), [MESSAGES[0][3], MESSAGES[3][3]])
+        self.assertEqual(self._messages(recipient="Mario"), [MESSAGES[1][3]])
+        self.assertEqual(self._messages(since="2026-01-06", until="2026-02-01"), [MESSAGES[1][3], MESSAGES[2][3]])
+        self.assertEqual(self._messages(limit=2), [MESSAGES[2][3], MESSAGES[3][3]])
+        with self.assertRaises(CryptoMessengerError):
+            self._messages(since="ieri")
+
+    def test_no_plaintext_on_disk(self):
+        for path in (self.messenger.archive_file, self.messenger.archive_index_file):
+            with open(path, 'rb') as f:
+                data = f.read().lower()
+            self.assertNotIn(b"bilancio", data, path)
+            self.assertNotIn(b"riunione", data, path)
+
+    def test_wrong_key(self):
+        other = cryptomessage_archive.MessageArchive(
+            self.messenger.archive_file, self.messenger.archive_index_file, os.urandom(32), os.urandom(32)
+        ).open()
+        try:
+            self.assertEqual(other.query(search="bilancio"), [])
+            with self.assertRaises(Exception):
+                other.query()
+        finally:
+            other.close()
+
+    def test_tampered_record(self):
+        with open(self.messenger.archive_file, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0x01]))
+        self.assertEqual(self._messages(limit=1, sender="Lucia"), [MESSAGES[2][3]])
+        with self.assertRaises(Exception):
+            self._messages(since="2026-03-01")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test dell'armatura ASCII in flusso (python -m pytest -q)"""
+
+import io
+import os
+import tempfile
+import unittest
+
+import cryptomessage_armor
+from cryptomessage_core import CryptoMessenger
+
+
+class _Unbuffered:
+    """Sorgente con solo read(), come un socket o un file raw"""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+
+class ArmorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.messenger = CryptoMessenger(data_dir=cls.home.name)
+        cls.messenger.create_account("password", key_type='x25519')
+        cls.plaintext = os.urandom(300 * 1024)
+        armored = io.BytesIO()
+        cls.messenger.encrypt_stream('Me', io.BytesIO(cls.plaintext), armored, sign=True, armored=True)
+        cls.armored = armored.getvalue()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def _decrypt(self, src):
+        out = io.BytesIO()
+        header, total = self.messenger.decrypt_stream(src, out)
+        self.assertEqual(out.getvalue(), self.plaintext)
+        self.assertEqual(total, len(self.plaintext))
+        self.assertTrue(header['signature_valid'])
+
+    def test_armored_bytesio(self):
+        self.assertTrue(self.armored.startswith(cryptomessage_armor.BEGIN))
+        self._decrypt(io.BytesIO(self.armored))
+
+    def test_armored_without_peek(self):
+        self._decrypt(_Unbuffered(self.armored))
+
+    def test_armored_buffered(self):
+        self._decrypt(io.BufferedReader(io.BytesIO(self.armored)))
+
+    def test_binary_bytesio(self):
+        binary = io.BytesIO()
+        self.messenger.encrypt_stream('Me', io.BytesIO(self.plaintext), binary, sign=True)
+        self._decrypt(io.BytesIO(binary.getvalue()))
+
+    def test_corrupted_armor(self):
+        damaged = bytearray(self.armored)
+        damaged[len(cryptomessage_armor.BEGIN) + 10] ^= 0x01
+        with self.assertRaises(ValueError):
+            self.messenger.decrypt_stream(io.BytesIO(bytes(damaged)), io.BytesIO())
+
+
+if __name__ == '__main__':
+    unittest.main()
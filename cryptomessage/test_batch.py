@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test di decrypt --batch con il pool di processi (python -m pytest -q)"""
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import cryptomessage_agent
+from cryptomessage_cli import CryptoMessengerCLI
+
+
+@unittest.skipUnless(cryptomessage_agent.is_supported(), "socket Unix non disponibili")
+class DecryptBatchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.messenger = CryptoMessengerCLI(data_dir=cls.home.name)
+        cls.messenger.create_account("password", key_type='rsa')
+        cls.messenger.unlock("password", use_agent=False)
+        cls.packets = [cls.messenger.encrypt('Me', f"messaggio {i}")['encoded'] for i in range(12)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def _batch(self, lines):
+        cli = CryptoMessengerCLI(data_dir=self.home.name)
+        output = io.StringIO()
+        with contextlib.redirect_stderr(io.StringIO()):
+            ok = cli.decrypt_batch(io.StringIO("\n".join(lines) + "\n"), output, jobs=2, password="password")
+        return ok, [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_round_trip_in_order(self):
+        before = set(os.listdir(tempfile.gettempdir()))
+        ok, results = self._batch(self.packets)
+        self.assertTrue(ok)
+        self.assertEqual([r['message'] for r in results], [f"messaggio {i}" for i in range(12)])
+        self.assertTrue(all(r['signature_valid'] for r in results))
+        # La cartella del socket dell'agente temporaneo viene rimossa
+        self.assertEqual(set(os.listdir(tempfile.gettempdir())) - before, set())
+
+    def test_damaged_line(self):
+        # Pacchetto troncato: manca parte del testo cifrato e del tag
+        ok, results = self._batch([self.packets[0], self.packets[1][:-8], self.packets[2]])
+        self.assertFalse(ok)
+        self.assertEqual([r['ok'] for r in results], [True, False, True])
+        self.assertEqual([r['index'] for r in results], [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test della creazione in parallelo di identità e del pacchetto contatti (python -m pytest -q)"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import cryptomessage_bulk
+from cryptomessage_core import CryptoMessenger, InvalidKeyError, NotForThisKeyError
+
+
+class BulkSetupTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.out_dir = os.path.join(cls.home.name, "staging")
+        cls.progress = []
+        cls.entries = cryptomessage_bulk.provision(
+            3, cls.out_dir, "password", key_type='x25519', prefix="utente", jobs=2,
+            progress=lambda done, total: cls.progress.append((done, total))
+        )
+        with open(os.path.join(cls.out_dir, cryptomessage_bulk.BUNDLE_NAME)) as f:
+            cls.bundle = f.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def _identity(self, name, import_bundle=True):
+        messenger = CryptoMessenger(data_dir=os.path.join(self.out_dir, name))
+        messenger.unlock("password", use_agent=False)
+        if import_bundle:
+            messenger.import_contacts(self.bundle)
+        return messenger
+
+    def _tampered(self, index, field, value):
+        data = json.loads(self.bundle)
+        data['contacts'][index][field] = value
+        return json.dumps(data)
+
+    def test_identities_created(self):
+        self.assertEqual([e['name'] for e in self.entries], ["utente1", "utente2", "utente3"])
+        self.assertEqual(self.progress[-1], (3, 3))
+        for entry in self.entries:
+            messenger = self._identity(entry['name'], import_bundle=False)
+            self.assertEqual(messenger.public_key_pem().decode('ascii'), entry['public_key'])
+            self.assertTrue(os.path.exists(os.path.join(self.out_dir, entry['name'], entry['name'] + ".pem")))
+
+    def test_import_and_round_trip(self):
+        with tempfile.TemporaryDirectory() as scratch:
+            # Account nuovo: tre contatti aggiunti, poi tutti già presenti
+            messenger = CryptoMessenger(data_dir=scratch)
+            messenger.create_account("password", key_type='x25519')
+            result = messenger.import_contacts(self.bundle)
+            self.assertEqual(result, {'added': ["utente1", "utente2", "utente3"], 'replaced': [], 'skipped': []})
+            result = messenger.import_contacts(self.bundle)
+            self.assertEqual(result['skipped'], ["utente1", "utente2", "utente3"])
+
+        sender = self._identity("utente1")
+        receiver = self._identity("utente2")
+        self.assertNotIn("utente1", sender.contacts)  # la propria chiave viene saltata
+        opened = receiver.decrypt(sender.encrypt("utente2", "ciao staging")['encoded'], use_cache=False)
+        self.assertEqual(opened['message'], "ciao staging")
+        self.assertEqual(opened['sender'], "utente1")
+        self.assertTrue(opened['signature_valid'])
+        with self.assertRaises(NotForThisKeyError):
+            self._identity("utente3").decrypt(sender.encrypt("utente2", "per utente2")['encoded'], use_cache=False)
+
+    def test_tampered_bundle(self):
+        public_pem = self.entries[1]['public_key']
+        middle = len(public_pem) // 2
+        altered = public_pem[:middle] + ("A" if public_pem[middle] != "A" else "B") + public_pem[middle + 1:]
+        with tempfile.TemporaryDirectory() as scratch:
+            messenger = CryptoMessenger(data_dir=scratch)
+            messenger.create_account("password", key_type='x25519')
+            for text in (self._tampered(1, 'public_key', altered),
+                         self._tampered(1, 'fingerprint', self.entries[0]['fingerprint']),
+                         "non json"):
+                with self.assertRaises(InvalidKeyError):
+                    messenger.import_contacts(text)
+            # Nessun contatto importato, neanche quelli validi prima dell'errore
+            self.assertEqual(messenger.contact_list(), [])
+
+    def test_refuses_existing_out_dir(self):
+        with self.assertRaises(FileExistsError):
+            cryptomessage_bulk.provision(3, self.out_dir, "password", key_type='x25519', jobs=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test della cache di decifratura condivisa (python -m pytest -q)"""
+
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import cryptomessage_cache
+
+KEY = b"k" * 32
+INDEX_KEY = b"i" * 32
+PER_PROCESS = 50
+
+
+def _result(text):
+    return {'message': text, 'signature_valid': None}
+
+
+def _fill(path, prefix):
+    cache = cryptomessage_cache.DecryptCache(path, KEY, INDEX_KEY).open()
+    try:
+        for i in range(PER_PROCESS):
+            cache.put(cache.digest(f"{prefix}-{i}"), _result(f"{prefix} {i}"))
+    finally:
+        cache.close()
+
+
+class DecryptCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.home.name, "cryptomessenger_cache.db")
+
+    def tearDown(self):
+        self.home.cleanup()
+
+    def _open(self, **settings):
+        return cryptomessage_cache.DecryptCache(self.path, KEY, INDEX_KEY, **settings).open()
+
+    def test_round_trip(self):
+        cache = self._open()
+        digest = cache.digest("pacchetto")
+        cache.put(digest, _result("ciao"), "impronta")
+        self.assertEqual(cache.get(digest), {'result': _result("ciao"), 'signer_fingerprint': "impronta"})
+        self.assertIsNone(cache.get(cache.digest("altro")))
+        cache.close()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_wrong_key_is_a_miss(self):
+        cache = self._open()
+        digest = cache.digest("pacchetto")
+        cache.put(digest, _result("ciao"))
+        cache.close()
+        other = cryptomessage_cache.DecryptCache(self.path, b"x" * 32, INDEX_KEY).open()
+        self.assertIsNone(other.get(digest))
+        self.assertEqual(len(other), 0)
+        other.close()
+
+    def test_evicts_least_recently_used(self):
+        cache = self._open(max_entries=3)
+        digests = [cache.digest(str(i)) for i in range(4)]
+        for digest in digests[:3]:
+            cache.put(digest, _result("x"))
+        cache.get(digests[0])
+        cache.put(digests[3], _result("x"))
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get(digests[1]))
+        self.assertIsNotNone(cache.get(digests[0]))
+        cache.close()
+
+    def test_concurrent_processes_keep_all_entries(self):
+        self._open().close()
+        workers = [multiprocessing.Process(target=_fill, args=(self.path, f"p{n}")) for n in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        cache = self._open()
+        self.assertEqual(len(cache), 4 * PER_PROCESS)
+        self.assertEqual(cache.get(cache.digest("p3-7"))['result']['message'], "p3 7")
+        cache.close()
+
+    def test_clear_is_seen_by_open_connections(self):
+        cache = self._open()
+        digest = cache.digest("pacchetto")
+        cache.put(digest, _result("ciao"))
+        cryptomessage_cache.clear(self.path)
+        self.assertIsNone(cache.get(digest))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
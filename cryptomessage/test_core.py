@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test dell'API in-process e delle eccezioni tipizzate (python -m pytest -q)"""
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from cryptomessage_core import (
+    CryptoMessenger, AccountNotConfiguredError, PasswordRequiredError, WrongPasswordError,
+    InvalidKeyError, ContactNotFoundError, ContactExistsError, GroupNotFoundError,
+    InvalidPacketError, NotForThisKeyError, DecryptionError,
+)
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+class CoreApiTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.alice = _account(os.path.join(cls.home.name, "alice"))
+        cls.bob = _account(os.path.join(cls.home.name, "bob"))
+        cls.alice.add_contact_key("Bob", cls.bob.public_key_pem())
+        cls.bob.add_contact_key("Alice", cls.alice.public_key_pem())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def test_round_trip_is_silent(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            sent = self.alice.encrypt("Bob", "ciao in-process")
+            received = self.bob.decrypt(sent['encoded'], use_cache=False)
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual(received['message'], "ciao in-process")
+        self.assertEqual(received['sender'], "Alice")
+        self.assertTrue(received['signed'])
+        self.assertTrue(received['signature_valid'])
+
+    def test_fresh_instance_unlocks_with_password(self):
+        messenger = CryptoMessenger(data_dir=os.path.join(self.home.name, "bob"))
+        with self.assertRaises(PasswordRequiredError):
+            messenger.unlock(use_agent=False)
+        with self.assertRaises(WrongPasswordError):
+            messenger.unlock("sbagliata", use_agent=False)
+        messenger.unlock("password", use_agent=False)
+        received = messenger.decrypt(self.alice.encrypt("Bob", "ciao")['encoded'], use_cache=False)
+        self.assertEqual(received['message'], "ciao")
+
+    def test_no_account(self):
+        with tempfile.TemporaryDirectory() as home:
+            with self.assertRaises(AccountNotConfiguredError):
+                CryptoMessenger(data_dir=home).unlock("password", use_agent=False)
+
+    def test_contact_errors(self):
+        with self.assertRaises(ContactNotFoundError):
+            self.alice.encrypt("Sconosciuto", "ciao")
+        with self.assertRaises(ContactExistsError):
+            self.alice.add_contact_key("Bob", self.bob.public_key_pem())
+        with self.assertRaises(InvalidKeyError):
+            self.alice.add_contact_key("Rotta", b"-----BEGIN PUBLIC KEY-----\nxx\n-----END PUBLIC KEY-----\n")
+        with self.assertRaises(GroupNotFoundError):
+            self.alice.resolve_recipients(group="inesistente")
+
+    def test_packet_errors(self):
+        with self.assertRaises(InvalidPacketError):
+            self.bob.decrypt("non è un pacchetto", use_cache=False)
+        with self.assertRaises(NotForThisKeyError):
+            self.alice.decrypt(self.alice.encrypt("Bob", "per Bob")['encoded'], use_cache=False)
+
+        packet = dict(self.alice.encrypt("Bob", "ciao")['packet'])
+        data = bytearray(packet['data'])
+        data[-1] ^= 0x01
+        packet['data'] = bytes(data)
+        with self.assertRaises(DecryptionError):
+            self.bob.decrypt(self.alice.encode_packet(packet), use_cache=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
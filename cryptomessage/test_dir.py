@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test della cifratura di cartelle (tar cifrato a blocchi) (python -m pytest -q)"""
+
+import io
+import os
+import tempfile
+import unittest
+
+from cryptomessage_core import (
+    CryptoMessenger, CryptoMessengerError, DecryptionError, InvalidPacketError, NotForThisKeyError,
+)
+
+CHUNK = 4096
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+def _tree(directory):
+    """Contenuto della cartella come {percorso relativo: byte} (None per le cartelle)"""
+    files = {}
+    for root, dirs, names in os.walk(directory):
+        for name in dirs:
+            files[os.path.relpath(os.path.join(root, name), directory)] = None
+        for name in names:
+            with open(os.path.join(root, name), 'rb') as f:
+                files[os.path.relpath(os.path.join(root, name), directory)] = f.read()
+    return files
+
+
+class EncryptDirTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.alice = _account(os.path.join(cls.home.name, "alice"))
+        cls.bob = _account(os.path.join(cls.home.name, "bob"), 'x25519')
+        cls.carol = _account(os.path.join(cls.home.name, "carol"))
+        cls.alice.add_contact_key("Bob", cls.bob.public_key_pem())
+        cls.bob.add_contact_key("Alice", cls.alice.public_key_pem())
+
+        cls.source = os.path.join(cls.home.name, "progetto")
+        os.makedirs(os.path.join(cls.source, "docs", "vuota"))
+        for name, data in (("leggimi.txt", b"ciao"), ("dati.bin", os.urandom(5 * CHUNK + 11)),
+                           (os.path.join("docs", "note.md"), b"")):
+            with open(os.path.join(cls.source, name), 'wb') as f:
+                f.write(data)
+        cls.encrypted = cls._encrypt(sign=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    @classmethod
+    def _encrypt(cls, sign=False):
+        output = io.BytesIO()
+        cls.alice.encrypt_dir("Bob", cls.source, output, chunk_size=CHUNK, sign=sign, jobs=2)
+        return output.getvalue()
+
+    def _out_dir(self):
+        return tempfile.mkdtemp(dir=self.home.name)
+
+    def test_round_trip(self):
+        out_dir = self._out_dir()
+        header, names = self.bob.decrypt_dir(io.BytesIO(self.encrypted), out_dir, jobs=2)
+        self.assertEqual(names, ["progetto"])
+        self.assertTrue(header['signature_valid'])
+        self.assertEqual(header['sender'], "Alice")
+        self.assertEqual(_tree(os.path.join(out_dir, "progetto")), _tree(self.source))
+        self.assertEqual(os.listdir(out_dir), ["progetto"])
+
+    def test_tampered_archive(self):
+        altered = bytearray(self.encrypted)
+        altered[len(altered) // 2] ^= 0x01
+        for damaged in (bytes(altered), self.encrypted[:-CHUNK]):
+            out_dir = self._out_dir()
+            with self.assertRaises(DecryptionError):
+                self.bob.decrypt_dir(io.BytesIO(damaged), out_dir)
+            # Nulla estratto, nessuna cartella temporanea rimasta
+            self.assertEqual(os.listdir(out_dir), [])
+
+    def test_wrong_key(self):
+        with self.assertRaises(NotForThisKeyError):
+            self.carol.decrypt_dir(io.BytesIO(self.encrypted), self._out_dir())
+
+    def test_existing_target(self):
+        out_dir = self._out_dir()
+        os.mkdir(os.path.join(out_dir, "progetto"))
+        with self.assertRaises(CryptoMessengerError):
+            self.bob.decrypt_dir(io.BytesIO(self._encrypt()), out_dir)
+        self.assertEqual(os.listdir(out_dir), ["progetto"])
+        self.assertEqual(os.listdir(os.path.join(out_dir, "progetto")), [])
+
+    def test_plain_file_stream(self):
+        encrypted = io.BytesIO()
+        self.alice.encrypt_stream("Bob", io.BytesIO(b"non una cartella"), encrypted)
+        with self.assertRaises(InvalidPacketError):
+            self.bob.decrypt_dir(io.BytesIO(encrypted.getvalue()), self._out_dir())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test dei percorsi senza copie: file mappati in memoria e messaggi CBC (python -m pytest -q)"""
+
+import io
+import os
+import tempfile
+import unittest
+
+from cryptomessage_core import CryptoMessenger, CryptoMessengerError
+
+CHUNK = 4096
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+class MappedFileTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.alice = _account(os.path.join(cls.home.name, "alice"))
+        cls.bob = _account(os.path.join(cls.home.name, "bob"))
+        cls.alice.add_contact_key("Bob", cls.bob.public_key_pem())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def _path(self, name, data=None):
+        path = os.path.join(self.home.name, name)
+        if data is not None:
+            with open(path, 'wb') as f:
+                f.write(data)
+        return path
+
+    def _encrypt_file(self, source, target, offset=0):
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            src.seek(offset)
+            self.alice.encrypt_stream("Bob", src, dst, chunk_size=CHUNK)
+            # Dopo la cifratura il file è consumato come con una lettura normale
+            self.assertEqual(src.tell(), os.path.getsize(source))
+
+    def _decrypt_file(self, source, target):
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            self.bob.decrypt_stream(src, dst)
+        with open(target, 'rb') as f:
+            return f.read()
+
+    def test_mapped_file_matches_buffered(self):
+        for size in (1, CHUNK, 5 * CHUNK + 3):
+            data = os.urandom(size)
+            plain = self._path("dati.bin", data)
+            self._encrypt_file(plain, self._path("dati.cmsg"))
+            self.assertEqual(self._decrypt_file(self._path("dati.cmsg"), self._path("dati.out")), data)
+
+            # Stesso contenuto cifrato da un flusso in memoria (senza mmap)
+            buffered = io.BytesIO()
+            self.alice.encrypt_stream("Bob", io.BytesIO(data), buffered, chunk_size=CHUNK)
+            output = io.BytesIO()
+            self.bob.decrypt_stream(io.BytesIO(buffered.getvalue()), output)
+            self.assertEqual(output.getvalue(), data)
+
+    def test_mapped_file_from_offset(self):
+        data = os.urandom(3 * CHUNK)
+        self._encrypt_file(self._path("offset.bin", data), self._path("offset.cmsg"), offset=100)
+        self.assertEqual(self._decrypt_file(self._path("offset.cmsg"), self._path("offset.out")), data[100:])
+
+    def test_tampered_file(self):
+        data = os.urandom(3 * CHUNK)
+        encrypted = self._path("alterato.cmsg")
+        self._encrypt_file(self._path("alterato.bin", data), encrypted)
+        with open(encrypted, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0x01]))
+        with self.assertRaises(CryptoMessengerError):
+            self._decrypt_file(encrypted, self._path("alterato.out"))
+        # Solo i blocchi con tag verificato arrivano nell'output
+        with open(self._path("alterato.out"), 'rb') as f:
+            written = f.read()
+        self.assertLess(len(written), len(data))
+        self.assertEqual(written, data[:len(written)])
+
+
+class CbcMessageTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.messenger = _account(cls.home.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def test_padding_round_trip(self):
+        # Ogni resto modulo 16, compreso il blocco intero di solo padding
+        for size in (0, 1, 15, 16, 17, 31, 32, 1000):
+            message = "è" * (size // 2) + "x" * (size % 2)
+            result = self.messenger.encrypt("Me", message, cipher='AES-256-CBC')
+            self.assertEqual(len(result['packet']['data']) % 16, 0)
+            opened = self.messenger.decrypt(result['encoded'], use_cache=False)
+            self.assertEqual(opened['message'], message, size)
+            self.assertTrue(opened['signature_valid'])
+
+    def test_truncated_ciphertext(self):
+        packet = dict(self.messenger.encrypt("Me", "x" * 40, cipher='AES-256-CBC')['packet'])
+        packet['data'] = bytes(packet['data'])[:-5]
+        with self.assertRaises(CryptoMessengerError):
+            self.messenger.decrypt(self.messenger.encode_packet(packet), use_cache=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test della KDF calibrata e della lettura della chiave dalla GUI (python -m pytest -q)"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import cryptomessage_kdf
+from cryptomessage_core import CryptoMessenger
+
+# Costo simulato di una derivazione: lineare nel lavoro, niente orologio reale
+SCRYPT_SECONDS_PER_UNIT = 0.02 / (cryptomessage_kdf.MIN_SCRYPT_N * cryptomessage_kdf.SCRYPT_R)
+PBKDF2_SECONDS_PER_ITERATION = 0.02 / cryptomessage_kdf.MIN_PBKDF2_ITERATIONS
+TARGETS_MS = (10, 50, 100, 250, 500, 1000, 4000)
+
+
+def _fake_measure(kdf, runs=2):
+    if kdf['name'] == 'scrypt':
+        return kdf['n'] * kdf['r'] * kdf['p'] * SCRYPT_SECONDS_PER_UNIT
+    return kdf['iterations'] * PBKDF2_SECONDS_PER_ITERATION
+
+
+def _work(kdf):
+    if kdf['name'] == 'scrypt':
+        return kdf['n'] * kdf['r'] * kdf['p']
+    return kdf['iterations']
+
+
+@mock.patch.object(cryptomessage_kdf, 'measure', _fake_measure)
+class CalibrateTest(unittest.TestCase):
+
+    def _check(self, name):
+        results = [cryptomessage_kdf.calibrate(name, target) for target in TARGETS_MS]
+        work = [_work(kdf) for kdf in results]
+        # Il costo scelto cresce con l'obiettivo (mai sotto i minimi)
+        self.assertEqual(work, sorted(work))
+        self.assertLess(work[0], work[-1])
+        for target, kdf in zip(TARGETS_MS, results):
+            self.assertEqual(kdf['target_ms'], target)
+            minimum = round(_fake_measure(cryptomessage_kdf.calibrate(name, 1)) * 1000)
+            if target >= minimum:
+                self.assertGreaterEqual(kdf['measured_ms'], target / 2, kdf)
+                self.assertLessEqual(kdf['measured_ms'], target * 2, kdf)
+
+    def test_scrypt_grows_with_target(self):
+        self._check('scrypt')
+
+    def test_pbkdf2_grows_with_target(self):
+        self._check('pbkdf2')
+
+    def test_scrypt_memory_capped(self):
+        kdf = cryptomessage_kdf.calibrate('scrypt', 10 ** 6)
+        self.assertEqual(kdf['n'], cryptomessage_kdf.MAX_SCRYPT_N)
+        self.assertGreater(kdf['p'], 1)
+
+    def test_round_trip(self):
+        kdf = {'name': 'pbkdf2', 'iterations': cryptomessage_kdf.MIN_PBKDF2_ITERATIONS}
+        blob, kdf = cryptomessage_kdf.encrypt_private_key(b"chiave", b"password", kdf)
+        self.assertEqual(cryptomessage_kdf.decrypt_private_key(blob, b"password", kdf), b"chiave")
+        with self.assertRaises(Exception):
+            cryptomessage_kdf.decrypt_private_key(blob, b"sbagliata", kdf)
+
+
+class GuiConfigTest(unittest.TestCase):
+    """La GUI legge la configurazione che la CLI ha cifrato con KDF calibrata, nella stessa cartella dati"""
+
+    def test_gui_reads_kdf_config(self):
+        try:
+            import cryptomessage
+        except ImportError as e:
+            self.skipTest(f"GUI non disponibile: {e}")
+
+        with tempfile.TemporaryDirectory() as home, mock.patch.dict(os.environ, {"CRYPTOMESSENGER_HOME": home}):
+            messenger = CryptoMessenger()
+            messenger.create_account("password", key_type='rsa', kdf='pbkdf2', unlock_ms=50)
+            with open(messenger.config_file) as f:
+                self.assertEqual(json.load(f)['kdf']['name'], 'pbkdf2')
+
+            # Finestra senza Tk: interessa solo dove la GUI cerca i file
+            with mock.patch.object(cryptomessage.CryptoMessengerPro, 'setup_ui'), \
+                    mock.patch.object(cryptomessage.CryptoMessengerPro, 'show_welcome_tutorial') as welcome:
+                gui = cryptomessage.CryptoMessengerPro(mock.MagicMock())
+            self.assertFalse(welcome.called)
+            self.assertEqual(gui.config_file, messenger.config_file)
+
+            private_key = gui._read_private_key("password")
+            self.assertEqual(
+                messenger.get_key_id_from_key(private_key.public_key()),
+                messenger.get_key_id(messenger.public_key_b64)
+            )
+            with self.assertRaises(Exception):
+                gui._read_private_key("sbagliata")
+            gui.contacts.close()
+            gui._executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
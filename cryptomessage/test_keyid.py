@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test dei key id nei pacchetti e delle chiavi ritirate (python -m pytest -q)"""
+
+import io
+import os
+import tempfile
+import unittest
+
+from cryptomessage_core import (
+    CryptoMessenger, NotForThisKeyError, RetiredKeyLockedError, WrongPasswordError,
+)
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+class KeyIdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.bob_home = os.path.join(self.home.name, "bob")
+        self.alice = _account(os.path.join(self.home.name, "alice"))
+        self.bob = _account(self.bob_home)
+        self.carol = _account(os.path.join(self.home.name, "carol"))
+        self.alice.add_contact_key("Bob", self.bob.public_key_pem())
+        self.bob.add_contact_key("Alice", self.alice.public_key_pem())
+        self.old_kid = self.bob.get_key_id(self.bob.public_key_b64)
+
+    def tearDown(self):
+        self.home.cleanup()
+
+    def _rotate_bob(self):
+        """Nuova chiave per Bob (con un'altra password): la vecchia viene ritirata"""
+        self.bob.create_account("nuova")
+        self.assertIn(self.old_kid, self.bob.retired_keys)
+        self.alice.add_contact_key("Bob", self.bob.public_key_pem(), replace=True)
+
+    def test_packet_carries_key_ids(self):
+        packet = self.alice.encrypt("Bob", "ciao")['packet']
+        self.assertEqual(packet['recipients'][0]['kid'], self.old_kid)
+        self.assertEqual(packet['signer_kid'], self.alice.get_key_id(self.alice.public_key_b64))
+        self.assertEqual(self.bob.find_signer(packet['signer_kid'])[0], "Alice")
+
+    def test_decrypt_with_retired_key(self):
+        old = self.alice.encrypt("Bob", "prima della rotazione")['encoded']
+        self._rotate_bob()
+        new = self.alice.encrypt("Bob", "dopo la rotazione")['encoded']
+
+        # Nuova istanza: la chiave ritirata arriva dalla configurazione
+        bob = CryptoMessenger(data_dir=self.bob_home)
+        bob.unlock("nuova", use_agent=False)
+        self.assertEqual(bob.decrypt(new, use_cache=False)['message'], "dopo la rotazione")
+        with self.assertRaises(RetiredKeyLockedError) as caught:
+            bob.decrypt(old, use_cache=False)
+        self.assertEqual(caught.exception.kid, self.old_kid)
+        with self.assertRaises(WrongPasswordError):
+            bob.unlock_retired(self.old_kid, "nuova")
+
+        bob.unlock_retired(self.old_kid, "password")
+        opened = bob.decrypt(old, use_cache=False)
+        self.assertEqual(opened['message'], "prima della rotazione")
+        self.assertEqual(opened['sender'], "Alice")
+        self.assertTrue(opened['signature_valid'])
+
+    def test_stream_with_retired_key(self):
+        encrypted = io.BytesIO()
+        self.alice.encrypt_stream("Bob", io.BytesIO(b"file vecchio"), encrypted)
+        self._rotate_bob()
+        asked = []
+
+        def unlock(kid):
+            asked.append(kid)
+            self.bob.unlock_retired(kid, "password")
+            return True
+
+        output = io.BytesIO()
+        self.bob.decrypt_stream(io.BytesIO(encrypted.getvalue()), output, unlock_retired=unlock)
+        self.assertEqual(output.getvalue(), b"file vecchio")
+        self.assertEqual(asked, [self.old_kid])
+
+    def test_wrong_key(self):
+        encoded = self.alice.encrypt("Bob", "per Bob")['encoded']
+        with self.assertRaises(NotForThisKeyError):
+            self.carol.decrypt(encoded, use_cache=False)
+
+        # Key id alterato: nessuna chiave corrispondente, nessun tentativo
+        packet = dict(self.alice.encrypt("Bob", "per Bob")['packet'])
+        packet['recipients'] = [dict(packet['recipients'][0], kid="0" * 16)]
+        with self.assertRaises(NotForThisKeyError):
+            self.bob.decrypt(self.alice.encode_packet(packet), use_cache=False)
+
+    def test_tampered_signer_kid(self):
+        packet = dict(self.alice.encrypt("Bob", "ciao")['packet'])
+        packet['signer_kid'] = self.carol.get_key_id(self.carol.public_key_b64)
+        self.bob.add_contact_key("Carol", self.carol.public_key_pem())
+        opened = self.bob.decrypt(self.alice.encode_packet(packet), use_cache=False)
+        self.assertFalse(opened['signature_valid'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test delle chiavi x25519/Ed25519 e delle rubriche miste (python -m pytest -q)"""
+
+import os
+import tempfile
+import unittest
+
+import cryptomessage_keys
+from cryptomessage_core import CryptoMessenger, CryptoMessengerError, NotForThisKeyError
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+class X25519Test(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.alice = _account(os.path.join(cls.home.name, "alice"), 'x25519')
+        cls.bob = _account(os.path.join(cls.home.name, "bob"), 'x25519')
+        cls.rita = _account(os.path.join(cls.home.name, "rita"))
+        cls.carol = _account(os.path.join(cls.home.name, "carol"), 'x25519')
+        for name, other in (("Bob", cls.bob), ("Rita", cls.rita)):
+            cls.alice.add_contact_key(name, other.public_key_pem())
+            other.add_contact_key("Alice", cls.alice.public_key_pem())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def _tampered(self, recipient, field, index):
+        packet = dict(self.alice.encrypt(recipient, "ciao")['packet'])
+        if field == 'aes_key':
+            entry = dict(packet['recipients'][0])
+            value = bytearray(entry['aes_key'])
+            value[index] ^= 0x01
+            entry['aes_key'] = bytes(value)
+            packet['recipients'] = [entry]
+        else:
+            value = bytearray(packet[field])
+            value[index] ^= 0x01
+            packet[field] = bytes(value)
+        return self.alice.encode_packet(packet)
+
+    def test_key_type_recorded(self):
+        self.assertEqual(cryptomessage_keys.detect_key_type(self.alice.public_key_pem()), 'x25519')
+        types = {c['name']: c['key_type'] for c in self.alice.contact_list()}
+        self.assertEqual(types, {"Bob": 'x25519', "Rita": 'rsa'})
+        packet = self.alice.encrypt("Bob", "ciao")['packet']
+        self.assertEqual(packet['recipients'][0]['key_type'], 'x25519')
+
+    def test_round_trip_mixed_keyring(self):
+        for reader, sender_name in ((self.bob, "Bob"), (self.rita, "Rita")):
+            encoded = self.alice.encrypt(sender_name, "ciao ed25519")['encoded']
+            opened = reader.decrypt(encoded, use_cache=False)
+            self.assertEqual(opened['message'], "ciao ed25519")
+            self.assertEqual(opened['sender'], "Alice")
+            self.assertTrue(opened['signature_valid'])
+        # Risposta da RSA a x25519
+        opened = self.alice.decrypt(self.rita.encrypt("Alice", "risposta")['encoded'], use_cache=False)
+        self.assertEqual(opened['message'], "risposta")
+        self.assertTrue(opened['signature_valid'])
+
+    def test_tampered_signature(self):
+        opened = self.bob.decrypt(self._tampered("Bob", 'signature', 0), use_cache=False)
+        self.assertFalse(opened['signature_valid'])
+
+    def test_tampered_wrapped_key(self):
+        # Byte 40: dopo la chiave pubblica effimera, dentro la chiave AES avvolta
+        with self.assertRaises(CryptoMessengerError):
+            self.bob.decrypt(self._tampered("Bob", 'aes_key', 40), use_cache=False)
+
+    def test_wrong_key(self):
+        encoded = self.alice.encrypt("Bob", "per Bob")['encoded']
+        with self.assertRaises(NotForThisKeyError):
+            self.carol.decrypt(encoded, use_cache=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
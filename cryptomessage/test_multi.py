@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test dei pacchetti per più destinatari (python -m pytest -q)"""
+
+import os
+import tempfile
+import unittest
+
+from cryptomessage_core import (
+    CryptoMessenger, CryptoMessengerError, ContactNotFoundError, NotForThisKeyError,
+)
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+class MultiRecipientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.alice = _account(os.path.join(cls.home.name, "alice"))
+        cls.bob = _account(os.path.join(cls.home.name, "bob"))
+        cls.dave = _account(os.path.join(cls.home.name, "dave"), 'x25519')
+        cls.carol = _account(os.path.join(cls.home.name, "carol"))
+        for name, other in (("Bob", cls.bob), ("Dave", cls.dave)):
+            cls.alice.add_contact_key(name, other.public_key_pem())
+            other.add_contact_key("Alice", cls.alice.public_key_pem())
+        cls.alice.set_group("squadra", ["Bob", "Dave"])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def test_every_recipient_decrypts(self):
+        for fmt in ('v3', 'v2'):
+            result = self.alice.encrypt_multi(["Bob", "Dave", "Me"], "ciao a tutti", fmt=fmt)
+            self.assertEqual(len(result['packet']['recipients']), 3)
+            for reader in (self.bob, self.dave, self.alice):
+                opened = reader.decrypt(result['encoded'], use_cache=False)
+                self.assertEqual(opened['message'], "ciao a tutti")
+                self.assertTrue(opened['signature_valid'])
+
+    def test_group_resolution(self):
+        names = self.alice.resolve_recipients("Bob, Me", "squadra")
+        self.assertEqual(names, ["Bob", "Dave", "Me"])
+        with self.assertRaises(ContactNotFoundError):
+            self.alice.encrypt_multi(["Bob", "Sconosciuto"], "ciao")
+
+    def test_non_recipient_cannot_decrypt(self):
+        encoded = self.alice.encrypt_multi(["Bob", "Dave"], "riservato")['encoded']
+        with self.assertRaises(NotForThisKeyError):
+            self.carol.decrypt(encoded, use_cache=False)
+
+    def test_tampered_payload(self):
+        packet = dict(self.alice.encrypt_multi(["Bob", "Dave"], "ciao")['packet'])
+        data = bytearray(packet['data'])
+        data[0] ^= 0x01
+        packet['data'] = bytes(data)
+        with self.assertRaises(CryptoMessengerError):
+            self.bob.decrypt(self.alice.encode_packet(packet), use_cache=False)
+
+    def test_swapped_wrapped_key(self):
+        packet = dict(self.alice.encrypt_multi(["Bob", "Dave"], "ciao")['packet'])
+        other = self.alice.encrypt_multi(["Bob", "Dave"], "altro")['packet']
+        # Chiave di Bob presa da un altro pacchetto: non apre questo payload
+        packet['recipients'] = [other['recipients'][0]] + list(packet['recipients'][1:])
+        with self.assertRaises(CryptoMessengerError):
+            self.bob.decrypt(self.alice.encode_packet(packet), use_cache=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test della cartella dati condivisa da CLI e GUI (python -m pytest -q)"""
+
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import cryptomessage_paths
+from cryptomessage_core import CryptoMessenger
+
+
+class DataDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.home = os.path.join(self.root.name, "home")
+        self.legacy = os.path.join(self.root.name, "vecchia")
+        old = CryptoMessenger(data_dir=self.legacy)
+        old.create_account("password", key_type='x25519')
+        self.legacy_key = old.public_key_b64
+
+        cwd = os.getcwd()
+        os.chdir(self.legacy)
+        self.addCleanup(os.chdir, cwd)
+        patcher = mock.patch.dict(os.environ, {"CRYPTOMESSENGER_HOME": self.home})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_never_reads_current_directory(self):
+        messenger = CryptoMessenger()
+        self.assertEqual(messenger.data_dir, self.home)
+        self.assertIsNone(messenger.public_key_b64)
+        self.assertFalse(os.path.exists(os.path.join(self.home, "cryptomessenger_config.json")))
+
+    def test_explicit_migration_once(self):
+        messenger = CryptoMessenger()
+        copied = messenger.migrate_account(self.legacy)
+        self.assertIn("cryptomessenger_config.json", copied)
+        self.assertEqual(messenger.public_key_b64, self.legacy_key)
+        self.assertEqual(os.stat(messenger.config_file).st_mode & 0o777, 0o600)
+        # Una volta sola: l'account ora esiste
+        self.assertEqual(messenger.migrate_account(self.legacy), [])
+
+    def test_empty_source_copies_nothing(self):
+        empty = os.path.join(self.root.name, "vuota")
+        os.mkdir(empty)
+        self.assertEqual(CryptoMessenger().migrate_account(empty), [])
+
+    def test_gui_shares_contacts_with_cli(self):
+        try:
+            import cryptomessage
+        except ImportError as e:
+            self.skipTest(f"GUI non disponibile: {e}")
+
+        messenger = CryptoMessenger()
+        messenger.create_account("password", key_type='rsa')
+        messenger.add_contact_key("Mario", messenger.public_key_pem())
+        messenger.contacts.close()
+
+        data_dir = cryptomessage_paths.data_dir()
+        gui = types.SimpleNamespace(
+            contacts_file=os.path.join(data_dir, "cryptomessenger_contacts.db"),
+            legacy_contacts_file=os.path.join(data_dir, "cryptomessenger_contacts.json"),
+        )
+        cryptomessage.CryptoMessengerPro.load_contacts(gui)
+        self.assertEqual(gui.contacts.keys(), ["Mario"])
+        gui.contacts.remove("Mario")
+        gui.contacts.close()
+        self.assertEqual(len(CryptoMessenger().contacts), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test del server JSON-RPC (python -m pytest -q)"""
+
+import os
+import tempfile
+import threading
+import unittest
+
+import cryptomessage_agent
+import cryptomessage_server
+from cryptomessage_core import CryptoMessenger
+
+
+@unittest.skipUnless(cryptomessage_agent.is_supported(), "socket Unix non disponibili")
+class ServerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.messenger = CryptoMessenger(data_dir=cls.home.name)
+        cls.messenger.create_account("password", key_type='x25519')
+        cls.messenger.unlock("password", use_agent=False)
+        socket_path = os.path.join(cls.home.name, "rpc", "server.sock")
+        cls.server = cryptomessage_server.MessengerServer(cls.messenger, socket_path, jobs=2)
+        ready = threading.Event()
+        cls.thread = threading.Thread(target=cls.server.serve, args=(ready.set,), daemon=True)
+        cls.thread.start()
+        ready.wait(10)
+        cls.client = cryptomessage_server.RPCClient(socket_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            cls.client.call('shutdown')
+        except (cryptomessage_server.RPCError, ConnectionError):
+            pass
+        cls.client.close()
+        cls.thread.join(10)
+        cls.home.cleanup()
+
+    def _invalid_params(self, **params):
+        with self.assertRaises(cryptomessage_server.RPCError) as caught:
+            self.client.call('encrypt', message="ciao", **params)
+        self.assertEqual(caught.exception.code, cryptomessage_server.INVALID_PARAMS)
+
+    def test_round_trip(self):
+        for params in ({'recipient': 'Me'}, {'recipients': ['Me']}):
+            result = self.client.call('encrypt', message="ciao", **params)
+            self.assertEqual(result['recipients'], ['Me'])
+            opened = self.client.call('decrypt', packet=result['packet'])
+            self.assertEqual(opened['message'], "ciao")
+            self.assertTrue(opened['signature_valid'])
+
+    def test_damaged_packet(self):
+        packet = self.client.call('encrypt', message="ciao", recipient='Me')['packet']
+        with self.assertRaises(cryptomessage_server.RPCError) as caught:
+            self.client.call('decrypt', packet=packet[:-8])
+        self.assertNotEqual(caught.exception.code, cryptomessage_server.INTERNAL_ERROR)
+
+    def test_recipients_must_be_list_of_strings(self):
+        self._invalid_params(recipients="Me")
+        self._invalid_params(recipients=[1, 2])
+        self._invalid_params(recipients={'Me': 1})
+        self._invalid_params(recipient=["Me"])
+
+    def test_unknown_params(self):
+        self._invalid_params(recipient="Me", colore="blu")
+
+    def test_rejects_shared_socket_dir(self):
+        directory = os.path.join(self.home.name, "condivisa")
+        os.mkdir(directory)
+        os.chmod(directory, 0o777)
+        server = cryptomessage_server.MessengerServer(self.messenger, os.path.join(directory, "server.sock"))
+        with self.assertRaises(PermissionError):
+            server.serve()
+        with self.assertRaises(PermissionError):
+            cryptomessage_server.RPCClient(os.path.join(directory, "server.sock")).call('ping')
+
+
+if __name__ == '__main__':
+    unittest.main()
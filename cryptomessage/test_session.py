@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test delle chiavi di sessione salvate su disco (python -m pytest -q)"""
+
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import cryptomessage_session
+
+STORE_KEY = b"s" * 32
+PER_PROCESS = 30
+
+
+def _add_sessions(path, prefix):
+    for i in range(PER_PROCESS):
+        store = cryptomessage_session.SessionStore(path, STORE_KEY).load()
+        sid, key, _ = store.outgoing_session(f"{prefix}-{i}", "kid")
+        store.add_incoming(sid, key)
+        store.save()
+
+
+class SessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.home.name, "cryptomessenger_sessions.bin")
+
+    def tearDown(self):
+        self.home.cleanup()
+
+    def test_round_trip(self):
+        store = cryptomessage_session.SessionStore(self.path, STORE_KEY)
+        sid, key, is_new = store.outgoing_session("Mario", "kid")
+        self.assertTrue(is_new)
+        nonce, ciphertext = cryptomessage_session.encrypt(key, sid, b"ciao")
+        store.save()
+
+        loaded = cryptomessage_session.SessionStore(self.path, STORE_KEY).load()
+        self.assertEqual(loaded.outgoing_session("Mario", "kid")[:2], (sid, key))
+        loaded.add_incoming(sid, key)
+        self.assertEqual(cryptomessage_session.decrypt(loaded.incoming_key(sid), sid, nonce, ciphertext), b"ciao")
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_wrong_key_and_tamper(self):
+        store = cryptomessage_session.SessionStore(self.path, STORE_KEY)
+        sid, key, _ = store.outgoing_session("Mario", "kid")
+        store.save()
+        with self.assertRaises(Exception):
+            cryptomessage_session.SessionStore(self.path, b"x" * 32).load()
+        nonce, ciphertext = cryptomessage_session.encrypt(key, sid, b"ciao")
+        with self.assertRaises(Exception):
+            cryptomessage_session.decrypt(key, sid, nonce, ciphertext[:-1] + bytes([ciphertext[-1] ^ 1]))
+
+    def test_concurrent_saves_keep_all_sessions(self):
+        workers = [multiprocessing.Process(target=_add_sessions, args=(self.path, f"p{n}")) for n in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        store = cryptomessage_session.SessionStore(self.path, STORE_KEY).load()
+        self.assertEqual(len(store.outgoing), 4 * PER_PROCESS)
+        self.assertEqual(len(store.incoming), 4 * PER_PROCESS)
+        # Nessun file temporaneo rimasto nella cartella
+        self.assertEqual(sorted(os.listdir(self.home.name)),
+                         ["cryptomessenger_sessions.bin", "cryptomessenger_sessions.bin.lock"])
+
+
+if __name__ == '__main__':
+    unittest.main()
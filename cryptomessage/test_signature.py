@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test delle firme in streaming e dei file .sig separati (python -m pytest -q)"""
+
+import base64
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import cryptomessage_signature
+from cryptomessage_core import CryptoMessenger, InvalidPacketError
+
+DATA = os.urandom(3 * cryptomessage_signature.CHUNK_SIZE + 17)
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+class DetachedSignatureTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.signers = {
+            key_type: _account(os.path.join(cls.home.name, key_type), key_type)
+            for key_type in ('rsa', 'x25519')
+        }
+        cls.bob = _account(os.path.join(cls.home.name, "bob"))
+        cls.carol = _account(os.path.join(cls.home.name, "carol"))
+        for key_type, signer in cls.signers.items():
+            cls.bob.add_contact_key(f"Alice-{key_type}", signer.public_key_pem())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def _sign(self, key_type, data=DATA):
+        return self.signers[key_type].sign_stream(io.BytesIO(data))
+
+    def test_round_trip(self):
+        for key_type in self.signers:
+            sig_text = self._sign(key_type)
+            info = json.loads(sig_text)
+            self.assertEqual(info['key_type'], key_type)
+            self.assertEqual(info['size'], len(DATA))
+            result = self.bob.verify_stream(io.BytesIO(DATA), sig_text)
+            self.assertTrue(result['valid'], key_type)
+            self.assertEqual(result['signer'], f"Alice-{key_type}")
+            self.assertEqual(result['size'], len(DATA))
+
+    def test_prehashed_matches_plain_rsa(self):
+        # La firma sul digest è una normale firma PSS dei dati interi
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        signer = self.signers['rsa']
+        signature = base64.b64decode(json.loads(self._sign('rsa'))['signature'])
+        pss = padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH)
+        signer.public_key.verify(signature, DATA, pss, hashes.SHA256())
+
+    def test_tampered_data(self):
+        for key_type in self.signers:
+            data = bytearray(DATA)
+            data[len(data) // 2] ^= 0x01
+            result = self.bob.verify_stream(io.BytesIO(bytes(data)), self._sign(key_type))
+            self.assertFalse(result['valid'], key_type)
+            self.assertEqual(result['signer'], f"Alice-{key_type}")
+
+    def test_tampered_signature(self):
+        for key_type in self.signers:
+            info = json.loads(self._sign(key_type))
+            signature = bytearray(base64.b64decode(info['signature']))
+            signature[0] ^= 0x01
+            info['signature'] = base64.b64encode(bytes(signature)).decode()
+            result = self.bob.verify_stream(io.BytesIO(DATA), json.dumps(info))
+            self.assertFalse(result['valid'], key_type)
+
+    def test_unknown_signer(self):
+        result = self.carol.verify_stream(io.BytesIO(DATA), self._sign('rsa'))
+        self.assertFalse(result['valid'])
+        self.assertIsNone(result['signer'])
+
+    def test_malformed_sig_file(self):
+        for text in ("non json", json.dumps({'version': 1})):
+            with self.assertRaises(InvalidPacketError):
+                self.bob.verify_stream(io.BytesIO(DATA), text)
+
+    def test_signature_of_encrypted_output(self):
+        # encrypt-file --detach-sign: digest calcolato mentre l'output viene scritto
+        signer = self.signers['rsa']
+        output = io.BytesIO()
+        writer = cryptomessage_signature.HashingWriter(output)
+        signer.encrypt_stream("Me", io.BytesIO(DATA), writer)
+        sig_text = signer.detached_signature(writer.digest(), writer.size)
+        result = self.bob.verify_stream(io.BytesIO(output.getvalue()), sig_text)
+        self.assertTrue(result['valid'])
+        self.assertEqual(result['size'], len(output.getvalue()))
+
+
+if __name__ == '__main__':
+    unittest.main()
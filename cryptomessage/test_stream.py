@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test del formato file cifrato a blocchi CMF1 (python -m pytest -q)"""
+
+import io
+import os
+import tempfile
+import unittest
+
+import cryptomessage_stream
+from cryptomessage_core import CryptoMessenger, CryptoMessengerError
+
+CHUNK = 4096
+
+
+def _account(home, key_type='rsa'):
+    messenger = CryptoMessenger(data_dir=home)
+    messenger.create_account("password", key_type=key_type)
+    messenger.unlock("password", use_agent=False)
+    return messenger
+
+
+class StreamTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.home = tempfile.TemporaryDirectory()
+        cls.alice = _account(os.path.join(cls.home.name, "alice"))
+        cls.bob = _account(os.path.join(cls.home.name, "bob"))
+        cls.carol = _account(os.path.join(cls.home.name, "carol"))
+        cls.alice.add_contact_key("Bob", cls.bob.public_key_pem())
+        cls.bob.add_contact_key("Alice", cls.alice.public_key_pem())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.home.cleanup()
+
+    def _encrypt(self, data, sign=False):
+        out = io.BytesIO()
+        self.alice.encrypt_stream("Bob", io.BytesIO(data), out, chunk_size=CHUNK, sign=sign)
+        return out.getvalue()
+
+    def _decrypt(self, messenger, encrypted):
+        out = io.BytesIO()
+        header, total = messenger.decrypt_stream(io.BytesIO(encrypted), out)
+        return header, total, out.getvalue()
+
+    def test_round_trip_sizes(self):
+        for size in (0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 3 * CHUNK + 5):
+            data = os.urandom(size)
+            encrypted = self._encrypt(data)
+            self.assertTrue(encrypted.startswith(cryptomessage_stream.MAGIC))
+            _, total, plaintext = self._decrypt(self.bob, encrypted)
+            self.assertEqual(plaintext, data, size)
+            self.assertEqual(total, size)
+
+    def test_signed_round_trip(self):
+        data = os.urandom(2 * CHUNK + 7)
+        header, _, plaintext = self._decrypt(self.bob, self._encrypt(data, sign=True))
+        self.assertEqual(plaintext, data)
+        self.assertTrue(header['signature_valid'])
+        self.assertEqual(header['sender'], "Alice")
+
+    def test_tampered_record(self):
+        encrypted = bytearray(self._encrypt(os.urandom(3 * CHUNK)))
+        encrypted[len(encrypted) // 2] ^= 0x01
+        with self.assertRaises(CryptoMessengerError):
+            self._decrypt(self.bob, bytes(encrypted))
+
+    def test_truncated_stream(self):
+        encrypted = self._encrypt(os.urandom(3 * CHUNK))
+        # Senza l'ultimo blocco (flag FLAG_LAST) il flusso è incompleto
+        with self.assertRaises(CryptoMessengerError):
+            self._decrypt(self.bob, encrypted[:-(CHUNK // 2)])
+
+    def test_wrong_recipient(self):
+        encrypted = self._encrypt(os.urandom(CHUNK))
+        with self.assertRaises(CryptoMessengerError):
+            self._decrypt(self.carol, encrypted)
+
+
+if __name__ == '__main__':
+    unittest.main()